@@ -0,0 +1,264 @@
+import io
+import os
+import abc
+import asyncio
+import logging
+import wave
+from typing import Callable, Dict, List, Optional, Tuple
+
+import numpy as np
+
+# Speech input for ChatStream. Clients either send a whole utterance (WAV or
+# raw PCM, as before) or stream 16-bit mono PCM chunks with format "pcm_stream".
+# Streamed audio goes through an energy VAD; as soon as the speaker has been
+# silent for ASR_ENDPOINT_SILENCE_MS the utterance is cut and handed to the
+# configured backend, without waiting for the client to close the recording.
+#
+# Backends:
+#   google  - speech_recognition's recognize_google (network, the old behaviour)
+#   sphinx  - speech_recognition's recognize_sphinx (offline, needs pocketsphinx)
+#   inline  - no transcription; the audio is attached to the Gemini turn as an
+#             inline part, which saves the separate ASR round-trip
+
+ASR_BACKEND = os.getenv("ASR_BACKEND", "google")
+ASR_DEFAULT_SAMPLE_RATE = 16000
+ASR_FRAME_MS = 30
+ASR_ENDPOINT_SILENCE_MS = int(os.getenv("ASR_ENDPOINT_SILENCE_MS", "600"))
+ASR_MIN_SPEECH_MS = int(os.getenv("ASR_MIN_SPEECH_MS", "200"))
+ASR_MAX_UTTERANCE_MS = int(os.getenv("ASR_MAX_UTTERANCE_MS", "15000"))
+# Audio kept from before the detected speech onset so the first syllable isn't clipped
+ASR_PRE_ROLL_MS = 200
+# Frame RMS (int16 scale) counted as speech; raised automatically above the noise floor
+ASR_ENERGY_THRESHOLD = float(os.getenv("ASR_ENERGY_THRESHOLD", "300"))
+
+GOOGLE_SPEECH_API_KEY = os.getenv("GOOGLE_SPEECH_API_KEY")
+
+STREAM_FORMAT = "pcm_stream"
+
+_stats = {"utterances": 0, "endpointed": 0, "flushed": 0, "transcribed": 0, "unintelligible": 0,
+          "failed": 0, "inline": 0}
+
+
+class UnintelligibleAudio(Exception):
+    pass
+
+
+def to_pcm(audio_bytes: bytes, sample_rate: int = 0) -> Tuple[bytes, int]:
+    """16-bit mono PCM and its sample rate, from a WAV file or raw PCM. Raises UnintelligibleAudio."""
+    if audio_bytes.startswith(b'RIFF') and b'WAVE' in audio_bytes[:12]:
+        try:
+            with wave.open(io.BytesIO(audio_bytes), 'rb') as wav_file:
+                pcm = wav_file.readframes(wav_file.getnframes())
+                rate = wav_file.getframerate()
+                if wav_file.getnchannels() > 1:
+                    samples = np.frombuffer(pcm, dtype="<i2").reshape(-1, wav_file.getnchannels())
+                    pcm = samples.mean(axis=1).astype("<i2").tobytes()
+                return pcm, rate
+        except (wave.Error, EOFError, ValueError) as e:  # truncated or not really a WAV file
+            raise UnintelligibleAudio() from e
+    return audio_bytes, sample_rate or ASR_DEFAULT_SAMPLE_RATE
+
+
+def to_wav(pcm: bytes, sample_rate: int) -> bytes:
+    out = io.BytesIO()
+    with wave.open(out, 'wb') as wav_file:
+        wav_file.setnchannels(1)
+        wav_file.setsampwidth(2)
+        wav_file.setframerate(sample_rate)
+        wav_file.writeframes(pcm)
+    return out.getvalue()
+
+
+class Endpointer:
+    """
+    Energy VAD over a stream of PCM chunks. feed() returns the utterances
+    completed by that chunk; flush() returns whatever speech is still buffered.
+    """
+
+    def __init__(self, sample_rate: int = ASR_DEFAULT_SAMPLE_RATE, threshold: float = ASR_ENERGY_THRESHOLD,
+                 silence_ms: int = ASR_ENDPOINT_SILENCE_MS, min_speech_ms: int = ASR_MIN_SPEECH_MS,
+                 max_utterance_ms: int = ASR_MAX_UTTERANCE_MS, pre_roll_ms: int = ASR_PRE_ROLL_MS):
+        self.sample_rate = sample_rate
+        self.frame_bytes = sample_rate * ASR_FRAME_MS // 1000 * 2
+        self.threshold = threshold
+        self.silence_frames = max(1, silence_ms // ASR_FRAME_MS)
+        self.min_speech_frames = max(1, min_speech_ms // ASR_FRAME_MS)
+        self.max_frames = max_utterance_ms // ASR_FRAME_MS
+        self.pre_roll_frames = pre_roll_ms // ASR_FRAME_MS
+        self.noise_floor: Optional[float] = None
+        self._pending = b""              # partial frame carried to the next chunk
+        self._frames: List[bytes] = []   # pre-roll while idle, the utterance while in speech
+        self._in_speech = False
+        self._speech_frames = 0
+        self._silent_run = 0
+
+    def _is_speech(self, frame: bytes) -> bool:
+        samples = np.frombuffer(frame, dtype="<i2").astype(np.float32)
+        rms = float(np.sqrt(np.mean(samples * samples)))
+        if self.noise_floor is None:
+            self.noise_floor = rms
+        threshold = max(self.threshold, 3.0 * self.noise_floor)
+        speech = rms > threshold
+        if not speech:
+            # slow tracking of background noise (traffic, wind)
+            self.noise_floor = 0.95 * self.noise_floor + 0.05 * rms
+        return speech
+
+    def _cut(self) -> Optional[bytes]:
+        frames, speech_frames = self._frames, self._speech_frames
+        # the endpoint silence itself is not worth uploading; keep a short tail
+        trailing = max(0, self._silent_run - self.pre_roll_frames)
+        if trailing:
+            frames = frames[:-trailing]
+        self._frames, self._in_speech, self._speech_frames, self._silent_run = [], False, 0, 0
+        if speech_frames < self.min_speech_frames:
+            return None  # a click or a bump, not speech
+        return b"".join(frames)
+
+    def feed(self, pcm: bytes) -> List[bytes]:
+        utterances = []
+        data = self._pending + pcm
+        usable = len(data) - len(data) % self.frame_bytes
+        self._pending = data[usable:]
+        for offset in range(0, usable, self.frame_bytes):
+            frame = data[offset:offset + self.frame_bytes]
+            speech = self._is_speech(frame)
+            self._frames.append(frame)
+            if not self._in_speech:
+                if speech:
+                    self._in_speech, self._speech_frames, self._silent_run = True, 1, 0
+                else:
+                    del self._frames[:-self.pre_roll_frames or len(self._frames)]
+                continue
+            if speech:
+                self._speech_frames += 1
+                self._silent_run = 0
+            else:
+                self._silent_run += 1
+            if self._silent_run >= self.silence_frames or len(self._frames) >= self.max_frames:
+                utterance = self._cut()
+                if utterance:
+                    _stats["endpointed"] += 1
+                    utterances.append(utterance)
+        return utterances
+
+    def flush(self) -> Optional[bytes]:
+        self._pending = b""
+        if not self._in_speech:
+            self._frames = []
+            return None
+        utterance = self._cut()
+        if utterance:
+            _stats["flushed"] += 1
+        return utterance
+
+
+class ASRBackend(abc.ABC):
+    name = "base"
+    # True when the audio should go to the model as-is instead of being transcribed
+    inline = False
+
+    @abc.abstractmethod
+    async def transcribe(self, pcm: bytes, sample_rate: int) -> Optional[str]:
+        """Transcript, or None if the service failed. Raises UnintelligibleAudio."""
+
+
+class _SpeechRecognitionBackend(ASRBackend):
+    def __init__(self):
+        import speech_recognition as sr
+        self.sr = sr
+        # One recognizer for the process; recognize_* keep no per-call state on it
+        self.recognizer = sr.Recognizer()
+
+    @abc.abstractmethod
+    def _recognize(self, audio_data) -> str:
+        """Runs the speech_recognition recognizer of the backend on `audio_data`."""
+
+    def _transcribe_sync(self, pcm: bytes, sample_rate: int) -> Optional[str]:
+        audio_data = self.sr.AudioData(pcm, sample_rate, 2)  # each sample is 2 bytes (16 bits)
+        try:
+            return self._recognize(audio_data)
+        except self.sr.UnknownValueError:
+            raise UnintelligibleAudio()
+        except self.sr.RequestError as e:
+            logging.error(f"Could not request results from the {self.name} speech service; {e}")
+            return None
+
+    async def transcribe(self, pcm: bytes, sample_rate: int) -> Optional[str]:
+        return await asyncio.to_thread(self._transcribe_sync, pcm, sample_rate)
+
+
+class GoogleBackend(_SpeechRecognitionBackend):
+    name = "google"
+
+    def _recognize(self, audio_data) -> str:
+        return self.recognizer.recognize_google(audio_data, key=GOOGLE_SPEECH_API_KEY)
+
+
+class SphinxBackend(_SpeechRecognitionBackend):
+    name = "sphinx"
+
+    def _recognize(self, audio_data) -> str:
+        return self.recognizer.recognize_sphinx(audio_data)
+
+
+class InlineBackend(ASRBackend):
+    name = "inline"
+    inline = True
+
+    async def transcribe(self, pcm: bytes, sample_rate: int) -> Optional[str]:
+        return None
+
+
+_factories: Dict[str, Callable[[], ASRBackend]] = {
+    "google": GoogleBackend,
+    "sphinx": SphinxBackend,
+    "inline": InlineBackend,
+}
+_backend: Optional[ASRBackend] = None
+
+
+def register_backend(name: str, factory: Callable[[], ASRBackend]) -> None:
+    _factories[name] = factory
+
+
+def get_backend() -> ASRBackend:
+    global _backend
+    if _backend is None:
+        if ASR_BACKEND not in _factories:
+            raise ValueError(f"Unknown ASR_BACKEND {ASR_BACKEND!r}, expected one of {sorted(_factories)}")
+        _backend = _factories[ASR_BACKEND]()
+        logging.info(f"ASR backend: {_backend.name}")
+    return _backend
+
+
+def set_backend(backend: ASRBackend) -> None:
+    global _backend
+    _backend = backend
+
+
+async def recognize(pcm: bytes, sample_rate: int) -> Tuple[Optional[str], Optional[bytes]]:
+    """
+    (text, inline_wav) for one utterance. With an inline backend the text is
+    None and the WAV bytes go to the model; otherwise inline_wav is None.
+    Raises UnintelligibleAudio.
+    """
+    backend = get_backend()
+    _stats["utterances"] += 1
+    if backend.inline:
+        _stats["inline"] += 1
+        return None, to_wav(pcm, sample_rate)
+    try:
+        text = await backend.transcribe(pcm, sample_rate)
+    except UnintelligibleAudio:
+        _stats["unintelligible"] += 1
+        raise
+    except Exception as e:
+        logging.error(f"An error occurred during audio transcription: {e}")
+        text = None
+    _stats["transcribed" if text else "failed"] += 1
+    return text, None
+
+
+def stats() -> Dict[str, int]:
+    return dict(_stats)
@@ -0,0 +1,96 @@
+"""Load benchmark for navigator.chatbot_conversation with a stubbed Gemini chat.
+
+Every session runs a few turns back to back while all sessions run concurrently.
+The stub model answers after a fixed latency, so with a non-blocking LLM path the
+p50/p99 turn latency should stay close to that latency as sessions grow.
+
+    python benchmarks/bench_llm_turns.py
+    python benchmarks/bench_llm_turns.py --blocking   # old synchronous send_message behaviour
+"""
+
+import argparse
+import asyncio
+import os
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark-key")  # never used, the chat is stubbed
+
+from google.genai import types as genai_types
+
+import navigator
+
+
+def _text_response(text: str) -> genai_types.GenerateContentResponse:
+    return genai_types.GenerateContentResponse(candidates=[
+        genai_types.Candidate(content=genai_types.Content(role="model", parts=[genai_types.Part(text=text)]))
+    ])
+
+
+class StubAsyncChat:
+    """Stands in for chats.AsyncChat and answers after a fixed model latency."""
+
+    def __init__(self, latency: float, blocking: bool):
+        self.latency = latency
+        self.blocking = blocking
+
+    async def send_message(self, message, config=None):
+        if self.blocking:
+            time.sleep(self.latency)  # what a synchronous client call does to the loop
+        else:
+            await asyncio.sleep(self.latency)
+        return _text_response("Continue straight for 50 meters.")
+
+
+async def _no_map(session_state, location_coords):
+    return None
+
+
+def _percentile(values, pct):
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, max(0, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
+
+
+async def run_load(sessions: int, turns: int, latency: float, blocking: bool) -> list:
+    latencies = []
+
+    async def run_session(index: int):
+        state = navigator.SessionState(session_id=f"bench-{index}")
+        state.chat = StubAsyncChat(latency, blocking)
+        navigator.set_current_location(state, {"lat": 24.9924, "lng": 121.4990, "heading": "north"})
+        for _ in range(turns):
+            start = time.perf_counter()
+            await navigator.chatbot_conversation(state, "Where am I?")
+            latencies.append(time.perf_counter() - start)
+
+    await asyncio.gather(*(run_session(i) for i in range(sessions)))
+    return latencies
+
+
+async def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sessions", type=int, nargs="+", default=[1, 10, 50, 100, 200])
+    parser.add_argument("--turns", type=int, default=3, help="turns per session")
+    parser.add_argument("--latency", type=float, default=0.2, help="stub model latency in seconds")
+    parser.add_argument("--blocking", action="store_true", help="simulate the old synchronous send_message")
+    args = parser.parse_args()
+
+    # Keep the benchmark about the LLM path: no Static Maps download, no per-turn prints.
+    navigator.get_static_map_image = _no_map
+    navigator.print = lambda *a, **k: None
+
+    print(f"stub latency {args.latency * 1000:.0f} ms, {args.turns} turns/session, "
+          f"{'blocking' if args.blocking else 'async'} send_message")
+    print(f"{'sessions':>8} {'turns':>6} {'p50 ms':>9} {'p99 ms':>9} {'wall s':>8}")
+    for sessions in args.sessions:
+        start = time.perf_counter()
+        latencies = await run_load(sessions, args.turns, args.latency, args.blocking)
+        wall = time.perf_counter() - start
+        print(f"{sessions:>8} {len(latencies):>6} {_percentile(latencies, 50) * 1000:>9.1f} "
+              f"{_percentile(latencies, 99) * 1000:>9.1f} {wall:>8.2f}")
+
+
+if __name__ == "__main__":
+    asyncio.run(main())
@@ -0,0 +1,104 @@
+"""Raw vs filtered GPS on a simulated walk: position error, outliers, tracking rate.
+
+A walker follows a synthetic route at --speed m/s while the phone reports --rate
+fixes per second with Gaussian noise and occasional multipath outliers. Every
+fix goes through location_filter.ingest the way server.py does it; the due
+ones run the step tracker and push guidance. The same walk fed raw, fix by
+fix, is the baseline.
+
+    python benchmarks/bench_location_filter.py --noise 6 --outliers 0.02
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark-key")  # never used, no model calls
+
+import deviation
+import location_filter
+import navigator
+import push_guidance
+from synthetic_routes import METERS_PER_DEGREE, make_route
+
+navigator.print = lambda *a, **k: None
+
+
+def simulate(compiled, speed, rate, noise, outliers, seed=3):
+    """(time, true lat/lng, reported lat/lng, reported heading) per fix."""
+    rng = random.Random(seed)
+    fixes, t = [], 0.0
+    while t * speed <= compiled.total_length:
+        lat, lng = compiled.segments.point_at_distance(t * speed)
+        ahead = compiled.segments.point_at_distance(t * speed + 1)
+        heading = math.degrees(math.atan2((ahead[1] - lng) * math.cos(math.radians(lat)), ahead[0] - lat)) % 360
+        north, east = rng.gauss(0, noise), rng.gauss(0, noise)
+        if rng.random() < outliers:
+            angle, jump = rng.uniform(0, 2 * math.pi), rng.uniform(80, 200)
+            north, east = north + jump * math.cos(angle), east + jump * math.sin(angle)
+        fixes.append((t, (lat, lng), (lat + north / METERS_PER_DEGREE,
+                                      lng + east / (METERS_PER_DEGREE * math.cos(math.radians(lat)))),
+                      (heading + rng.gauss(0, 15)) % 360))
+        t += 1.0 / rate
+    return fixes
+
+
+def _session(route):
+    state = navigator.SessionState("bench")
+    state.status = "Navigating"
+    state.current_route = route
+    state.compiled_route = deviation.CompiledRoute(route)
+    state.progress_tracker = deviation.RouteProgressTracker(state.compiled_route)
+    state.prefers_zh = False
+    return state
+
+
+def run(route, fixes, filtered):
+    state = _session(route)
+    errors, tracked, off_route, cost = [], 0, 0, 0.0
+    for t, (true_lat, true_lng), (lat, lng), heading in fixes:
+        start = time.perf_counter()
+        if filtered:
+            fix = location_filter.ingest(state, lat, lng, heading, now=t)
+        else:
+            fix = {"lat": lat, "lng": lng, "heading": heading}
+        if fix is not None:
+            navigator.set_current_location(state, fix)
+            text = push_guidance.on_location(state, now=t)
+            tracked += 1
+            off_route += bool(text and "off the route" in text)
+        cost += time.perf_counter() - start
+        if state.current_loc:
+            errors.append(deviation.haversine_distance(true_lat, true_lng,
+                                                       state.current_loc["lat"], state.current_loc["lng"]))
+    errors.sort()
+    rms = math.sqrt(sum(e * e for e in errors) / len(errors))
+    return rms, errors[int(len(errors) * 0.95)], errors[-1], tracked, off_route, cost / len(fixes) * 1e6
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--steps", type=int, default=20)
+    parser.add_argument("--step-meters", type=float, default=150)
+    parser.add_argument("--speed", type=float, default=1.3, help="walking speed, m/s")
+    parser.add_argument("--rate", type=float, default=5.0, help="fixes per second sent by the phone")
+    parser.add_argument("--noise", type=float, default=6.0, help="GPS noise sigma in meters")
+    parser.add_argument("--outliers", type=float, default=0.02, help="share of fixes that jump 80-200 m")
+    args = parser.parse_args()
+
+    route = make_route(args.steps, step_meters=args.step_meters)
+    fixes = simulate(deviation.CompiledRoute(route), args.speed, args.rate, args.noise, args.outliers)
+    print(f"{len(fixes)} fixes at {args.rate:g}/s, noise {args.noise:g} m, {args.outliers:.0%} outliers")
+    print(f"{'input':>9} {'rms m':>7} {'p95 m':>7} {'max m':>7} {'tracked':>8} {'off-route':>10} {'us/fix':>7}")
+    for name, filtered in (("raw", False), ("filtered", True)):
+        rms, p95, worst, tracked, off_route, us = run(route, fixes, filtered)
+        print(f"{name:>9} {rms:>7.1f} {p95:>7.1f} {worst:>7.1f} {tracked:>8} {off_route:>10} {us:>7.1f}")
+    print(location_filter.stats())
+
+
+if __name__ == "__main__":
+    main()
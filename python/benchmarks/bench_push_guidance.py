@@ -0,0 +1,92 @@
+"""Walks a synthetic route fix by fix and reports what push_guidance says and what each fix costs.
+
+The walker moves --speed meters per fix with Gaussian GPS noise and, halfway
+(in the middle step), steps --detour meters sideways off the route for --detour-fixes fixes
+before coming back. Timing covers navigator.set_current_location (tracker update)
+plus push_guidance.on_location, i.e. everything a location-only request does.
+
+    python benchmarks/bench_push_guidance.py --steps 10 --show
+"""
+
+import argparse
+import math
+import os
+import random
+import sys
+import time
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault("GEMINI_API_KEY", "benchmark-key")  # never used, no model calls
+
+import deviation
+import navigator
+import push_guidance
+from synthetic_routes import METERS_PER_DEGREE, make_route
+
+navigator.print = lambda *a, **k: None
+
+
+def walk(compiled, speed, noise, detour, detour_fixes, seed=2):
+    rng = random.Random(seed)
+    total = compiled.total_length
+    middle = len(compiled) // 2  # leave the route mid-step, away from corners
+    detour_start = int((compiled.step_start_offset[middle] + compiled.step_end_offset[middle]) / 2 / speed)
+    fixes = []
+    for i in range(int(total / speed) + 2 + detour_fixes):
+        lost = detour_start <= i < detour_start + detour_fixes
+        along = min(i, detour_start) * speed if lost else (i - (detour_fixes if i > detour_start else 0)) * speed
+        lat, lng = compiled.segments.point_at_distance(along)
+        north, east = rng.gauss(0, noise), rng.gauss(0, noise)
+        if lost:
+            # sideways, perpendicular to the route where the walker left it
+            ahead_lat, ahead_lng = compiled.segments.point_at_distance(along + 1)
+            dn = (ahead_lat - lat) * METERS_PER_DEGREE
+            de = (ahead_lng - lng) * METERS_PER_DEGREE * math.cos(math.radians(lat))
+            norm = math.hypot(dn, de) or 1.0
+            north, east = north - de / norm * detour, east + dn / norm * detour
+        fixes.append((lat + north / METERS_PER_DEGREE,
+                      lng + east / (METERS_PER_DEGREE * math.cos(math.radians(lat)))))
+    return fixes
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--steps", type=int, default=10)
+    parser.add_argument("--step-meters", type=float, default=80)
+    parser.add_argument("--speed", type=float, default=1.3, help="meters walked per fix")
+    parser.add_argument("--noise", type=float, default=4.0, help="GPS noise sigma in meters")
+    parser.add_argument("--detour", type=float, default=45.0, help="sideways offset of the detour in meters")
+    parser.add_argument("--detour-fixes", type=int, default=40)
+    parser.add_argument("--show", action="store_true", help="print every prompt")
+    args = parser.parse_args()
+
+    route = make_route(args.steps, step_meters=args.step_meters)
+    state = navigator.SessionState("bench")
+    state.status = "Navigating"
+    state.current_route = route
+    state.compiled_route = deviation.CompiledRoute(route)
+    state.progress_tracker = deviation.RouteProgressTracker(state.compiled_route)
+    state.prefers_zh = False
+    fixes = walk(state.compiled_route, args.speed, args.noise, args.detour, args.detour_fixes)
+
+    prompts, costs = [], []
+    for n, (lat, lng) in enumerate(fixes):
+        start = time.perf_counter()
+        navigator.set_current_location(state, {"lat": lat, "lng": lng, "heading": "north angle: 0°"})
+        text = push_guidance.on_location(state, now=float(n))  # one fix per second
+        costs.append((time.perf_counter() - start) * 1e6)
+        if text:
+            prompts.append((n, text))
+            if args.show:
+                print(f"fix {n:>5}: {text}")
+
+    costs.sort()
+    print(f"{args.steps} steps, {state.compiled_route.total_length:.0f} m, {len(fixes)} fixes, "
+          f"{len(prompts)} prompts")
+    print(f"per fix: p50 {costs[len(costs) // 2]:.1f} us, p99 {costs[int(len(costs) * 0.99)]:.1f} us, "
+          f"max {costs[-1]:.1f} us")
+    print(push_guidance.stats())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,134 @@
+"""Benchmark deviation.get_current_step / has_user_deviated against the
+pre-CompiledRoute implementation (Shapely + haversine, copied below as the
+reference), on both the raw-route and the CompiledRoute paths, plus batch
+scoring of many fixes with CompiledRoute.project_many.
+
+    python benchmarks/bench_route_geometry.py
+"""
+
+import argparse
+import math
+import os
+import sys
+import time
+
+import polyline
+from shapely.geometry import LineString, Point
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import deviation
+from synthetic_routes import make_route, route_path, sample_fixes
+
+deviation.print = lambda *a, **k: None  # the raw path logs every lookup
+
+
+# --- Reference: deviation.py before routes were compiled (logging removed) ---
+
+def _ref_haversine_distance(lat1, lon1, lat2, lon2):
+    R = 6371000  # Earth radius in meters
+    phi1, phi2 = math.radians(lat1), math.radians(lat2)
+    delta_phi = math.radians(lat2 - lat1)
+    delta_lambda = math.radians(lon2 - lon1)
+
+    a = math.sin(delta_phi / 2)**2 + \
+        math.cos(phi1) * math.cos(phi2) * math.sin(delta_lambda / 2)**2
+    c = 2 * math.atan2(math.sqrt(a), math.sqrt(1 - a))
+    return R * c
+
+
+def _ref_shortest_distance_to_route(user_lat, user_lon, route_coordinates):
+    if not route_coordinates:
+        return float('inf')
+    user_point_shapely = Point(user_lon, user_lat)
+    if len(route_coordinates) == 1:
+        r_lat, r_lon = route_coordinates[0]
+        return _ref_haversine_distance(user_lat, user_lon, r_lat, r_lon)
+    route_line = LineString([(lon, lat) for lat, lon in route_coordinates])
+    closest_point_on_line = route_line.interpolate(route_line.project(user_point_shapely))
+    return _ref_haversine_distance(user_lat, user_lon, closest_point_on_line.y, closest_point_on_line.x)
+
+
+def ref_has_user_deviated(user_lat, user_lon, route_coordinates, deviation_tolerance_meters):
+    if not route_coordinates:
+        return True
+    return _ref_shortest_distance_to_route(user_lat, user_lon, route_coordinates) > deviation_tolerance_meters
+
+
+def ref_get_current_step(user_lat, user_lon, route, tolerance_meters):
+    for leg_index, leg in enumerate(route.get('legs', [])):
+        for step_index, step in enumerate(leg.get('steps', [])):
+            if 'polyline' in step and 'encodedPolyline' in step['polyline']:
+                decoded_step_path = polyline.decode(step['polyline']['encodedPolyline'])
+                if not decoded_step_path:
+                    continue
+                if _ref_shortest_distance_to_route(user_lat, user_lon, decoded_step_path) <= tolerance_meters:
+                    return {"leg_index": leg_index, "step_index": step_index, "step_info": step}
+    return None
+
+# --- end of reference ---
+
+
+def _per_call_us(fn, fixes):
+    start = time.perf_counter()
+    for lat, lng in fixes:
+        fn(lat, lng)
+    return (time.perf_counter() - start) / len(fixes) * 1e6
+
+
+def _agreement(fn, reference, fixes):
+    return sum(fn(la, ln) == reference(la, ln) for la, ln in fixes) / len(fixes)
+
+
+def _ids(step):
+    return step and (step["leg_index"], step["step_index"])
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument("--steps", type=int, nargs="+", default=[5, 50, 500])
+    parser.add_argument("--fixes", type=int, default=200)
+    parser.add_argument("--tolerance", type=float, default=100)
+    args = parser.parse_args()
+
+    # Speedups and agreement (share of fixes with the same answer) are against the reference
+    print(f"{'steps':>6} {'compile ms':>11} {'step ref us':>12} {'raw x':>7} {'idx x':>7} {'agree':>6} "
+          f"{'dev ref us':>11} {'raw x':>7} {'idx x':>7} {'agree':>6} {'batch us':>9}")
+    for n in args.steps:
+        route = make_route(n)
+        path = route_path(route)
+        fixes = sample_fixes(route, args.fixes)
+
+        start = time.perf_counter()
+        compiled = deviation.CompiledRoute(route)
+        compile_ms = (time.perf_counter() - start) * 1e3
+
+        step = {
+            "ref": lambda la, ln: _ids(ref_get_current_step(la, ln, route, args.tolerance)),
+            "raw": lambda la, ln: _ids(deviation.get_current_step(la, ln, route, args.tolerance)),
+            "idx": lambda la, ln: _ids(deviation.get_current_step(la, ln, compiled, args.tolerance)),
+        }
+        dev = {
+            "ref": lambda la, ln: ref_has_user_deviated(la, ln, path, 20),
+            "raw": lambda la, ln: deviation.has_user_deviated(la, ln, path, 20),
+            "idx": lambda la, ln: deviation.has_user_deviated(la, ln, compiled, 20),
+        }
+        step_us = {name: _per_call_us(fn, fixes) for name, fn in step.items()}
+        dev_us = {name: _per_call_us(fn, fixes) for name, fn in dev.items()}
+        step_agree = min(_agreement(step[name], step["ref"], fixes) for name in ("raw", "idx"))
+        dev_agree = min(_agreement(dev[name], dev["ref"], fixes) for name in ("raw", "idx"))
+
+        lats, lngs = zip(*fixes)
+        start = time.perf_counter()
+        compiled.project_many(lats, lngs)
+        batch = (time.perf_counter() - start) / len(fixes) * 1e6
+
+        print(f"{n:>6} {compile_ms:>11.2f} {step_us['ref']:>12.1f} "
+              f"{step_us['ref'] / step_us['raw']:>6.1f}x {step_us['ref'] / step_us['idx']:>6.1f}x "
+              f"{step_agree:>6.0%} {dev_us['ref']:>11.1f} "
+              f"{dev_us['ref'] / dev_us['raw']:>6.1f}x {dev_us['ref'] / dev_us['idx']:>6.1f}x "
+              f"{dev_agree:>6.0%} {batch:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
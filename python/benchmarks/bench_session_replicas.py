@@ -0,0 +1,180 @@
+"""Throughput of server.py replicas sharing one session store.
+
+Starts N server.py processes on consecutive ports, all with the same sqlite
+SESSION_STORE, and drives them over gRPC: each client session is created on one
+replica and every following turn goes to the next replica in turn, so every
+request has to pick the session up from the store. Gemini is replaced by a stub
+that answers after --latency seconds and burns --cpu-ms of CPU per call (what
+response parsing and the rest of a real turn cost), and the static map is
+skipped.
+
+    python benchmarks/bench_session_replicas.py --replicas 1 2 4
+"""
+
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import subprocess
+import sys
+import tempfile
+import time
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, PYTHON_DIR)
+os.environ.setdefault("GEMINI_API_KEY", "benchmark-key")  # never used, the model is stubbed
+
+
+def _burn(ms: float) -> None:
+    end = time.perf_counter() + ms / 1000
+    while time.perf_counter() < end:
+        pass
+
+
+def serve_replica(port: int, latency: float, cpu_ms: float) -> None:
+    os.environ["PORT"] = str(port)
+    import logging
+    from google.genai import types as genai_types
+    import navigator
+    import server
+
+    logging.disable(logging.WARNING)
+    navigator.print = lambda *a, **k: None
+
+    async def no_map(session_state, location_coords):
+        return None
+
+    async def generate_content(*, model, contents, config=None):
+        await asyncio.sleep(latency)
+        _burn(cpu_ms)
+        return genai_types.GenerateContentResponse(
+            candidates=[genai_types.Candidate(content=genai_types.Content(
+                role="model", parts=[genai_types.Part(text="Continue straight for 50 meters.")]))],
+            usage_metadata=genai_types.GenerateContentResponseUsageMetadata(
+                prompt_token_count=1200, candidates_token_count=12))
+
+    async def generate_content_stream(*, model, contents, config=None):
+        response = await generate_content(model=model, contents=contents, config=config)
+        response.candidates[0].finish_reason = genai_types.FinishReason.STOP
+
+        async def chunks():
+            yield response
+        return chunks()
+
+    navigator.get_static_map_image = no_map
+    navigator.client.aio.models.generate_content = generate_content
+    navigator.client.aio.models.generate_content_stream = generate_content_stream
+    asyncio.run(server.serve())
+
+
+def _free_ports(count: int):
+    sockets = [socket.socket() for _ in range(count)]
+    for s in sockets:
+        s.bind(("127.0.0.1", 0))
+    ports = [s.getsockname()[1] for s in sockets]
+    for s in sockets:
+        s.close()
+    return ports
+
+
+async def _drive(ports, sessions: int, turns: int, offset: int):
+    import grpc
+    import gemini_chat_pb2
+    import gemini_chat_pb2_grpc
+
+    channels = [grpc.aio.insecure_channel(f"127.0.0.1:{port}") for port in ports]
+    stubs = [gemini_chat_pb2_grpc.GeminiChatStub(channel) for channel in channels]
+    done = errors = 0
+
+    async def run_session(index: int):
+        nonlocal done, errors
+        home = (index + offset) % len(stubs)
+        created = await stubs[home].CreateSession(gemini_chat_pb2.CreateSessionRequest())
+        for turn in range(turns):
+            stub = stubs[(home + 1 + turn) % len(stubs)]  # never the same replica twice in a row
+            request = gemini_chat_pb2.ChatRequest(
+                session_id=created.session_id, text="Where am I?",
+                location=gemini_chat_pb2.LocationInput(lat=24.9924, lng=121.4990, heading=90))
+            async for response in stub.ChatStream(iter([request])):
+                if response.nav.nav_description.startswith("Error"):
+                    errors += 1
+                elif response.nav.is_final:
+                    done += 1
+
+    await asyncio.gather(*(run_session(i) for i in range(sessions)))
+    for channel in channels:
+        await channel.close()
+    return done, errors
+
+
+def _client_process(ports, sessions, turns, offset, results):
+    results.put(asyncio.run(_drive(ports, sessions, turns, offset)))
+
+
+def _wait_ready(ports, timeout=30.0):
+    import grpc
+    for port in ports:
+        channel = grpc.insecure_channel(f"127.0.0.1:{port}")
+        grpc.channel_ready_future(channel).result(timeout=timeout)
+        channel.close()
+
+
+def run(replicas: int, sessions: int, turns: int, clients: int, latency: float, cpu_ms: float):
+    ports = _free_ports(replicas)
+    with tempfile.TemporaryDirectory() as tmp:
+        env = dict(os.environ, SESSION_STORE=f"sqlite:///{os.path.join(tmp, 'sessions.db')}",
+                   IMAGE_PIPELINE_WORKERS="0")
+        procs = [subprocess.Popen([sys.executable, os.path.abspath(__file__), "--serve", str(port),
+                                   "--latency", str(latency), "--cpu-ms", str(cpu_ms)],
+                                  env=env, cwd=PYTHON_DIR, stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+                 for port in ports]
+        try:
+            _wait_ready(ports)
+            ctx = multiprocessing.get_context("spawn")
+            results = ctx.Queue()
+            per_client = sessions // clients
+            start = time.perf_counter()
+            workers = [ctx.Process(target=_client_process, args=(ports, per_client, turns, i * per_client, results))
+                       for i in range(clients)]
+            for w in workers:
+                w.start()
+            totals = [results.get() for _ in workers]
+            wall = time.perf_counter() - start
+            for w in workers:
+                w.join()
+        finally:
+            for p in procs:
+                p.terminate()
+            for p in procs:
+                p.wait()
+    done = sum(t[0] for t in totals)
+    errors = sum(t[1] for t in totals)
+    return done, errors, wall
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--replicas", type=int, nargs="+", default=[1, 2, 4])
+    parser.add_argument("--sessions", type=int, default=200)
+    parser.add_argument("--turns", type=int, default=5, help="turns per session")
+    parser.add_argument("--clients", type=int, default=4, help="load generator processes")
+    parser.add_argument("--latency", type=float, default=0.05, help="stub model latency in seconds")
+    parser.add_argument("--cpu-ms", type=float, default=5.0, help="CPU burnt per stub model call")
+    parser.add_argument("--serve", type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.serve:
+        serve_replica(args.serve, args.latency, args.cpu_ms)
+        return
+
+    print(f"{args.sessions} sessions x {args.turns} turns, stub latency {args.latency * 1000:.0f} ms "
+          f"+ {args.cpu_ms:.1f} ms CPU per call, sqlite session store")
+    print(f"{'replicas':>8} {'turns':>6} {'errors':>6} {'wall s':>8} {'turns/s':>9}")
+    for replicas in args.replicas:
+        done, errors, wall = run(replicas, args.sessions, args.turns, args.clients, args.latency, args.cpu_ms)
+        print(f"{replicas:>8} {done:>6} {errors:>6} {wall:>8.2f} {done / wall:>9.1f}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,449 @@
+"""Replays recorded walking sessions against GeminiChatServicer.ChatStream, in process.
+
+Gemini, Maps (Routes, Geocoding, Places, Static Maps) and ASR are replaced by
+the deterministic fakes in replay_fakes.py, so no key or network is needed and
+every run does the same work. Each trace is one session: a JSONL file with one
+ChatRequest per line,
+
+    {"t": 12.0, "location": {"lat": 24.99, "lng": 121.49, "heading": 87.0},
+     "text": "Is the path clear?",
+     "images": [{"path": "../../dummy_image.jpg", "width": 640, "height": 480}],
+     "audio": {"path": "../../audio/dummy_audio1.wav", "transcript": "Where am I?"}}
+
+where `t` is seconds since the session started and every field but `t` is
+optional (paths are relative to the trace file). Traces are replayed --speed
+times faster than recorded; with N --users, N copies of the traces run
+concurrently, each level in a fresh process.
+
+Reported per level: throughput, per-turn latency (total and first spoken word)
+broken down into time spent in the model, prompt cache, Maps and ASR fakes
+(summed over calls, so parallel calls can add up to more than the turn) and
+the server's own time (the turn minus the union of all fake calls),
+location-update latency, and event loop lag. Background work (map prefetch,
+reroutes) counts against whichever request of its session is in flight.
+With TRACING=local (see tracing.py) the span histograms of each level are
+printed too.
+
+    python benchmarks/replay.py                                # traces/*.jsonl, compared to replay_baseline.json
+    python benchmarks/replay.py --users 1 20 --save-baseline   # record a new baseline
+    TRACING=local python benchmarks/replay.py --users 10       # plus per-span latency
+    python benchmarks/replay.py --synthesize traces/my_walk.jsonl --destination "Taipei 101"
+"""
+
+import argparse
+import asyncio
+import glob
+import json
+import math
+import multiprocessing
+import os
+import random
+import sys
+import time
+from typing import Dict, List, Optional
+
+BENCH_DIR = os.path.dirname(os.path.abspath(__file__))
+PYTHON_DIR = os.path.dirname(BENCH_DIR)
+sys.path.insert(0, PYTHON_DIR)
+sys.path.insert(0, BENCH_DIR)
+os.environ.setdefault("GEMINI_API_KEY", "replay-key")  # never used, every service is faked
+os.environ.setdefault("GOOGLE_MAPS_KEY", "replay-key")
+os.environ.setdefault("STREAM_RESPONSES", "on")  # first-word times are measured on streamed answers
+DEFAULT_BASELINE = os.path.join(BENCH_DIR, "replay_baseline.json")
+
+# (section, metric, higher is better) checked against the baseline
+BASELINE_METRICS = [
+    ("turn", "total_p50_ms", False), ("turn", "total_p95_ms", False),
+    ("turn", "first_word_p50_ms", False), ("turn", "first_word_p95_ms", False),
+    ("location", "total_p95_ms", False), (None, "requests_per_s", True),
+]
+# Latency changes smaller than this are noise, whatever the tolerance says
+BASELINE_FLOOR_MS = 10.0
+
+
+class Trace:
+    def __init__(self, path: str):
+        self.path = path
+        base = os.path.dirname(os.path.abspath(path))
+        blobs: Dict[str, bytes] = {}
+
+        def blob(relative: str) -> bytes:
+            full = os.path.normpath(os.path.join(base, relative))
+            if full not in blobs:
+                with open(full, "rb") as f:
+                    blobs[full] = f.read()
+            return blobs[full]
+
+        self.events = []
+        with open(path) as f:
+            for line in f:
+                if not line.strip():
+                    continue
+                event = json.loads(line)
+                for image in event.get("images", []):
+                    image["data"] = blob(image["path"])
+                if "audio" in event:
+                    event["audio"]["data"] = blob(event["audio"]["path"])
+                self.events.append(event)
+        self.events.sort(key=lambda e: e["t"])
+
+
+def _kind(event: Dict) -> str:
+    if "text" in event or "audio" in event:
+        return "turn"
+    return "location" if "location" in event else "other"
+
+
+def _request(session_id: str, event: Dict):
+    import gemini_chat_pb2
+
+    request = gemini_chat_pb2.ChatRequest(session_id=session_id)
+    if "location" in event:
+        loc = event["location"]
+        request.location.lat, request.location.lng = loc["lat"], loc["lng"]
+        request.location.heading = loc.get("heading", 0.0)
+    if "text" in event:
+        request.text = event["text"]
+    for image in event.get("images", []):
+        request.multi_images.images.add(data=image["data"], format="jpeg",
+                                        width=image.get("width", 640), height=image.get("height", 480))
+    if "audio" in event:
+        request.audio.data = event["audio"]["data"]
+        request.audio.format = "wav"
+    return request
+
+
+class SessionLog:
+    """Timings of one replayed session, one record per request."""
+
+    def __init__(self):
+        self.records: List[Dict] = []
+        self.current: Optional[Dict] = None
+        self.transcript: Optional[str] = None  # what FakeASR hears for the current request
+        self.errors = 0
+
+    def begin(self, kind: str, late: float, transcript: Optional[str]) -> None:
+        self.transcript = transcript
+        self.current = {"kind": kind, "started": time.perf_counter(), "late": late, "first_word": None,
+                        "model": 0.0, "model_calls": 0, "prompt_cache": 0.0, "maps": 0.0, "asr": 0.0,
+                        "waiting": [], "responses": 0, "pushes": 0}
+
+    def charge(self, component: str, started: float, ended: float) -> None:
+        record = self.current
+        if record is None:
+            return
+        started = max(started, record["started"])  # background work begun during an earlier request
+        record[component] += ended - started
+        record["model_calls"] += component == "model"
+        record["waiting"].append((started, ended))
+
+    def on_response(self, response) -> None:
+        record = self.current
+        text = response.nav.nav_description
+        if text.startswith("Error") or text.startswith("An error occurred"):
+            self.errors += 1
+        if record is None:
+            return
+        record["responses"] += 1
+        if text and record["first_word"] is None:
+            record["first_word"] = time.perf_counter() - record["started"]
+        if text and record["kind"] == "location":
+            record["pushes"] += 1
+
+    def end(self) -> None:
+        record, self.current = self.current, None
+        started = record.pop("started")
+        record["total"] = time.perf_counter() - started
+        # Fakes overlap (parallel tools, map prefetch): what's left after their union is the server's own time
+        waited, reached = 0.0, started
+        for begin, finish in sorted(record.pop("waiting")):
+            if finish > reached:
+                waited += finish - max(begin, reached)
+                reached = finish
+        record["server"] = record["total"] - waited
+        self.records.append(record)
+
+
+async def replay_session(servicer, trace: Trace, speed: float, delay: float, log: SessionLog) -> None:
+    import gemini_chat_pb2
+    from replay_fakes import session_log
+
+    session_log.set(log)  # the fakes charge their time to this session
+    loop = asyncio.get_running_loop()
+    await asyncio.sleep(delay)
+    created = await servicer.CreateSession(gemini_chat_pb2.CreateSessionRequest(), None)
+
+    async def requests():
+        # ChatStream pulls the next request only after answering the previous one
+        start = loop.time()
+        for event in trace.events:
+            due = start + event["t"] / speed
+            if due > loop.time():
+                await asyncio.sleep(due - loop.time())
+            log.begin(_kind(event), max(0.0, loop.time() - due), (event.get("audio") or {}).get("transcript"))
+            yield _request(created.session_id, event)
+            log.end()
+
+    async for response in servicer.ChatStream(requests(), None):
+        log.on_response(response)
+
+
+async def _loop_lag(samples: List[float], interval: float = 0.01) -> None:
+    loop = asyncio.get_running_loop()
+    while True:
+        start = loop.time()
+        await asyncio.sleep(interval)
+        samples.append(max(0.0, loop.time() - start - interval))
+
+
+def _percentile(values: List[float], q: float) -> float:
+    if not values:
+        return 0.0
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(q * len(ordered)))]
+
+
+def _ms(seconds: float) -> float:
+    return round(seconds * 1000, 1)
+
+
+def summarize(logs: List[SessionLog], wall: float, lag: List[float]) -> Dict:
+    records = [r for log in logs for r in log.records]
+    turns = [r for r in records if r["kind"] == "turn"]
+    fixes = [r for r in records if r["kind"] == "location"]
+    summary = {
+        "wall_s": round(wall, 2),
+        "requests": len(records),
+        "requests_per_s": round(len(records) / wall, 1),
+        "turns_per_s": round(len(turns) / wall, 2),
+        "errors": sum(log.errors for log in logs),
+        "late_p95_ms": _ms(_percentile([r["late"] for r in records], 0.95)),
+        "loop_lag_p99_ms": _ms(_percentile(lag, 0.99)),
+        "loop_lag_max_ms": _ms(max(lag, default=0.0)),
+    }
+    if turns:
+        first_words = [r["first_word"] for r in turns if r["first_word"] is not None]
+        n = len(turns)
+        summary["turn"] = {
+            "count": n,
+            "total_p50_ms": _ms(_percentile([r["total"] for r in turns], 0.5)),
+            "total_p95_ms": _ms(_percentile([r["total"] for r in turns], 0.95)),
+            "first_word_p50_ms": _ms(_percentile(first_words, 0.5)),
+            "first_word_p95_ms": _ms(_percentile(first_words, 0.95)),
+            "model_calls_avg": round(sum(r["model_calls"] for r in turns) / n, 2),
+            "model_ms_avg": _ms(sum(r["model"] for r in turns) / n),
+            "prompt_cache_ms_avg": _ms(sum(r["prompt_cache"] for r in turns) / n),
+            "maps_ms_avg": _ms(sum(r["maps"] for r in turns) / n),
+            "asr_ms_avg": _ms(sum(r["asr"] for r in turns) / n),
+            "server_ms_avg": _ms(sum(r["server"] for r in turns) / n),
+        }
+    if fixes:
+        summary["location"] = {
+            "count": len(fixes),
+            "pushes": sum(r["pushes"] for r in fixes),
+            "total_p50_ms": _ms(_percentile([r["total"] for r in fixes], 0.5)),
+            "total_p95_ms": _ms(_percentile([r["total"] for r in fixes], 0.95)),
+            "total_max_ms": _ms(max(r["total"] for r in fixes)),
+            "server_ms_avg": _ms(sum(r["server"] for r in fixes) / len(fixes)),
+        }
+    return summary
+
+
+async def run_level(trace_paths: List[str], users: int, settings: Dict) -> Dict:
+    import logging
+    import image_pipeline
+    import navigator
+    import server
+    import tracing
+    from replay_fakes import FakeASR, FakeGemini, FakeMaps
+
+    logging.disable(logging.WARNING)
+    navigator.print = lambda *a, **k: None
+    FakeGemini(settings["model_latency"], settings["chunk_latency"]).install()
+    FakeMaps(settings["maps_latency"], settings["static_map_latency"]).install()
+    FakeASR(settings["asr_latency"]).install()
+
+    traces = [Trace(path) for path in trace_paths]
+    servicer = server.GeminiChatServicer()
+    await image_pipeline.startup()
+    lag: List[float] = []
+    lag_task = asyncio.create_task(_loop_lag(lag))
+    logs = [SessionLog() for _ in range(users)]
+    rng = random.Random(users)
+    start = time.perf_counter()
+    try:
+        await asyncio.gather(*(
+            replay_session(servicer, traces[i % len(traces)], settings["speed"],
+                           rng.uniform(0, settings["stagger"]), logs[i])
+            for i in range(users)))
+    finally:
+        wall = time.perf_counter() - start
+        lag_task.cancel()
+        image_pipeline.shutdown()
+    summary = summarize(logs, wall, lag)
+    if tracing.ENABLED:
+        summary["spans"] = tracing.snapshot()
+    return summary
+
+
+def _level_process(trace_paths, users, settings, results) -> None:
+    # Fresh process per level: caches, pools and stats start cold every time
+    os.environ["SESSION_STORE"] = ""
+    results.put(asyncio.run(run_level(trace_paths, users, settings)))
+
+
+def run(trace_paths: List[str], users: int, settings: Dict) -> Dict:
+    ctx = multiprocessing.get_context("spawn")
+    results = ctx.Queue()
+    proc = ctx.Process(target=_level_process, args=(trace_paths, users, settings, results))
+    proc.start()
+    summary = results.get()
+    proc.join()
+    return summary
+
+
+def compare(levels: Dict[str, Dict], baseline: Dict, tolerance: float) -> List[str]:
+    """Human-readable regressions of `levels` against the baseline's levels."""
+    regressions = []
+    for users, summary in levels.items():
+        base = baseline["levels"].get(users)
+        if base is None:
+            continue
+        for section, metric, higher_is_better in BASELINE_METRICS:
+            value = (summary.get(section) or {}).get(metric) if section else summary.get(metric)
+            old = (base.get(section) or {}).get(metric) if section else base.get(metric)
+            if value is None or old is None:
+                continue
+            name = f"{section}.{metric}" if section else metric
+            if higher_is_better and value < old * (1 - tolerance):
+                regressions.append(f"{users} users: {name} {old} -> {value}")
+            elif not higher_is_better and value - old > max(old * tolerance, BASELINE_FLOOR_MS):
+                regressions.append(f"{users} users: {name} {old} -> {value} ms")
+    return regressions
+
+
+def synthesize(path: str, destination: str, seed: int = 7, max_walk_seconds: float = 240.0,
+               fix_interval: float = 1.0, noise: float = 4.0, question_every: float = 40.0) -> None:
+    """Writes a trace of a walk to `destination` on the route the fakes will compute."""
+    import deviation
+    import replay_fakes
+
+    rng = random.Random(seed)
+    start = (24.9924, 121.4990)
+    route = deviation.CompiledRoute(replay_fakes.route(start, replay_fakes.geocode(destination, start)))
+    base = os.path.dirname(os.path.abspath(path))
+    image = {"path": os.path.relpath(os.path.join(PYTHON_DIR, "dummy_image.jpg"), base), "width": 640, "height": 480}
+    audio = {"path": os.path.relpath(os.path.join(PYTHON_DIR, "audio", "dummy_audio1.wav"), base),
+             "transcript": "Where am I?"}
+
+    def fix(along: float) -> Dict:
+        lat, lng = route.segments.point_at_distance(along)
+        ahead = route.segments.point_at_distance(along + 1)
+        heading = math.degrees(math.atan2((ahead[1] - lng) * math.cos(math.radians(lat)), ahead[0] - lat)) % 360
+        return {"lat": round(lat + rng.gauss(0, noise) / replay_fakes.METERS_PER_DEGREE, 7),
+                "lng": round(lng + rng.gauss(0, noise) / (replay_fakes.METERS_PER_DEGREE *
+                                                          math.cos(math.radians(lat))), 7),
+                "heading": round((heading + rng.gauss(0, 10)) % 360, 1)}
+
+    events = [{"t": 0.0, "location": fix(0), "text": f"Take me to {destination}", "images": [image]}]
+    events += [{"t": float(t), "location": fix(0)} for t in range(1, 6)]
+    events.append({"t": 6.0, "location": fix(0), "text": "start"})
+    questions = [{"text": "What's next?"}, {"text": "Is the path clear?", "images": [image]}, {"audio": audio}]
+    walk_seconds = min(max_walk_seconds, route.total_length / replay_fakes.WALK_SPEED)
+    t, asked = 0.0, 0
+    while t < walk_seconds:
+        t += fix_interval
+        event = {"t": round(6.0 + t, 2), "location": fix(t * replay_fakes.WALK_SPEED)}
+        if t >= question_every * (asked + 1):
+            event.update(questions[asked % len(questions)])
+            asked += 1
+        events.append(event)
+    events.append({"t": round(7.0 + t, 2), "location": fix(t * replay_fakes.WALK_SPEED), "text": "stop"})
+    os.makedirs(base, exist_ok=True)
+    with open(path, "w") as f:
+        for event in events:
+            f.write(json.dumps(event, ensure_ascii=False) + "\n")
+    print(f"Wrote {len(events)} requests ({events[-1]['t']:.0f} s, {asked + 2} turns) to {path}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("traces", nargs="*", help="trace files (default: benchmarks/traces/*.jsonl)")
+    parser.add_argument("--users", type=int, nargs="+", default=[1, 10, 40], help="concurrent replayed users")
+    parser.add_argument("--speed", type=float, default=6.0, help="replay this many times faster than recorded")
+    parser.add_argument("--stagger", type=float, default=2.0, help="users start within this many seconds")
+    parser.add_argument("--model-latency", type=float, default=0.4, help="fake Gemini time to first chunk, s")
+    parser.add_argument("--chunk-latency", type=float, default=0.03, help="fake Gemini gap between chunks, s")
+    parser.add_argument("--maps-latency", type=float, default=0.08, help="fake Routes/Geocoding/Places latency, s")
+    parser.add_argument("--static-map-latency", type=float, default=0.12)
+    parser.add_argument("--asr-latency", type=float, default=0.3)
+    parser.add_argument("--baseline", default=DEFAULT_BASELINE)
+    parser.add_argument("--save-baseline", action="store_true", help="write the results as the new baseline")
+    parser.add_argument("--tolerance", type=float, default=0.15, help="allowed relative change before a regression")
+    parser.add_argument("--synthesize", metavar="PATH", help="write a synthetic trace instead of replaying")
+    parser.add_argument("--destination", default="Banqiao Station")
+    args = parser.parse_args()
+
+    if args.synthesize:
+        synthesize(args.synthesize, args.destination)
+        return
+
+    trace_paths = args.traces or sorted(glob.glob(os.path.join(BENCH_DIR, "traces", "*.jsonl")))
+    settings = {"speed": args.speed, "stagger": args.stagger, "model_latency": args.model_latency,
+                "chunk_latency": args.chunk_latency, "maps_latency": args.maps_latency,
+                "static_map_latency": args.static_map_latency, "asr_latency": args.asr_latency,
+                "traces": [os.path.basename(p) for p in trace_paths]}
+    print(f"{len(trace_paths)} trace(s) at {args.speed:g}x, model {args.model_latency * 1000:.0f} ms "
+          f"+ {args.chunk_latency * 1000:.0f} ms/chunk, maps {args.maps_latency * 1000:.0f} ms, "
+          f"asr {args.asr_latency * 1000:.0f} ms")
+    print(f"{'users':>5} {'req/s':>7} {'turns/s':>7} {'turn p50':>8} {'p95':>7} {'1st word p50':>12} {'p95':>7} "
+          f"{'fix p95':>7} {'lag p99':>7} {'errors':>6}")
+    levels, spans = {}, {}
+    for users in args.users:
+        s = run(trace_paths, users, settings)
+        if "spans" in s:
+            spans[users] = s.pop("spans")
+        levels[str(users)] = s
+        turn, fixes = s.get("turn", {}), s.get("location", {})
+        print(f"{users:>5} {s['requests_per_s']:>7.1f} {s['turns_per_s']:>7.2f} {turn.get('total_p50_ms', 0):>8.0f} "
+              f"{turn.get('total_p95_ms', 0):>7.0f} {turn.get('first_word_p50_ms', 0):>12.0f} "
+              f"{turn.get('first_word_p95_ms', 0):>7.0f} {fixes.get('total_p95_ms', 0):>7.1f} "
+              f"{s['loop_lag_p99_ms']:>7.1f} {s['errors']:>6}")
+    print("\nPer turn, average ms:")
+    print(f"{'users':>5} {'model':>7} {'calls':>5} {'cache':>6} {'maps':>6} {'asr':>6} {'server':>7}")
+    for users, s in levels.items():
+        turn = s.get("turn", {})
+        print(f"{users:>5} {turn.get('model_ms_avg', 0):>7.0f} {turn.get('model_calls_avg', 0):>5.2f} "
+              f"{turn.get('prompt_cache_ms_avg', 0):>6.0f} {turn.get('maps_ms_avg', 0):>6.0f} "
+              f"{turn.get('asr_ms_avg', 0):>6.0f} {turn.get('server_ms_avg', 0):>7.1f}")
+    for users, level_spans in spans.items():
+        print(f"\nSpans at {users} users (TRACING={os.environ['TRACING']}), ms:")
+        print(f"{'span':>22} {'count':>6} {'avg':>7} {'p50':>7} {'p95':>7} {'p99':>7} {'max':>7} {'errors':>6}")
+        for name, h in level_spans.items():
+            print(f"{name:>22} {h['count']:>6} {h['avg_ms']:>7.1f} {h['p50_ms']:>7g} {h['p95_ms']:>7g} "
+                  f"{h['p99_ms']:>7g} {h['max_ms']:>7.1f} {h['errors']:>6}")
+
+    if args.save_baseline:
+        with open(args.baseline, "w") as f:
+            json.dump({"settings": settings, "levels": levels}, f, indent=2, sort_keys=True)
+            f.write("\n")
+        print(f"\nBaseline written to {args.baseline}")
+        return
+    if not os.path.exists(args.baseline):
+        return
+    with open(args.baseline) as f:
+        baseline = json.load(f)
+    if baseline.get("settings") != settings:
+        print(f"\n{args.baseline} was recorded with other settings, not comparing")
+        return
+    regressions = compare(levels, baseline, args.tolerance)
+    if regressions:
+        print(f"\nRegressions against {os.path.basename(args.baseline)} (tolerance {args.tolerance:.0%}):")
+        for line in regressions:
+            print(f"  {line}")
+        sys.exit(1)
+    print(f"\nNo regressions against {os.path.basename(args.baseline)}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,294 @@
+"""Deterministic local stand-ins for Gemini, the Maps APIs and ASR, for replay.py.
+
+Everything answers after a fixed, configurable latency and derives its answer
+from the request alone, so two replays of the same trace do the same work:
+
+  * FakeMaps: an httpx transport for maps_client serving Routes (an L-shaped
+    walk from origin to destination, split into steps), Geocoding, Places text
+    search / details and Static Maps.
+  * FakeGemini: models.generate_content(_stream) and caches.create/delete on the
+    shared genai client. A tiny scripted "model": "take me to X" geocodes X and
+    reads the location, then computes the route; "start" / "stop" start and end
+    navigation; "where am I" reverse-geocodes; anything else gets a two-sentence
+    answer, streamed a few words at a time.
+  * FakeASR: an asr backend returning the transcript the trace recorded.
+
+Time spent in each fake is charged to the request being replayed (see
+SessionLog in replay.py) through the `session_log` context variable.
+"""
+
+import asyncio
+import contextvars
+import hashlib
+import json
+import math
+import os
+import time
+from typing import Dict, List, Optional, Tuple
+
+import httpx
+import polyline
+from google.genai import types as genai_types
+
+import asr
+import maps_client
+import navigator
+from synthetic_routes import METERS_PER_DEGREE
+
+PYTHON_DIR = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+STEP_METERS = 120.0
+WALK_SPEED = 1.3
+
+# The SessionLog of the session whose request is being served
+session_log: contextvars.ContextVar = contextvars.ContextVar("replay_session_log", default=None)
+
+
+def charge(component: str, started: float) -> None:
+    """Records that `component` kept the current request waiting from `started` until now."""
+    log = session_log.get()
+    if log is not None:
+        log.charge(component, started, time.perf_counter())
+
+
+def _offset(lat: float, lng: float, north: float, east: float) -> Tuple[float, float]:
+    return (lat + north / METERS_PER_DEGREE,
+            lng + east / (METERS_PER_DEGREE * math.cos(math.radians(lat))))
+
+
+def _digest(text: str) -> int:
+    return int(hashlib.sha256(text.encode()).hexdigest()[:8], 16)
+
+
+def geocode(query: str, center: Tuple[float, float]) -> Tuple[float, float]:
+    """Where FakeMaps puts a place name: 300-900 m north-east-ish of `center`."""
+    h = _digest(query.strip().lower())
+    return _offset(center[0], center[1], 300 + h % 400, ((h >> 12) % 1000) - 300)
+
+
+def route(origin: Tuple[float, float], destination: Tuple[float, float]) -> Dict:
+    """A Routes API `routes[0]`: north/south to the destination's latitude, then east/west."""
+    (lat1, lng1), (lat2, lng2) = origin, destination
+    north = (lat2 - lat1) * METERS_PER_DEGREE
+    east = (lng2 - lng1) * METERS_PER_DEGREE * math.cos(math.radians(lat1))
+    legs = [(north, 0.0, "north" if north >= 0 else "south"), (0.0, east, "east" if east >= 0 else "west")]
+    turn = "TURN_RIGHT" if (north >= 0) == (east >= 0) else "TURN_LEFT"
+    steps, path, lat, lng = [], [(lat1, lng1)], lat1, lng1
+    for leg_index, (dn, de, heading) in enumerate(legs):
+        length = abs(dn) + abs(de)
+        count = max(1, math.ceil(length / STEP_METERS)) if length >= 1 else 0
+        for i in range(count):
+            end = _offset(lat, lng, dn / count, de / count)
+            step_path = [(lat, lng), end]
+            maneuver = "DEPART" if not steps else (turn if i == 0 and leg_index else "STRAIGHT")
+            steps.append({
+                "distanceMeters": int(length / count),
+                "staticDuration": f"{int(length / count / WALK_SPEED)}s",
+                "polyline": {"encodedPolyline": polyline.encode(step_path)},
+                "startLocation": {"latLng": {"latitude": lat, "longitude": lng}},
+                "endLocation": {"latLng": {"latitude": end[0], "longitude": end[1]}},
+                "navigationInstruction": {"maneuver": maneuver,
+                                          "instructions": f"Head {heading} for {int(length / count)} m"},
+            })
+            path.append(end)
+            lat, lng = end
+    total = int(sum(s["distanceMeters"] for s in steps))
+    return {
+        "distanceMeters": total,
+        "duration": f"{int(total / WALK_SPEED)}s",
+        "polyline": {"encodedPolyline": polyline.encode(path)},
+        "legs": [{"steps": steps}],
+    }
+
+
+class FakeMaps:
+    """httpx transport for maps_client; latencies in seconds per service."""
+
+    def __init__(self, latency: float = 0.08, static_map_latency: float = 0.12, center=(24.9924, 121.4990)):
+        self.latency = latency
+        self.static_map_latency = static_map_latency
+        self.center = center
+        with open(os.path.join(PYTHON_DIR, "dummy_image.jpg"), "rb") as f:
+            self.map_image = f.read()
+
+    async def handle(self, request: httpx.Request) -> httpx.Response:
+        started = time.perf_counter()
+        path, params = request.url.path, request.url.params
+        await asyncio.sleep(self.static_map_latency if path.endswith("staticmap") else self.latency)
+        try:
+            if path.endswith("computeRoutes"):
+                body = json.loads(request.content)
+                origin, destination = (body[k]["location"]["latLng"] for k in ("origin", "destination"))
+                return httpx.Response(200, json={"routes": [route(
+                    (origin["latitude"], origin["longitude"]), (destination["latitude"], destination["longitude"]))]})
+            if path.endswith("geocode/json"):
+                if "latlng" in params:
+                    return httpx.Response(200, json={"results": [{
+                        "formatted_address": f"No. {_digest(params['latlng'][:9]) % 300 + 1}, Replay Rd"}]})
+                lat, lng = geocode(params["address"], self.center)
+                return httpx.Response(200, json={"results": [{
+                    "geometry": {"location": {"lat": lat, "lng": lng}}, "formatted_address": params["address"]}]})
+            if path.endswith("textsearch/json"):
+                query = params["query"]
+                results = []
+                for i in range(3):
+                    lat, lng = geocode(f"{query}#{i}", self.center)
+                    results.append({"name": f"{query} {i + 1}", "place_id": f"replay-{_digest(query)}-{i}",
+                                    "formatted_address": f"{i + 1} {query} St",
+                                    "geometry": {"location": {"lat": lat, "lng": lng}}})
+                return httpx.Response(200, json={"results": results})
+            if path.endswith("details/json"):
+                return httpx.Response(200, json={"result": {"name": params["place_id"],
+                                                            "formatted_address": "1 Replay Rd", "rating": 4.2}})
+            if path.endswith("staticmap"):
+                return httpx.Response(200, content=self.map_image, headers={"content-type": "image/jpeg"})
+            return httpx.Response(404, json={"error": f"no fake for {path}"})
+        finally:
+            charge("maps", started)
+
+    def install(self) -> None:
+        transport = httpx.MockTransport(self.handle)
+        maps_client._new_client = lambda: httpx.AsyncClient(transport=transport, timeout=maps_client._timeout())
+
+
+def _function_call(name: str, **args) -> genai_types.Part:
+    return genai_types.Part(function_call=genai_types.FunctionCall(name=name, args=args))
+
+
+def _user_text(content: genai_types.Content) -> str:
+    return " ".join(p.text for p in content.parts or [] if p.text).strip()
+
+
+class FakeGemini:
+    """
+    Stands in for client.aio.models / client.aio.caches. `latency` is the time
+    to the first chunk, `chunk_latency` the gap between streamed chunks.
+    """
+
+    def __init__(self, latency: float = 0.4, chunk_latency: float = 0.03, words_per_chunk: int = 3):
+        self.latency = latency
+        self.chunk_latency = chunk_latency
+        self.words_per_chunk = words_per_chunk
+
+    @staticmethod
+    def reply(contents: List[genai_types.Content]) -> List[genai_types.Part]:
+        """What the scripted model says to a conversation."""
+        last = contents[-1]
+        responses = {p.function_response.name: p.function_response.response or {}
+                     for p in last.parts or [] if p.function_response}
+        if responses:
+            if "geocode_place" in responses and "get_current_location" in responses:
+                place, here = responses["geocode_place"], responses["get_current_location"]
+                if "error" in place or "error" in here:
+                    return [genai_types.Part(text="Sorry, I could not find that place. Where do you want to go?")]
+                return [_function_call("compute_route", origin=f"{here['lat']},{here['lng']}",
+                                       destination=f"{place['lat']},{place['lng']}", mode="WALK")]
+            if "compute_route" in responses:
+                meters = responses["compute_route"].get("distanceMeters") or 0
+                return [genai_types.Part(text=f"I found a walking route of {meters} meters. "
+                                              f"Say start when you are ready to go.")]
+            if "get_current_location" in responses:
+                here = responses["get_current_location"]
+                return [_function_call("reverse_geocode", lat=here.get("lat", 0.0), lng=here.get("lng", 0.0))]
+            if "reverse_geocode" in responses:
+                address = responses["reverse_geocode"].get("formatted_address", "an unknown street")
+                return [genai_types.Part(text=f"You are near {address}. The sidewalk continues ahead of you.")]
+            return [genai_types.Part(text="Done. Let me know what you need next.")]
+
+        text = _user_text(last).lower()
+        for prefix in ("take me to ", "navigate to ", "帶我去"):
+            if prefix in text:
+                query = _user_text(last)[text.index(prefix) + len(prefix):].strip(" .?!")
+                return [_function_call("geocode_place", query=query), _function_call("get_current_location")]
+        if text in ("start", "let's go", "開始"):
+            return [_function_call("start_navigation")]
+        if text in ("stop", "end navigation", "結束"):
+            return [_function_call("end_navigation")]
+        if "where am i" in text or "我在哪" in text:
+            return [_function_call("get_current_location")]
+        if any(p.inline_data for p in last.parts or []):
+            return [genai_types.Part(text="The path ahead looks clear of obstacles. "
+                                          "Keep going straight and I will tell you before the next turn.")]
+        return [genai_types.Part(text="I am here to help you get there safely. "
+                                      "Ask me about the route or what is around you at any time.")]
+
+    @staticmethod
+    def _usage(contents: List[genai_types.Content], config, parts: List[genai_types.Part]):
+        chars = sum(len(p.text or "") for c in contents for p in c.parts or [])
+        images = sum(1 for c in contents for p in c.parts or [] if p.inline_data)
+        cached = 2500 if config is not None and config.cached_content else 0
+        output = sum(len(p.text or "") for p in parts) // 4 + 10
+        return genai_types.GenerateContentResponseUsageMetadata(
+            prompt_token_count=2500 + chars // 4 + 258 * images,
+            cached_content_token_count=cached or None, candidates_token_count=output)
+
+    def _response(self, parts, usage=None, finished=True) -> genai_types.GenerateContentResponse:
+        return genai_types.GenerateContentResponse(
+            candidates=[genai_types.Candidate(content=genai_types.Content(role="model", parts=parts),
+                                              finish_reason=genai_types.FinishReason.STOP if finished else None)],
+            usage_metadata=usage)
+
+    async def generate_content(self, *, model, contents, config=None):
+        started = time.perf_counter()
+        parts = self.reply(contents)
+        await asyncio.sleep(self.latency)
+        charge("model", started)
+        return self._response(parts, self._usage(contents, config, parts))
+
+    async def generate_content_stream(self, *, model, contents, config=None):
+        parts = self.reply(contents)
+        usage = self._usage(contents, config, parts)
+
+        async def chunks():
+            started = time.perf_counter()
+            try:
+                await asyncio.sleep(self.latency)
+                if parts[0].function_call:
+                    yield self._response(parts, usage)
+                    return
+                words = parts[0].text.split(" ")
+                for i in range(0, len(words), self.words_per_chunk):
+                    if i:
+                        await asyncio.sleep(self.chunk_latency)
+                    done = i + self.words_per_chunk >= len(words)
+                    text = " ".join(words[i:i + self.words_per_chunk]) + ("" if done else " ")
+                    yield self._response([genai_types.Part(text=text)], usage if done else None, finished=done)
+            finally:
+                charge("model", started)
+        return chunks()
+
+    async def create_cache(self, *, model, config=None):
+        started = time.perf_counter()
+        await asyncio.sleep(self.latency)
+        charge("prompt_cache", started)
+        return genai_types.CachedContent(name=f"cachedContents/replay-{_digest(str(config.display_name))}",
+                                         model=model)
+
+    async def delete_cache(self, *, name, config=None):
+        return None
+
+    def install(self) -> None:
+        # Every session key maps to the same pooled client in the replay (one GEMINI_API_KEY)
+        aio = navigator.client.aio
+        aio.models.generate_content = self.generate_content
+        aio.models.generate_content_stream = self.generate_content_stream
+        aio.caches.create = self.create_cache
+        aio.caches.delete = self.delete_cache
+
+
+class FakeASR(asr.ASRBackend):
+    """Returns the transcript recorded with the audio in the trace, after `latency` seconds."""
+
+    name = "replay"
+
+    def __init__(self, latency: float = 0.3):
+        self.latency = latency
+
+    async def transcribe(self, pcm: bytes, sample_rate: int) -> Optional[str]:
+        started = time.perf_counter()
+        await asyncio.sleep(self.latency)
+        charge("asr", started)
+        log = session_log.get()
+        return (log.transcript if log is not None else None) or "Where am I?"
+
+    def install(self) -> None:
+        asr.set_backend(self)
@@ -0,0 +1,68 @@
+"""Synthetic Routes API responses for the benchmarks (no Maps key needed)."""
+
+import math
+import random
+
+import polyline
+
+METERS_PER_DEGREE = 111320.0
+
+
+def make_route(n_steps, start=(24.9924, 121.4990), step_meters=80, vertices_per_step=4, seed=0):
+    """
+    A walking route shaped like a Routes API `routes[0]`: n_steps steps that
+    alternate between heading north and heading east/west, each with a few
+    jittered polyline vertices and a navigationInstruction.
+    """
+    rng = random.Random(seed)
+    lat, lng = start
+    steps, route_path = [], [start]
+    headings = [0, 90, 0, 270]  # north, east, north, west: a long zigzag
+    maneuvers = {0: "TURN_LEFT", 90: "TURN_RIGHT", 270: "TURN_LEFT"}
+    for i in range(n_steps):
+        heading = math.radians(headings[i % len(headings)])
+        path = [(lat, lng)]
+        for v in range(1, vertices_per_step + 1):
+            d = step_meters * v / vertices_per_step
+            jitter = rng.uniform(-1.5, 1.5) if v < vertices_per_step else 0.0
+            dn = d * math.cos(heading) + jitter * math.sin(heading)
+            de = d * math.sin(heading) + jitter * math.cos(heading)
+            path.append((lat + dn / METERS_PER_DEGREE,
+                         lng + de / (METERS_PER_DEGREE * math.cos(math.radians(lat)))))
+        path = [(round(a, 5), round(b, 5)) for a, b in path]
+        next_heading = headings[(i + 1) % len(headings)]
+        steps.append({
+            "distanceMeters": step_meters,
+            "staticDuration": f"{int(step_meters / 1.3)}s",
+            "polyline": {"encodedPolyline": polyline.encode(path)},
+            "startLocation": {"latLng": {"latitude": path[0][0], "longitude": path[0][1]}},
+            "endLocation": {"latLng": {"latitude": path[-1][0], "longitude": path[-1][1]}},
+            "navigationInstruction": {
+                "maneuver": maneuvers[next_heading] if i else "DEPART",
+                "instructions": f"Walk {step_meters} m (step {i})",
+            },
+        })
+        route_path.extend(path[1:])
+        lat, lng = path[-1]
+    return {
+        "distanceMeters": step_meters * n_steps,
+        "duration": f"{int(step_meters * n_steps / 1.3)}s",
+        "polyline": {"encodedPolyline": polyline.encode(route_path)},
+        "legs": [{"steps": steps}],
+    }
+
+
+def route_path(route):
+    return polyline.decode(route["polyline"]["encodedPolyline"])
+
+
+def sample_fixes(route, count, noise_meters=8.0, seed=1):
+    """GPS fixes scattered around random vertices of the route."""
+    rng = random.Random(seed)
+    path = route_path(route)
+    fixes = []
+    for _ in range(count):
+        lat, lng = rng.choice(path)
+        fixes.append((lat + rng.gauss(0, noise_meters) / METERS_PER_DEGREE,
+                      lng + rng.gauss(0, noise_meters) / (METERS_PER_DEGREE * math.cos(math.radians(lat)))))
+    return fixes
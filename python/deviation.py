@@ -1,7 +1,12 @@
 
 import math
+from typing import NamedTuple
+
+import numpy as np
 import polyline
-from shapely.geometry import Point, LineString
+import shapely
+
+EARTH_RADIUS_METERS = 6371000
 
 
 def decode_google_polyline(encoded_polyline_string):
@@ -15,7 +20,7 @@ def decode_google_polyline(encoded_polyline_string):
 
 def haversine_distance(lat1, lon1, lat2, lon2):
     """Calculates great-circle distance in meters between two lat/lon points."""
-    R = 6371000  # Earth radius in meters
+    R = EARTH_RADIUS_METERS
     phi1, phi2 = math.radians(lat1), math.radians(lat2)
     delta_phi = math.radians(lat2 - lat1)
     delta_lambda = math.radians(lon2 - lon1)
@@ -26,37 +31,392 @@ def haversine_distance(lat1, lon1, lat2, lon2):
     return R * c
 
 
+class LocalFrame:
+    """
+    Local equirectangular (east/north, meters) projection around a reference
+    point. Accurate to well under a meter over the few kilometers a walking
+    route spans; works on scalars and NumPy arrays alike.
+    """
+
+    def __init__(self, ref_lat, ref_lon):
+        self.ref_lat = ref_lat
+        self.ref_lon = ref_lon
+        self.meters_per_deg_lat = math.radians(1) * EARTH_RADIUS_METERS
+        self.meters_per_deg_lon = self.meters_per_deg_lat * math.cos(math.radians(ref_lat))
+
+    def to_xy(self, lat, lon):
+        return ((np.asarray(lon, dtype=float) - self.ref_lon) * self.meters_per_deg_lon,
+                (np.asarray(lat, dtype=float) - self.ref_lat) * self.meters_per_deg_lat)
+
+    def to_latlon(self, x, y):
+        return (self.ref_lat + np.asarray(y) / self.meters_per_deg_lat,
+                self.ref_lon + np.asarray(x) / self.meters_per_deg_lon)
+
+
+class RouteMatch(NamedTuple):
+    distance_meters: float   # from the point to the closest point of the route
+    segment_index: int       # segment holding that closest point
+    fraction: float          # along-track position inside the segment, 0..1
+
+
+def point_segment_distances(px, py, ax, ay, bx, by):
+    """
+    Exact planar distances from point(s) to segment(s); inputs broadcast.
+    Returns (distances, fractions) where fraction is the clamped projection
+    parameter along each segment.
+    """
+    dx, dy = bx - ax, by - ay
+    length_sq = dx * dx + dy * dy
+    safe = np.where(length_sq > 0, length_sq, 1.0)
+    t = np.clip(np.where(length_sq > 0, ((px - ax) * dx + (py - ay) * dy) / safe, 0.0), 0.0, 1.0)
+    return np.hypot(ax + t * dx - px, ay + t * dy - py), t
+
+
+class RouteSegments:
+    """
+    Route segments projected once into a LocalFrame. Scoring a point is a
+    single vectorized pass over every (or a chosen subset of) segment.
+    """
+
+    # Fixes scored per block in project_many, bounds the (fixes x segments) temporaries
+    BATCH_CELLS = 1 << 20
+
+    def __init__(self, seg_a, seg_b, frame=None):
+        seg_a = np.asarray(seg_a, dtype=float).reshape(-1, 2)   # (lat, lon) of segment starts
+        seg_b = np.asarray(seg_b, dtype=float).reshape(-1, 2)   # (lat, lon) of segment ends
+        if frame is None:
+            ref = np.vstack([seg_a, seg_b]).mean(axis=0) if len(seg_a) else (0.0, 0.0)
+            frame = LocalFrame(float(ref[0]), float(ref[1]))
+        self.frame = frame
+        self.seg_a, self.seg_b = seg_a, seg_b
+        self.ax, self.ay = frame.to_xy(seg_a[:, 0], seg_a[:, 1])
+        self.bx, self.by = frame.to_xy(seg_b[:, 0], seg_b[:, 1])
+        self.length = np.hypot(self.bx - self.ax, self.by - self.ay)
+        # Distance along the route to the start of each segment
+        self.offset = np.concatenate([[0.0], np.cumsum(self.length)[:-1]]) if len(self.length) else self.length
+
+    @classmethod
+    def from_path(cls, route_coordinates, frame=None):
+        path = list(route_coordinates)
+        if len(path) == 1:
+            path = path * 2
+        return cls(path[:-1], path[1:], frame)
+
+    def __len__(self):
+        return len(self.length)
+
+    def project(self, user_lat, user_lon, segments=None):
+        """Closest point of the route (or of the given segment subset) to one fix."""
+        if not len(self):
+            return None
+        idx = np.arange(len(self)) if segments is None else np.asarray(segments, dtype=int)
+        if not len(idx):
+            return None
+        px, py = self.frame.to_xy(user_lat, user_lon)
+        d, t = point_segment_distances(px, py, self.ax[idx], self.ay[idx], self.bx[idx], self.by[idx])
+        best = int(np.argmin(d))
+        return RouteMatch(float(d[best]), int(idx[best]), float(t[best]))
+
+    def project_many(self, user_lats, user_lons):
+        """
+        Batch version of project for many fixes against this route, e.g. for
+        replays and analytics. Returns arrays (distances, segment_indices, fractions).
+        """
+        lats = np.asarray(user_lats, dtype=float).ravel()
+        lons = np.asarray(user_lons, dtype=float).ravel()
+        distances = np.full(len(lats), np.inf)
+        indices = np.full(len(lats), -1, dtype=int)
+        fractions = np.zeros(len(lats))
+        if not len(self) or not len(lats):
+            return distances, indices, fractions
+
+        px, py = self.frame.to_xy(lats, lons)
+        block = max(1, self.BATCH_CELLS // len(self))
+        for start in range(0, len(lats), block):
+            sl = slice(start, start + block)
+            d, t = point_segment_distances(px[sl, None], py[sl, None], self.ax, self.ay, self.bx, self.by)
+            best = np.argmin(d, axis=1)
+            rows = np.arange(len(best))
+            distances[sl], indices[sl], fractions[sl] = d[rows, best], best, t[rows, best]
+        return distances, indices, fractions
+
+    def along_track_meters(self, match):
+        """Distance along the route from its start to the matched point."""
+        return float(self.offset[match.segment_index] + match.fraction * self.length[match.segment_index])
+
+    def point_at_distance(self, meters):
+        """(lat, lon) of the point `meters` along the route, clamped to its ends."""
+        if not len(self):
+            return None
+        meters = min(max(meters, 0.0), float(self.offset[-1] + self.length[-1]))
+        i = int(np.clip(np.searchsorted(self.offset, meters, side='right') - 1, 0, len(self) - 1))
+        t = (meters - self.offset[i]) / self.length[i] if self.length[i] > 0 else 0.0
+        return self.point_at(RouteMatch(0.0, i, float(min(t, 1.0))))
+
+    def point_at(self, match):
+        """(lat, lon) of the matched point on the route."""
+        i, t = match.segment_index, match.fraction
+        x = self.ax[i] + t * (self.bx[i] - self.ax[i])
+        y = self.ay[i] + t * (self.by[i] - self.ay[i])
+        lat, lon = self.frame.to_latlon(x, y)
+        return float(lat), float(lon)
+
+
 def shortest_distance_to_route(user_lat, user_lon, route_coordinates):
     """
     Calculates the shortest distance (in meters) from a user's location
-    to the route using Shapely.
+    to the route, exactly, in a local metric frame around the route.
     """
     if not route_coordinates:
         return float('inf')
 
-    user_point_shapely = Point(user_lon, user_lat)  # Shapely uses (lon, lat)
+    return RouteSegments.from_path(route_coordinates).project(user_lat, user_lon).distance_meters
 
-    if len(route_coordinates) == 1:  # Route is a single point
-        r_lat, r_lon = route_coordinates[0]
-        return haversine_distance(user_lat, user_lon, r_lat, r_lon)
 
-    # Convert route to Shapely LineString (lon, lat format)
-    route_linestring_coords = [(lon, lat) for lat, lon in route_coordinates]
-    route_line = LineString(route_linestring_coords)
+def trim_route_coordinates(user_lat, user_lon, route_coordinates):
+    """
+    Returns the part of the route that is still ahead of the user: the route
+    is cut at the user's projection onto it, same (lat, lon) format as input.
+    """
+    if len(route_coordinates) < 2:
+        return list(route_coordinates)
 
-    # Find the closest point on the line to the user's point
-    closest_point_on_line = route_line.interpolate(
-        route_line.project(user_point_shapely))
-    closest_lon, closest_lat = closest_point_on_line.x, closest_point_on_line.y
+    segments = RouteSegments.from_path(route_coordinates)
+    match = segments.project(user_lat, user_lon)
+    return [segments.point_at(match)] + [tuple(c) for c in route_coordinates[match.segment_index + 1:]]
 
-    return haversine_distance(user_lat, user_lon, closest_lat, closest_lon)
+
+def path_length_meters(route_coordinates):
+    """Sum of haversine distances along a (lat, lon) path."""
+    return sum(
+        haversine_distance(a[0], a[1], b[0], b[1])
+        for a, b in zip(route_coordinates, route_coordinates[1:])
+    )
+
+
+def _duration_seconds(duration):
+    # Routes API durations look like "123s"
+    try:
+        return float(str(duration).rstrip('s')) if duration else 0.0
+    except ValueError:
+        return 0.0
+
+
+class CompiledRoute:
+    """
+    A route with its step polylines decoded once into RouteSegments and an
+    STRtree over all segments (in the route's local metric frame), so step
+    lookups and deviation checks become an index query plus a local search
+    over the few segments near the user.
+    """
+
+    def __init__(self, route):
+        self.route = route
+        self.steps = []            # (leg_index, step_index, step) in route order
+        seg_a, seg_b, seg_step = [], [], []
+
+        for leg_index, leg in enumerate(route.get('legs', [])):
+            for step_index, step in enumerate(leg.get('steps', [])):
+                encoded = step.get('polyline', {}).get('encodedPolyline')
+                path = decode_google_polyline(encoded) if encoded else []
+                if not path:
+                    continue
+                if len(path) == 1:  # a single-point step still needs one segment
+                    path = [path[0], path[0]]
+                position = len(self.steps)
+                self.steps.append((leg_index, step_index, step))
+                seg_a.extend(path[:-1])
+                seg_b.extend(path[1:])
+                seg_step.extend([position] * (len(path) - 1))
+
+        self.segments = RouteSegments(seg_a, seg_b)
+        self.seg_step = np.array(seg_step, dtype=int)
+        # Per step: first segment, along-route offsets of its start/end, static duration
+        positions = np.arange(len(self.steps))
+        self.step_first_segment = np.searchsorted(self.seg_step, positions, side='left')
+        step_last_segment = np.searchsorted(self.seg_step, positions, side='right') - 1
+        self.step_start_offset = self.segments.offset[self.step_first_segment] if len(self.steps) else np.zeros(0)
+        self.step_end_offset = (self.segments.offset[step_last_segment] + self.segments.length[step_last_segment]
+                                if len(self.steps) else np.zeros(0))
+        self.step_seconds = np.array([_duration_seconds(step.get('staticDuration')) for _, _, step in self.steps])
+        self.total_length = float(self.step_end_offset[-1]) if len(self.steps) else 0.0
+        s = self.segments
+        self.tree = shapely.STRtree(shapely.linestrings(
+            np.stack([np.column_stack([s.ax, s.ay]), np.column_stack([s.bx, s.by])], axis=1))) if len(s) else None
+
+    def __len__(self):
+        return len(self.steps)
+
+    def segments_near(self, user_lat, user_lon, radius_meters):
+        """Indices of segments whose bounding box is within radius_meters of the user."""
+        if self.tree is None:
+            return np.empty(0, dtype=int)
+        x, y = self.segments.frame.to_xy(user_lat, user_lon)
+        window = shapely.box(x - radius_meters, y - radius_meters, x + radius_meters, y + radius_meters)
+        return np.sort(self.tree.query(window))
+
+    def project(self, user_lat, user_lon, search_radius_meters=None):
+        """
+        RouteMatch of the user against the route. With a search radius only
+        nearby segments are examined (None if there are none).
+        """
+        segments = None
+        if search_radius_meters is not None:
+            segments = self.segments_near(user_lat, user_lon, search_radius_meters)
+        return self.segments.project(user_lat, user_lon, segments)
+
+    def project_many(self, user_lats, user_lons):
+        """Batch-score many fixes against the whole route, see RouteSegments.project_many."""
+        return self.segments.project_many(user_lats, user_lons)
+
+    def distance_to_route(self, user_lat, user_lon, search_radius_meters=None):
+        """Shortest distance in meters from the user to the route (inf if none found)."""
+        match = self.project(user_lat, user_lon, search_radius_meters)
+        return match.distance_meters if match else float('inf')
+
+    def step_of_segment(self, segment_index):
+        leg_index, step_index, step = self.steps[int(self.seg_step[segment_index])]
+        return {"leg_index": leg_index, "step_index": step_index, "step_info": step}
+
+    def current_step(self, user_lat, user_lon, tolerance_meters):
+        """Equivalent of get_current_step on the raw route, answered from the index."""
+        segments = self.segments_near(user_lat, user_lon, tolerance_meters)
+        if not len(segments):
+            return None
+        px, py = self.segments.frame.to_xy(user_lat, user_lon)
+        s = self.segments
+        distances, _ = point_segment_distances(px, py, s.ax[segments], s.ay[segments], s.bx[segments], s.by[segments])
+        within = distances <= tolerance_meters
+        if not within.any():
+            return None
+        # Earliest step in route order that is within tolerance
+        return self.step_of_segment(segments[within][np.argmin(self.seg_step[segments][within])])
+
+
+class RouteProgressTracker:
+    """
+    Per-session progress along one CompiledRoute. Remembers the last matched
+    segment and searches a forward window from there first, so each GPS fix
+    costs O(window) and the reported step never jumps backwards at
+    intersections, switchbacks or where steps overlap. Falls back to the
+    STRtree (still never behind the current step) when the window misses.
+
+    Candidates are scored by their distance to the fix plus a penalty for
+    along-route jumps beyond what walking since the last match explains, and
+    the earliest one within tie_meters of the best score wins. Where the route
+    comes back along itself (out-and-back, switchbacks, the other sidewalk),
+    the later leg is only taken once continuity supports it.
+    """
+
+    def __init__(self, compiled_route, tolerance_meters=100, window_segments=40,
+                 backtrack_segments=2, walking_speed_mps=1.3, forward_slack_meters=20,
+                 backward_slack_meters=15, continuity_weight=1.0, tie_meters=5):
+        self.compiled = compiled_route
+        self.tolerance_meters = tolerance_meters
+        self.window_segments = window_segments
+        self.backtrack_segments = backtrack_segments   # GPS jitter allowance, matching only
+        self.walking_speed_mps = walking_speed_mps     # for steps without a staticDuration
+        self.forward_slack_meters = forward_slack_meters    # along-route jump free of penalty
+        self.backward_slack_meters = backward_slack_meters
+        self.continuity_weight = continuity_weight     # meters of score per meter of excess jump
+        self.tie_meters = tie_meters
+        self.last_segment = None
+        self.last_position = 0                          # index into compiled.steps
+        self.distance_along_route = 0.0
+        self.last_progress = None
+        lengths = compiled_route.step_end_offset - compiled_route.step_start_offset
+        self._step_seconds = np.where(compiled_route.step_seconds > 0, compiled_route.step_seconds,
+                                      lengths / walking_speed_mps)
+        # Seconds of every step after a given one, so ETA stays O(1) per fix
+        self._seconds_after = np.concatenate([np.cumsum(self._step_seconds[::-1])[::-1][1:], [0.0]]) \
+            if len(self._step_seconds) else self._step_seconds
+
+    def _best(self, user_lat, user_lon, segment_indices):
+        if not len(segment_indices):
+            return None
+        s = self.compiled.segments
+        idx = np.asarray(segment_indices, dtype=int)
+        px, py = s.frame.to_xy(user_lat, user_lon)
+        d, t = point_segment_distances(px, py, s.ax[idx], s.ay[idx], s.bx[idx], s.by[idx])
+        within = d <= self.tolerance_meters
+        if not within.any():
+            return None
+        idx, d, t = idx[within], d[within], t[within]
+        along = s.offset[idx] + t * s.length[idx]
+        jump = along - self.distance_along_route
+        cost = d + self.continuity_weight * (np.maximum(0.0, jump - self.forward_slack_meters) +
+                                             np.maximum(0.0, -jump - self.backward_slack_meters))
+        close = np.flatnonzero(cost <= cost.min() + self.tie_meters)
+        best = close[np.argmin(along[close])]
+        return RouteMatch(float(d[best]), int(idx[best]), float(t[best]))
+
+    def _match(self, user_lat, user_lon):
+        start = 0 if self.last_segment is None else max(0, self.last_segment - self.backtrack_segments)
+        end = min(len(self.compiled.segments), (self.last_segment or 0) + self.window_segments)
+        match = self._best(user_lat, user_lon, np.arange(start, end))
+        if match is not None:
+            return match
+
+        near = self.compiled.segments_near(user_lat, user_lon, self.tolerance_meters)
+        return self._best(user_lat, user_lon, near[near >= start])
+
+    def update(self, user_lat, user_lon):
+        """
+        Matches one fix. Returns the current step in the get_current_step
+        format extended with progress figures, or None when the fix is not
+        within tolerance of the route ahead (the tracker state is kept).
+        """
+        if not len(self.compiled.segments):
+            return None
+        match = self._match(user_lat, user_lon)
+        if match is None:
+            return None
+
+        c = self.compiled
+        position = max(int(c.seg_step[match.segment_index]), self.last_position)
+        along = max(c.segments.along_track_meters(match), float(c.step_start_offset[position]),
+                    self.distance_along_route)
+        if self.last_segment is None or match.segment_index > self.last_segment:
+            self.last_segment = match.segment_index
+        self.last_position = position
+        self.distance_along_route = along
+
+        step_end = float(c.step_end_offset[position])
+        step_length = step_end - float(c.step_start_offset[position])
+        to_maneuver = max(0.0, step_end - along)
+        eta = (to_maneuver / step_length * self._step_seconds[position] if step_length > 0 else 0.0)
+        eta += self._seconds_after[position]
+
+        progress = c.step_of_segment(c.step_first_segment[position])
+        next_step = c.steps[position + 1][2] if position + 1 < len(c.steps) else None
+        progress.update({
+            "distance_from_route_meters": round(match.distance_meters, 1),
+            "distance_along_route_meters": round(along, 1),
+            "distance_to_next_maneuver_meters": round(to_maneuver, 1),
+            "remaining_distance_meters": round(max(0.0, c.total_length - along), 1),
+            "eta_remaining_seconds": int(round(eta)),
+            "next_instruction": (next_step or {}).get("navigationInstruction"),
+            "is_last_step": next_step is None,
+        })
+        self.last_progress = progress
+        return progress
+
+    def step_of_route(self):
+        """(1-based number of the current step, number of steps), counted across all legs."""
+        return self.last_position + 1, len(self.compiled)
 
 
 def has_user_deviated(user_lat, user_lon, route_coordinates, deviation_tolerance_meters):
     """
     Checks if the user has deviated from the route beyond a given tolerance.
-    The route_coordinates here represent the *entire* path.
+    The route_coordinates here represent the *entire* path, either as a list
+    of (lat, lon) or as a CompiledRoute.
     """
+    if isinstance(route_coordinates, CompiledRoute):
+        # Only segments inside the tolerance window can disprove a deviation
+        return route_coordinates.distance_to_route(
+            user_lat, user_lon, deviation_tolerance_meters) > deviation_tolerance_meters
+
     if not route_coordinates:
         print("Route is empty for deviation check. Assuming deviation.")
         return True
@@ -75,13 +435,15 @@ def get_current_step(user_lat, user_lon, route, tolerance_meters):
     Args:
         user_lat (float): User's current latitude.
         user_lon (float): User's current longitude.
-        google_routes_response (dict): The full JSON response from Google Directions API.
+        route (dict | CompiledRoute): A route from the Routes API, or its CompiledRoute.
         tolerance_meters (float): Maximum distance in meters to consider the user "on" a step.
 
     Returns:
         dict: The step object the user is on, or None if not on any step within tolerance.
               Returns a tuple (leg_index, step_index, step_object) if found.
     """
+    if isinstance(route, CompiledRoute):
+        return route.current_step(user_lat, user_lon, tolerance_meters)
 
     for leg_index, leg in enumerate(route.get('legs', [])):
         for step_index, step in enumerate(leg.get('steps', [])):
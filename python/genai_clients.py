@@ -0,0 +1,48 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Dict, Optional
+
+from google import genai
+
+# One genai.Client per distinct Gemini API key, shared by every session that
+# uses that key, so a session with its own key (CreateSessionRequest.gemini_api_key)
+# gets its own client without paying for a new HTTP connection pool each time.
+# The pool is bounded; the least recently used client is dropped from the
+# registry, while chats created from it keep working until they go away.
+
+GEMINI_CLIENT_POOL_MAX = int(os.getenv("GEMINI_CLIENT_POOL_MAX", "32"))
+
+
+class ClientRegistry:
+    def __init__(self, max_clients: int = GEMINI_CLIENT_POOL_MAX):
+        self.max_clients = max_clients
+        self._clients: "OrderedDict[str, genai.Client]" = OrderedDict()
+        self._lock = threading.Lock()
+        self.stats = {"hits": 0, "misses": 0, "evictions": 0}
+
+    def get(self, api_key: Optional[str]) -> genai.Client:
+        key = api_key or ""
+        with self._lock:
+            client = self._clients.get(key)
+            if client is not None:
+                self._clients.move_to_end(key)
+                self.stats["hits"] += 1
+                return client
+            self.stats["misses"] += 1
+            client = genai.Client(api_key=api_key)  # None falls back to the environment
+            self._clients[key] = client
+            while len(self._clients) > self.max_clients:
+                self._clients.popitem(last=False)
+                self.stats["evictions"] += 1
+            return client
+
+    def snapshot(self) -> Dict[str, int]:
+        return {"clients": len(self._clients), **self.stats}
+
+
+registry = ClientRegistry()
+
+
+def get_client(api_key: Optional[str]) -> genai.Client:
+    return registry.get(api_key)
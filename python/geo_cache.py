@@ -0,0 +1,245 @@
+import os
+import copy
+import json
+import math
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from typing import Any, Awaitable, Callable, Dict, Hashable, Optional, Tuple, TypeVar
+
+# Response cache for the geocode / reverse-geocode / places helpers in navigator.
+# Entries expire after a TTL, the least recently used ones are evicted once the
+# entry or byte budget is exceeded, and concurrent misses on the same key share
+# one upstream request. An optional sqlite file lets entries survive restarts.
+# Callers get their own copy of a cached value, never the stored object.
+
+GEO_CACHE_SQLITE_PATH = os.getenv("GEO_CACHE_SQLITE_PATH")  # unset = memory only
+GEO_CACHE_MAX_ENTRIES = int(os.getenv("GEO_CACHE_MAX_ENTRIES", "5000"))
+GEO_CACHE_MAX_BYTES = int(os.getenv("GEO_CACHE_MAX_BYTES", str(32 * 1024 * 1024)))
+
+EARTH_METERS_PER_DEGREE = 111320.0
+
+
+def normalize_query(query: str) -> str:
+    """Case/width/whitespace-insensitive form of a free-text place query."""
+    return " ".join(unicodedata.normalize("NFKC", query).casefold().split())
+
+
+def grid_cell(lat: float, lng: float, cell_meters: float) -> str:
+    """Snaps a coordinate to a roughly square grid cell of the given size."""
+    lat_step = cell_meters / EARTH_METERS_PER_DEGREE
+    lat_index = math.floor(lat / lat_step)
+    # Longitude degrees shrink with latitude; size the column from the cell's own row.
+    cos_lat = max(math.cos(math.radians((lat_index + 0.5) * lat_step)), 1e-6)
+    lng_index = math.floor(lng / (lat_step / cos_lat))
+    return f"{cell_meters:g}m:{lat_index}:{lng_index}"
+
+
+class _SqliteTier:
+    def __init__(self, path: str):
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False)
+        with self._lock:
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS geo_cache ("
+                "namespace TEXT, key TEXT, value TEXT, expires_at REAL, "
+                "PRIMARY KEY (namespace, key))"
+            )
+            self._conn.commit()
+
+    def get(self, namespace: str, key: str) -> Optional[Tuple[Any, float]]:
+        with self._lock:
+            row = self._conn.execute(
+                "SELECT value, expires_at FROM geo_cache WHERE namespace = ? AND key = ?",
+                (namespace, key),
+            ).fetchone()
+        if not row or row[1] < time.time():
+            return None
+        return json.loads(row[0]), row[1]
+
+    def put(self, namespace: str, key: str, value: Any, expires_at: float) -> None:
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO geo_cache VALUES (?, ?, ?, ?)",
+                (namespace, key, json.dumps(value), expires_at),
+            )
+            self._conn.commit()
+
+    def purge_expired(self) -> None:
+        with self._lock:
+            self._conn.execute("DELETE FROM geo_cache WHERE expires_at < ?", (time.time(),))
+            self._conn.commit()
+
+    def close(self) -> None:
+        with self._lock:
+            self._conn.close()
+
+
+_disk: Optional[_SqliteTier] = None
+
+
+def _disk_tier() -> Optional[_SqliteTier]:
+    global _disk
+    if _disk is None and GEO_CACHE_SQLITE_PATH:
+        try:
+            _disk = _SqliteTier(GEO_CACHE_SQLITE_PATH)
+            _disk.purge_expired()
+        except sqlite3.Error as e:
+            logging.error(f"geo_cache: cannot open sqlite tier at {GEO_CACHE_SQLITE_PATH}: {e}")
+    return _disk
+
+
+T = TypeVar("T")
+
+
+class _Flight:
+    def __init__(self, task: asyncio.Task):
+        self.task = task
+        self.waiters = 0
+
+
+class SingleFlight:
+    """
+    Concurrent calls with the same key share one run of their coroutine. The
+    run is a task of its own: a caller that is cancelled (its client went away)
+    only stops waiting, everyone else still gets the result. The run itself
+    is cancelled once nobody waits for it any more.
+    """
+
+    def __init__(self):
+        self._flights: Dict[Hashable, _Flight] = {}
+
+    def __contains__(self, key: Hashable) -> bool:
+        return key in self._flights
+
+    def _forget(self, key: Hashable, flight: _Flight) -> None:
+        if self._flights.get(key) is flight:
+            del self._flights[key]
+
+    async def do(self, key: Hashable, run: Callable[[], Awaitable[T]]) -> T:
+        flight = self._flights.get(key)
+        if flight is None:
+            flight = self._flights[key] = _Flight(asyncio.ensure_future(run()))
+            flight.task.add_done_callback(lambda _: self._forget(key, flight))
+        flight.waiters += 1
+        try:
+            return await asyncio.shield(flight.task)
+        finally:
+            flight.waiters -= 1
+            if not flight.waiters and not flight.task.done():
+                self._forget(key, flight)  # a later caller starts a fresh run
+                flight.task.cancel()
+
+
+class TTLCache:
+    """TTL + LRU cache with single-flight fetches, bounded by entries and bytes."""
+
+    def __init__(self, namespace: str, ttl_seconds: float,
+                 max_entries: int = GEO_CACHE_MAX_ENTRIES, max_bytes: int = GEO_CACHE_MAX_BYTES,
+                 persistent: bool = True, sizeof: Optional[Callable[[Any], int]] = None):
+        self.namespace = namespace
+        self.ttl_seconds = ttl_seconds
+        self.max_entries = max_entries
+        self.max_bytes = max_bytes
+        self.persistent = persistent
+        # Budget accounting; JSON length by default, pass len for bytes values
+        self.sizeof = sizeof or (lambda value: len(json.dumps(value, default=str)))
+        self._entries: "OrderedDict[str, Tuple[float, int, Any]]" = OrderedDict()  # key -> (expires_at, size, value)
+        self._bytes = 0
+        self._inflight = SingleFlight()
+        self.stats = {"hits": 0, "misses": 0, "disk_hits": 0, "coalesced": 0, "evictions": 0, "expired": 0}
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: str) -> Optional[Any]:
+        """A copy of the live entry for key, or None."""
+        value = self.peek(key)
+        return None if value is None else copy.deepcopy(value)
+
+    def peek(self, key: str) -> Optional[Any]:
+        """The stored value itself (not a copy): read it, never modify it."""
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        expires_at, size, value = entry
+        if expires_at < time.time():
+            self._remove(key)
+            self.stats["expired"] += 1
+            return None
+        self._entries.move_to_end(key)
+        return value
+
+    def put(self, key: str, value: Any, expires_at: Optional[float] = None) -> None:
+        size = self.sizeof(value)
+        if size > self.max_bytes:
+            return
+        if key in self._entries:
+            self._remove(key)
+        self._entries[key] = (expires_at or time.time() + self.ttl_seconds, size, value)
+        self._bytes += size
+        while len(self._entries) > self.max_entries or self._bytes > self.max_bytes:
+            oldest = next(iter(self._entries))
+            self._remove(oldest)
+            self.stats["evictions"] += 1
+
+    def _remove(self, key: str) -> None:
+        _, size, _ = self._entries.pop(key)
+        self._bytes -= size
+
+    async def get_or_fetch(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        value = self.peek(key)
+        if value is not None:
+            self.stats["hits"] += 1
+        else:
+            if key in self._inflight:
+                self.stats["coalesced"] += 1
+            value = await self._inflight.do(key, lambda: self._load(key, fetch))
+        return copy.deepcopy(value)
+
+    async def _load(self, key: str, fetch: Callable[[], Awaitable[Any]]) -> Any:
+        disk = _disk_tier() if self.persistent else None
+        if disk:
+            stored = await asyncio.to_thread(disk.get, self.namespace, key)
+            if stored is not None:
+                self.stats["disk_hits"] += 1
+                value, expires_at = stored
+                self.put(key, value, expires_at)
+                return value
+
+        self.stats["misses"] += 1
+        value = await fetch()
+        expires_at = time.time() + self.ttl_seconds
+        self.put(key, value, expires_at)
+        if disk:
+            await asyncio.to_thread(disk.put, self.namespace, key, value, expires_at)
+        return value
+
+    def snapshot(self) -> Dict[str, Any]:
+        return {**self.stats, "entries": len(self._entries), "bytes": self._bytes}
+
+
+geocode_cache = TTLCache("geocode", ttl_seconds=float(os.getenv("GEOCODE_CACHE_TTL", str(24 * 3600))))
+reverse_geocode_cache = TTLCache("reverse_geocode", ttl_seconds=float(os.getenv("REVERSE_GEOCODE_CACHE_TTL", "3600")))
+search_places_cache = TTLCache("search_places", ttl_seconds=float(os.getenv("SEARCH_PLACES_CACHE_TTL", "600")))
+place_details_cache = TTLCache("place_details", ttl_seconds=float(os.getenv("PLACE_DETAILS_CACHE_TTL", "3600")))
+
+# Nearby reverse-geocodes share one entry; place searches share a coarser cell.
+REVERSE_GEOCODE_CELL_METERS = float(os.getenv("REVERSE_GEOCODE_CELL_METERS", "25"))
+SEARCH_PLACES_CELL_METERS = float(os.getenv("SEARCH_PLACES_CELL_METERS", "200"))
+
+
+def stats() -> Dict[str, Dict[str, Any]]:
+    return {c.namespace: c.snapshot() for c in
+            (geocode_cache, reverse_geocode_cache, search_places_cache, place_details_cache)}
+
+
+def close() -> None:
+    global _disk
+    if _disk is not None:
+        _disk.close()
+        _disk = None
@@ -0,0 +1,129 @@
+import re
+from typing import Dict, Optional, Tuple
+
+# Deterministic answers for the most common turns during active navigation
+# ("where am I", "what next", "how far"). They are built from the tracked step
+# and the route's navigationInstruction in well under a millisecond, without a
+# static map download or a Gemini round-trip. Anything open-ended, or asking
+# about what the camera sees, is left to the LLM.
+
+# Checked first: these always need the model (camera images, hazards, free questions)
+_LLM_ONLY = re.compile(
+    r"\b(?:obstacles?|hazards?|danger\w*|safe\w*|see|look\w*|front of me|ahead of me|cars?|traffic lights?|"
+    r"red light|crosswalk|describe|read|signs?|why|change|another|different|stop|end|cancel|"
+    r"new destination|instead)\b|"
+    r"障礙|危險|安全|看到|看見|前面有|紅綠燈|紅燈|斑馬線|描述|為什麼|改去|換|停止|結束|取消",
+    re.IGNORECASE,
+)
+_NEXT = re.compile(
+    r"\b(?:what(?:'s| is)? next|next (?:turn|step|instruction|maneuver)|where (?:do|should) i (?:go|turn)|"
+    r"which way|what now)\b|下一步|下個路口|怎麼走|往哪|接下來",
+    re.IGNORECASE,
+)
+_PROGRESS = re.compile(
+    r"\b(?:where am i|how far|how long|how much (?:longer|further)|are we there|"
+    r"am i (?:there|close|on (?:the )?(?:right )?(?:track|route))|progress|remaining|eta)\b|"
+    r"我在哪|還有多遠|多遠|多久|到了嗎|快到了|走對|進度",
+    re.IGNORECASE,
+)
+_CJK = re.compile(r"[一-鿿]")
+
+# Longer utterances are rarely simple progress questions
+MAX_FAST_PATH_CHARS = 60
+
+_MANEUVERS = {
+    "TURN_LEFT": ("turn left", "左轉"),
+    "TURN_RIGHT": ("turn right", "右轉"),
+    "TURN_SLIGHT_LEFT": ("bear slightly left", "稍微向左"),
+    "TURN_SLIGHT_RIGHT": ("bear slightly right", "稍微向右"),
+    "TURN_SHARP_LEFT": ("make a sharp left", "向左急轉"),
+    "TURN_SHARP_RIGHT": ("make a sharp right", "向右急轉"),
+    "UTURN_LEFT": ("make a U-turn to the left", "向左迴轉"),
+    "UTURN_RIGHT": ("make a U-turn to the right", "向右迴轉"),
+    "STRAIGHT": ("continue straight", "直走"),
+    "FORK_LEFT": ("keep left at the fork", "在岔路靠左"),
+    "FORK_RIGHT": ("keep right at the fork", "在岔路靠右"),
+    "ROUNDABOUT_LEFT": ("go left around the roundabout", "在圓環向左"),
+    "ROUNDABOUT_RIGHT": ("go right around the roundabout", "在圓環向右"),
+    "MERGE": ("merge", "匯入"),
+    "NAME_CHANGE": ("continue onto the next street", "繼續沿路直走"),
+    "DEPART": ("start walking", "出發"),
+}
+
+_stats = {"turns": 0, "fast_path": 0, "llm": 0}
+
+
+def is_zh(text: str) -> bool:
+    return bool(_CJK.search(text or ""))
+
+
+def classify_intent(text: str) -> Optional[str]:
+    """'next', 'progress' or None (meaning: ask the LLM)."""
+    text = (text or "").strip()
+    if not text or len(text) > MAX_FAST_PATH_CHARS or _LLM_ONLY.search(text):
+        return None
+    if _NEXT.search(text):
+        return "next"
+    if _PROGRESS.search(text):
+        return "progress"
+    return None
+
+
+def _round_meters(meters: float) -> int:
+    step = 5 if meters < 100 else 10
+    return int(max(step, round(meters / step) * step))
+
+
+def _instruction_text(instruction: Optional[Dict], zh: bool) -> str:
+    instruction = instruction or {}
+    maneuver = _MANEUVERS.get(instruction.get("maneuver", ""))
+    # Routes API instructions are already localized (languageCode zh-TW)
+    if zh and instruction.get("instructions"):
+        return instruction["instructions"].replace("\n", "，")
+    if maneuver:
+        return maneuver[1] if zh else maneuver[0]
+    return instruction.get("instructions", "").replace("\n", ", ") or ("繼續前進" if zh else "continue")
+
+
+def next_maneuver_text(progress: Dict, zh: bool = False) -> str:
+    to_maneuver = _round_meters(progress["distance_to_next_maneuver_meters"])
+    if progress.get("is_last_step"):
+        return f"目的地在前方約 {to_maneuver} 公尺。" if zh else f"Your destination is about {to_maneuver} meters ahead."
+    action = _instruction_text(progress.get("next_instruction"), zh)
+    return f"{to_maneuver} 公尺後，{action}。" if zh else f"In {to_maneuver} meters, {action}."
+
+
+def progress_text(progress: Dict, step_of_route: Tuple[int, int], zh: bool = False) -> str:
+    # step_of_route: RouteProgressTracker.step_of_route(); progress["step_index"] is per leg
+    remaining = _round_meters(progress["remaining_distance_meters"])
+    minutes = max(1, round(progress["eta_remaining_seconds"] / 60))
+    current = _instruction_text((progress.get("step_info") or {}).get("navigationInstruction"), zh)
+    position, step_count = step_of_route
+    if zh:
+        return (f"您在第 {position} 步，共 {step_count} 步：{current}。"
+                f"{next_maneuver_text(progress, zh)}距離目的地還有約 {remaining} 公尺，大約 {minutes} 分鐘。")
+    return (f"You are on step {position} of {step_count}: {current}. "
+            f"{next_maneuver_text(progress, zh)} About {remaining} meters and {minutes} "
+            f"minute{'s' if minutes != 1 else ''} to your destination.")
+
+
+def fast_path_response(user_input: str, progress: Optional[Dict], step_of_route: Tuple[int, int]) -> Optional[str]:
+    """
+    Answer for a navigation turn without the LLM, or None when the turn needs
+    the model. Every call is counted towards the fast-path share.
+    """
+    _stats["turns"] += 1
+    intent = classify_intent(user_input)
+    if intent is None or not progress:
+        _stats["llm"] += 1
+        return None
+    zh = is_zh(user_input)
+    _stats["fast_path"] += 1
+    if intent == "next":
+        return next_maneuver_text(progress, zh)
+    return progress_text(progress, step_of_route, zh)
+
+
+def stats() -> Dict[str, float]:
+    turns = _stats["turns"]
+    return {**_stats, "fast_path_share": round(_stats["fast_path"] / turns, 3) if turns else 0.0}
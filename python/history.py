@@ -0,0 +1,171 @@
+import os
+from typing import List, Optional
+
+from google.genai import types as genai_types
+
+import navigator
+from navigator import SessionState
+
+# Keeps the chat context of long sessions small. After every turn:
+#   * inline blobs (map overview, camera frames, inline audio) are replaced by a
+#     short placeholder in all but the last HISTORY_KEEP_BLOB_TURNS turns;
+#   * once the session's prompt grows past HISTORY_COMPACT_PROMPT_TOKENS, or more
+#     than HISTORY_KEEP_TURNS + HISTORY_COMPACT_SLACK turns are held, all but the
+#     last HISTORY_KEEP_TURNS turns are folded into one text digest (destination,
+#     navigation progress, recent requests and answers).
+# The digest is built from session state and the history itself, not by asking
+# the model, so compaction costs no extra round-trip.
+
+HISTORY_KEEP_TURNS = int(os.getenv("HISTORY_KEEP_TURNS", "4"))
+HISTORY_KEEP_BLOB_TURNS = int(os.getenv("HISTORY_KEEP_BLOB_TURNS", "1"))
+HISTORY_COMPACT_SLACK = int(os.getenv("HISTORY_COMPACT_SLACK", "6"))
+HISTORY_COMPACT_PROMPT_TOKENS = int(os.getenv("HISTORY_COMPACT_PROMPT_TOKENS", "16000"))
+# Exchanges quoted in the digest, newest last
+HISTORY_DIGEST_EXCHANGES = 8
+HISTORY_DIGEST_SNIPPET_CHARS = 160
+
+DIGEST_HEADER = "[Summary of the earlier conversation]"
+
+stats = {"blob_strips": 0, "blobs_removed": 0, "blob_bytes_removed": 0, "compactions": 0, "turns_compacted": 0}
+
+
+def split_turns(history: List[genai_types.Content]) -> List[List[genai_types.Content]]:
+    """Groups contents into turns, each starting at a user message."""
+    turns: List[List[genai_types.Content]] = []
+    for content in history:
+        if not turns or navigator.is_turn_start(content):
+            turns.append([])
+        turns[-1].append(content)
+    return turns
+
+
+def _is_digest(turn: List[genai_types.Content]) -> bool:
+    parts = turn[0].parts or []
+    return bool(parts and parts[0].text and parts[0].text.startswith(DIGEST_HEADER))
+
+
+def strip_blobs(content: genai_types.Content) -> Optional[genai_types.Content]:
+    """Copy of `content` without inline data, or None if it has none."""
+    parts = content.parts or []
+    if not any(p.inline_data for p in parts):
+        return None
+    new_parts = []
+    for part in parts:
+        if part.inline_data:
+            kind = (part.inline_data.mime_type or "data").split("/")[0]
+            new_parts.append(genai_types.Part(text=f"[{kind} omitted]"))
+        else:
+            new_parts.append(part)
+    return genai_types.Content(role=content.role, parts=new_parts)
+
+
+def _snippet(text: str) -> str:
+    text = " ".join(text.split())
+    limit = HISTORY_DIGEST_SNIPPET_CHARS
+    return text if len(text) <= limit else text[:limit - 1] + "…"
+
+
+def _turn_text(contents: List[genai_types.Content], role: str) -> str:
+    return " ".join(p.text for c in contents if c.role == role for p in c.parts or []
+                    if p.text and not p.text.startswith("["))
+
+
+def _progress_line(session_state: SessionState) -> str:
+    if session_state.status != "Navigating" or not session_state.compiled_route:
+        return "Status: idle, not navigating."
+    line = "Status: navigating"
+    tracker = session_state.progress_tracker
+    progress = tracker.last_progress if tracker else None
+    if progress:
+        number, count = tracker.step_of_route()
+        line += f"; on step {number} of {count}, about {int(progress['remaining_distance_meters'])} m remaining"
+    return line + "."
+
+
+def build_digest(session_state: SessionState, old_turns: List[List[genai_types.Content]]) -> str:
+    lines = [DIGEST_HEADER]
+    previous = [t for t in old_turns if _is_digest(t)]
+    old_turns = [t for t in old_turns if not _is_digest(t)]
+
+    destination = None
+    tools = []
+    exchanges = []
+    if previous:
+        # carry the earlier digest's facts forward
+        for line in previous[-1][0].parts[0].text.splitlines()[1:]:
+            if line.startswith("Destination: "):
+                destination = line[len("Destination: "):]
+            elif line.startswith("- "):
+                exchanges.append(line)
+    for turn in old_turns:
+        for content in turn:
+            for part in content.parts or []:
+                call = part.function_call
+                if call and call.name:
+                    tools.append(call.name)
+                    if call.name in ("compute_route", "restart_navigation"):
+                        args = call.args or {}
+                        destination = args.get("destination") or args.get("new_location") or destination
+        asked, answered = _turn_text(turn, "user"), _turn_text(turn, "model")
+        if asked or answered:
+            exchanges.append(f'- User: "{_snippet(asked)}" -> Assistant: "{_snippet(answered)}"')
+
+    lines.append(_progress_line(session_state))
+    if destination:
+        lines.append(f"Destination: {destination}")
+    if tools:
+        counts = {name: tools.count(name) for name in dict.fromkeys(tools)}
+        lines.append("Tools used: " + ", ".join(f"{n} x{c}" if c > 1 else n for n, c in counts.items()))
+    if exchanges:
+        lines.append("Earlier exchanges:")
+        lines.extend(exchanges[-HISTORY_DIGEST_EXCHANGES:])
+    return "\n".join(lines)
+
+
+def compact_history(session_state: SessionState, force: bool = False) -> bool:
+    """
+    Strips old blobs and, past the thresholds (or with force), folds old turns
+    into a digest, then rebuilds the session's chat. Returns True if the chat
+    was rebuilt. Call with the session's turn_lock held.
+    """
+    chat = session_state.chat
+    if not chat or not session_state.chat_manager or not session_state.chat_manager.config:
+        return False
+    history = chat.get_history()
+    # The route preamble is re-added by recreate_chat, it is neither compacted nor counted
+    turns = [t for t in split_turns(history) if not navigator.is_route_preamble(t[0])]
+    changed = False
+
+    held = len(turns) - (1 if turns and _is_digest(turns[0]) else 0)
+    if force or session_state.prompt_tokens > HISTORY_COMPACT_PROMPT_TOKENS \
+            or held > HISTORY_KEEP_TURNS + HISTORY_COMPACT_SLACK:
+        split = max(0, len(turns) - HISTORY_KEEP_TURNS)
+        old, recent = turns[:split], turns[split:]
+        if old and not (len(old) == 1 and _is_digest(old[0])):
+            digest = build_digest(session_state, old)
+            stats["compactions"] += 1
+            stats["turns_compacted"] += sum(1 for t in old if not _is_digest(t))
+            turns = [[genai_types.Content(role="user", parts=[genai_types.Part(text=digest)]),
+                      genai_types.Content(role="model", parts=[genai_types.Part(text="Understood.")])]] + recent
+            changed = True
+
+    keep_from = max(0, len(turns) - HISTORY_KEEP_BLOB_TURNS)
+    stripped = False
+    for turn in turns[:keep_from]:
+        for i, content in enumerate(turn):
+            replacement = strip_blobs(content)
+            if replacement is not None:
+                blobs = [p.inline_data.data or b"" for p in content.parts if p.inline_data]
+                stats["blobs_removed"] += len(blobs)
+                stats["blob_bytes_removed"] += sum(len(b) for b in blobs)
+                turn[i] = replacement
+                stripped = True
+    if stripped:
+        stats["blob_strips"] += 1
+        changed = True
+
+    if changed:
+        session_state.chat = session_state.chat_manager.recreate_chat([c for turn in turns for c in turn])
+        session_state.prompt_tokens = 0  # unknown until the next model call
+    return changed
+
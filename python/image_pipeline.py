@@ -0,0 +1,160 @@
+import io
+import os
+import time
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Sequence, Tuple
+
+from PIL import Image, ImageOps
+
+from live_api.frame_filter import difference_hash, hamming
+
+# Preprocessing for the camera images of a ChatStream turn, before they are
+# attached to the Gemini request: decode (at reduced DCT scale where possible),
+# apply the EXIF orientation, downscale to IMAGE_MAX_EDGE, re-encode as JPEG
+# without metadata, and drop frames that are near-identical to a frame the model
+# still has in its context (64-bit dHash, Hamming distance; the same hash as the
+# live API's frame gate). The newest frame of a turn is always sent: a scene can
+# change in ways that matter (a traffic light turning green) and still hash the
+# same, and the question is usually about what the camera sees now.
+#
+# Full-size phone photos go to a process pool so decoding never holds the GIL
+# of the event loop; images the client reports as already small are handled in
+# a worker thread, where the pool round-trip would cost more than the work.
+
+IMAGE_MAX_EDGE = int(os.getenv("IMAGE_MAX_EDGE", "1024"))
+IMAGE_JPEG_QUALITY = int(os.getenv("IMAGE_JPEG_QUALITY", "75"))
+IMAGE_DUPLICATE_BITS = int(os.getenv("IMAGE_DUPLICATE_BITS", "5"))
+IMAGE_PIPELINE_WORKERS = int(os.getenv("IMAGE_PIPELINE_WORKERS", str(min(4, os.cpu_count() or 1))))
+
+STAGES = ("decode", "resize", "encode", "hash")
+
+# (data, width hint, height hint); hints are 0 when the client didn't set them
+ImageInput = Tuple[bytes, int, int]
+
+_pool: Optional[ProcessPoolExecutor] = None
+_stats = {"images_in": 0, "images_out": 0, "dropped_duplicate": 0, "failed": 0, "pooled": 0,
+          "bytes_in": 0, "bytes_out": 0}
+_stage_seconds = {stage: 0.0 for stage in STAGES + ("total",)}
+
+
+def process_image(data: bytes, max_edge: int = IMAGE_MAX_EDGE,
+                  quality: int = IMAGE_JPEG_QUALITY) -> Tuple[bytes, int, Dict[str, float]]:
+    """
+    (jpeg, dhash, stage timings in seconds) for one image. Runs in a pool
+    worker, so it only takes and returns picklable values.
+    """
+    timings = {}
+    t0 = time.perf_counter()
+    image = Image.open(io.BytesIO(data))
+    # JPEG: let libjpeg decode at 1/2, 1/4 or 1/8 scale when the photo is that much too big
+    image.draft("RGB", (max_edge, max_edge))
+    image = ImageOps.exif_transpose(image)
+    image = image.convert("RGB")
+    t1 = time.perf_counter()
+    timings["decode"] = t1 - t0
+
+    if max(image.size) > max_edge:
+        image.thumbnail((max_edge, max_edge), Image.LANCZOS)
+    t2 = time.perf_counter()
+    timings["resize"] = t2 - t1
+
+    out = io.BytesIO()
+    # no exif= argument, so the metadata (GPS, device, thumbnail) is dropped
+    image.save(out, format="JPEG", quality=quality, optimize=True)
+    t3 = time.perf_counter()
+    timings["encode"] = t3 - t2
+
+    image_hash = difference_hash(image)
+    timings["hash"] = time.perf_counter() - t3
+    return out.getvalue(), image_hash, timings
+
+
+def _get_pool() -> Optional[ProcessPoolExecutor]:
+    global _pool
+    if _pool is None and IMAGE_PIPELINE_WORKERS > 0:
+        # spawn rather than fork: forking a process with live gRPC threads is unsafe
+        _pool = ProcessPoolExecutor(max_workers=IMAGE_PIPELINE_WORKERS,
+                                    mp_context=multiprocessing.get_context("spawn"))
+    return _pool
+
+
+def _is_small(width: int, height: int) -> bool:
+    return 0 < width <= IMAGE_MAX_EDGE and 0 < height <= IMAGE_MAX_EDGE
+
+
+async def _process(data: bytes, width: int, height: int) -> Tuple[bytes, int, Dict[str, float]]:
+    pool = _get_pool()
+    if pool is None or _is_small(width, height):
+        return await asyncio.to_thread(process_image, data)
+    _stats["pooled"] += 1
+    return await asyncio.get_running_loop().run_in_executor(pool, process_image, data)
+
+
+async def prepare_images(images: Sequence[ImageInput],
+                         context_hashes: Sequence[int] = ()) -> Tuple[List[bytes], List[Tuple[bytes, int]]]:
+    """
+    Processed images to send, in order, and (jpeg, dhash) of each one sent
+    that could be hashed. context_hashes are the hashes of frames the model
+    still has in its context (see navigator.frame_hashes_in_context). Older
+    frames within IMAGE_DUPLICATE_BITS of one of those, or of a newer frame
+    of the same turn, are dropped; the newest frame is always kept. Images
+    that fail to decode are passed through.
+    """
+    if not images:
+        return [], []
+    start = time.perf_counter()
+    results = await asyncio.gather(*(_process(data, width, height) for data, width, height in images),
+                                   return_exceptions=True)
+
+    kept: List[Tuple[bytes, Optional[int]]] = []
+    seen = list(context_hashes)
+    # Newest first, so that of a run of near-identical frames the latest is the one sent
+    for age, ((data, _, _), result) in enumerate(reversed(list(zip(images, results)))):
+        _stats["images_in"] += 1
+        _stats["bytes_in"] += len(data)
+        if isinstance(result, BaseException):
+            logging.warning(f"Image preprocessing failed, sending the original: {result}")
+            _stats["failed"] += 1
+            out, image_hash = data, None
+        else:
+            out, image_hash, timings = result
+            for stage, seconds in timings.items():
+                _stage_seconds[stage] += seconds
+            if age and any(hamming(image_hash, other) <= IMAGE_DUPLICATE_BITS for other in seen):
+                _stats["dropped_duplicate"] += 1
+                continue
+            seen.append(image_hash)
+        kept.append((out, image_hash))
+        _stats["images_out"] += 1
+        _stats["bytes_out"] += len(out)
+    kept.reverse()
+    _stage_seconds["total"] += time.perf_counter() - start
+    return [out for out, _ in kept], [(out, h) for out, h in kept if h is not None]
+
+
+async def startup() -> None:
+    """Starts the worker processes now rather than on the first photo."""
+    pool = _get_pool()
+    if pool is not None:
+        loop = asyncio.get_running_loop()
+        await asyncio.gather(*(loop.run_in_executor(pool, time.sleep, 0) for _ in range(IMAGE_PIPELINE_WORKERS)))
+
+
+def shutdown() -> None:
+    global _pool
+    if _pool is not None:
+        _pool.shutdown(wait=False, cancel_futures=True)
+        _pool = None
+
+
+def stats() -> Dict[str, float]:
+    processed = max(1, _stats["images_in"] - _stats["failed"])
+    return {
+        **_stats,
+        "bytes_saved": _stats["bytes_in"] - _stats["bytes_out"],
+        **{f"avg_{stage}_ms": round(_stage_seconds[stage] / processed * 1000, 2) for stage in STAGES},
+        "total_ms": round(_stage_seconds["total"] * 1000, 1),
+    }
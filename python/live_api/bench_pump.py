@@ -0,0 +1,115 @@
+"""Benchmark GeminiLiveServicer.ChatStream with many concurrent idle streams.
+
+Runs the servicer in process against a fake Gemini live client and reports
+  * CPU time burnt per idle stream (streams connected, nobody talking), and
+  * time to first audio chunk after a text turn, beyond the fake model latency.
+
+    python bench_pump.py --streams 500
+"""
+
+import argparse
+import asyncio
+import os
+import statistics
+import time
+from types import SimpleNamespace
+
+os.environ.setdefault("GEMINI_API_KEY", "benchmark-key")  # never used, the client is faked
+
+import blind_assist_pb2
+import liveapi_server
+
+
+class FakeLiveSession:
+    def __init__(self, latency):
+        self.latency = latency
+        self._turns = asyncio.Queue()
+
+    async def send(self, input=None, **kwargs):
+        async def reply():
+            await asyncio.sleep(self.latency)
+            await self._turns.put([SimpleNamespace(text=None, data=b"\0" * 960) for _ in range(3)])
+        asyncio.get_running_loop().create_task(reply())
+
+    async def send_realtime_input(self, media=None, **kwargs):
+        pass
+
+    async def receive(self):
+        for message in await self._turns.get():
+            yield message
+
+
+class FakeConnect:
+    def __init__(self, latency):
+        self.session = FakeLiveSession(latency)
+
+    async def __aenter__(self):
+        return self.session
+
+    async def __aexit__(self, *exc):
+        return False
+
+
+def fake_client(latency):
+    return SimpleNamespace(aio=SimpleNamespace(live=SimpleNamespace(
+        connect=lambda model, config: FakeConnect(latency))))
+
+
+async def run(streams, idle_seconds, latency):
+    liveapi_server.gemini_global_client = fake_client(latency)
+    servicer = liveapi_server.GeminiLiveServicer()
+    started = asyncio.Event()
+    ready = 0
+    go = asyncio.Event()
+    sent_at = {}
+    first_audio = {}
+
+    async def requests(i):
+        nonlocal ready
+        yield blind_assist_pb2.ClientRequest(initial_config=blind_assist_pb2.InitialConfigRequest())
+        ready += 1
+        if ready == streams:
+            started.set()
+        await go.wait()
+        sent_at[i] = time.perf_counter()
+        yield blind_assist_pb2.ClientRequest(text_part=blind_assist_pb2.TextPart(text="hello"))
+        while i not in first_audio:
+            await asyncio.sleep(0.05)
+
+    async def consume(i):
+        async for resp in servicer.ChatStream(requests(i), None):
+            if resp.HasField("gemini_audio_part") and i not in first_audio:
+                first_audio[i] = time.perf_counter()
+
+    tasks = [asyncio.create_task(consume(i)) for i in range(streams)]
+    await started.wait()
+    await asyncio.sleep(0.2)  # let every session finish connecting
+
+    cpu_start, wall_start = time.process_time(), time.perf_counter()
+    await asyncio.sleep(idle_seconds)
+    cpu = time.process_time() - cpu_start
+    wall = time.perf_counter() - wall_start
+
+    go.set()
+    await asyncio.gather(*tasks)
+    extra = sorted((first_audio[i] - sent_at[i] - latency) * 1000 for i in range(streams))
+    return cpu, wall, extra
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--streams", type=int, default=500)
+    parser.add_argument("--idle", type=float, default=3.0, help="idle measurement window in seconds")
+    parser.add_argument("--latency", type=float, default=0.05, help="fake model latency in seconds")
+    args = parser.parse_args()
+    liveapi_server.logging.disable(liveapi_server.logging.INFO)
+
+    cpu, wall, extra = asyncio.run(run(args.streams, args.idle, args.latency))
+    print(f"{args.streams} idle streams for {wall:.1f}s: CPU {cpu * 1000:.1f} ms total, "
+          f"{cpu / args.streams / wall * 1e6:.1f} us CPU per stream per second")
+    print(f"time to first audio chunk beyond model latency: p50 {statistics.median(extra):.1f} ms, "
+          f"p99 {extra[min(len(extra) - 1, int(len(extra) * 0.99))]:.1f} ms")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,126 @@
+import io
+import os
+import time
+from typing import Optional
+
+from PIL import Image
+
+# Camera frame gate for the live session. Each incoming JPEG is reduced to a
+# 64-bit difference hash; frames that look like the last one sent are dropped,
+# the frame rate adapts to how much the scene changes, and the resolution sent
+# upstream shrinks while frames are still queued for Gemini.
+
+FRAME_MAX_FPS = float(os.environ.get("FRAME_MAX_FPS", "2"))
+FRAME_MIN_FPS = float(os.environ.get("FRAME_MIN_FPS", "0.2"))
+# A static scene is still refreshed this often so hazards never go stale
+FRAME_KEEPALIVE_SECONDS = float(os.environ.get("FRAME_KEEPALIVE_SECONDS", "5"))
+# Hamming distance (out of 64 bits) at or below which a frame counts as a duplicate
+FRAME_DUPLICATE_BITS = int(os.environ.get("FRAME_DUPLICATE_BITS", "4"))
+# Hamming distance treated as a full scene change
+FRAME_SCENE_CHANGE_BITS = int(os.environ.get("FRAME_SCENE_CHANGE_BITS", "20"))
+FRAME_MAX_EDGE = int(os.environ.get("FRAME_MAX_EDGE", "768"))
+FRAME_MIN_EDGE = int(os.environ.get("FRAME_MIN_EDGE", "384"))
+FRAME_JPEG_QUALITY = int(os.environ.get("FRAME_JPEG_QUALITY", "70"))
+
+
+def difference_hash(image: Image.Image) -> int:
+    """64-bit dHash: sign of the horizontal gradient on a 9x8 grayscale thumbnail."""
+    small = image.convert("L").resize((9, 8), Image.BILINEAR)
+    pixels = small.tobytes()
+    bits = 0
+    for row in range(8):
+        offset = row * 9
+        for col in range(8):
+            bits = (bits << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return bits
+
+
+def hamming(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class FrameGate:
+    """
+    Decides per frame whether to forward it to the live session, and at what
+    size. Not thread-safe; one gate per stream, frames processed in order.
+    """
+
+    def __init__(self, max_fps: float = FRAME_MAX_FPS, min_fps: float = FRAME_MIN_FPS,
+                 keepalive_seconds: float = FRAME_KEEPALIVE_SECONDS,
+                 duplicate_bits: int = FRAME_DUPLICATE_BITS, scene_change_bits: int = FRAME_SCENE_CHANGE_BITS,
+                 max_edge: int = FRAME_MAX_EDGE, min_edge: int = FRAME_MIN_EDGE,
+                 quality: int = FRAME_JPEG_QUALITY):
+        self.min_interval = 1.0 / max_fps
+        self.max_interval = 1.0 / min_fps
+        self.keepalive_seconds = keepalive_seconds
+        self.duplicate_bits = duplicate_bits
+        self.scene_change_bits = scene_change_bits
+        self.max_edge = max_edge
+        self.min_edge = min_edge
+        self.quality = quality
+        self.interval = self.min_interval        # current adaptive send interval
+        self.last_sent_at: Optional[float] = None
+        self.last_hash: Optional[int] = None
+        self.stats = {"frames_in": 0, "sent": 0, "dropped_rate": 0, "dropped_duplicate": 0,
+                      "dropped_invalid": 0, "dropped_backpressure": 0, "bytes_in": 0, "bytes_out": 0}
+
+    def _adapt(self, change: float) -> None:
+        # Busy scenes pull the interval towards max fps, calm ones towards min fps
+        target = self.max_interval + (self.min_interval - self.max_interval) * change
+        self.interval = 0.5 * self.interval + 0.5 * target
+
+    def target_edge(self, upstream_depth: int, upstream_capacity: int) -> int:
+        """Longest image edge to send, smaller while Gemini is behind on frames."""
+        if upstream_capacity <= 0:
+            return self.max_edge
+        load = min(1.0, upstream_depth / upstream_capacity)
+        return int(self.max_edge - (self.max_edge - self.min_edge) * load)
+
+    def process(self, jpeg_bytes: bytes, upstream_depth: int = 0, upstream_capacity: int = 0,
+                now: Optional[float] = None) -> Optional[bytes]:
+        """JPEG bytes to forward (downscaled if needed), or None to drop the frame."""
+        now = time.monotonic() if now is None else now
+        self.stats["frames_in"] += 1
+        self.stats["bytes_in"] += len(jpeg_bytes)
+
+        since_last = None if self.last_sent_at is None else now - self.last_sent_at
+        if since_last is not None and since_last < self.min_interval:
+            self.stats["dropped_rate"] += 1
+            return None
+
+        try:
+            image = Image.open(io.BytesIO(jpeg_bytes))
+            is_jpeg = image.format == "JPEG"
+            image.draft("RGB", (self.max_edge, self.max_edge))  # let libjpeg decode at reduced scale
+            image = image.convert("RGB")
+        except Exception:
+            self.stats["dropped_invalid"] += 1
+            return None
+
+        frame_hash = difference_hash(image)
+        distance = 64 if self.last_hash is None else hamming(frame_hash, self.last_hash)
+        stale = since_last is None or since_last >= self.keepalive_seconds
+        if not stale:
+            if distance <= self.duplicate_bits:
+                self._adapt(0.0)
+                self.stats["dropped_duplicate"] += 1
+                return None
+            if since_last < self.interval and distance < self.scene_change_bits:
+                self.stats["dropped_rate"] += 1
+                return None
+        self._adapt(min(1.0, distance / self.scene_change_bits))
+
+        edge = self.target_edge(upstream_depth, upstream_capacity)
+        if max(image.size) > edge or not is_jpeg:
+            image.thumbnail((edge, edge), Image.BILINEAR)
+            out = io.BytesIO()
+            image.save(out, format="JPEG", quality=self.quality)
+            data = out.getvalue()
+        else:
+            data = jpeg_bytes  # already small enough, re-encoding would only cost quality
+
+        self.last_sent_at = now
+        self.last_hash = frame_hash
+        self.stats["sent"] += 1
+        self.stats["bytes_out"] += len(data)
+        return data
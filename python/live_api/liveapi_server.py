@@ -5,10 +5,12 @@ from contextlib import suppress
 
 import grpc
 from google import genai
+from google.genai import types
 from dotenv import load_dotenv
 
 import blind_assist_pb2
 import blind_assist_pb2_grpc
+from frame_filter import FrameGate
 
 load_dotenv()
 
@@ -25,29 +27,46 @@ gemini_global_client = genai.Client(http_options={"api_version": "v1beta"}, api_
 logging.basicConfig(level=logging.INFO)
 
 
+# Responses buffered per stream before the Gemini receiver is made to wait
+RESPONSE_QUEUE_MAX = int(os.environ.get("RESPONSE_QUEUE_MAX", "64"))
+
+# Camera frames waiting to be sent to Gemini; when full the oldest frame is dropped
+FRAME_QUEUE_MAX = int(os.environ.get("FRAME_QUEUE_MAX", "2"))
+CLIENT_AUDIO_RATE_DEFAULT = 16000
+
+# Put on the response queue once nothing more will follow
+_STREAM_END = object()
+
+
 class GeminiLiveServicer(blind_assist_pb2_grpc.GeminiLiveServicer):
 
     async def ChatStream(self, request_iterator, context):
-        client_response_queue = asyncio.Queue()
+        # Bounded: when the gRPC client reads slowly, the Gemini receiver blocks on
+        # put() instead of buffering audio without limit.
+        client_response_queue = asyncio.Queue(maxsize=RESPONSE_QUEUE_MAX)
+        session_cm = None
         active_session = None
         receive_task = None
+        frame_task = None
+        frame_gate = FrameGate()
+        frame_queue = asyncio.Queue(maxsize=FRAME_QUEUE_MAX)
 
         async def _handle_gemini_responses(session):
             try:
                 while True:
-                    # **Await** the coroutine to get an async iterable of turns
-                    gemini_turn = await session.receive()
-                    async for part in gemini_turn:
-                        if part.text:
+                    # receive() yields the messages of one model turn
+                    async for message in session.receive():
+                        if message.text:
                             await client_response_queue.put(
                                 blind_assist_pb2.ServerResponse(
-                                    text_part=blind_assist_pb2.TextPart(text=part.text)
+                                    text_part=blind_assist_pb2.TextPart(text=message.text)
                                 )
                             )
-                        if part.data:
+                        if message.data:
                             await client_response_queue.put(
                                 blind_assist_pb2.ServerResponse(
-                                    gemini_audio_part=blind_assist_pb2.AudioPart(data=part.data)
+                                    gemini_audio_part=blind_assist_pb2.AudioPart(
+                                        audio_data=message.data, mime_type="audio/pcm", sample_rate=24000)
                                 )
                             )
                     # signal end of one turn
@@ -62,63 +81,113 @@ class GeminiLiveServicer(blind_assist_pb2_grpc.GeminiLiveServicer):
                     )
                 )
 
+        async def _frames_to_gemini(session):
+            while True:
+                frame = await frame_queue.get()
+                await session.send_realtime_input(
+                    media=types.Blob(data=frame, mime_type="image/jpeg"))
+
+        async def _enqueue_frame(image_part):
+            # Decoding/hashing is CPU work; keep it off the event loop
+            frame = await asyncio.to_thread(
+                frame_gate.process, image_part.image_data, frame_queue.qsize(), FRAME_QUEUE_MAX)
+            if frame is None:
+                return
+            if frame_queue.full():
+                frame_queue.get_nowait()  # a fresher frame replaces the stale one
+                frame_gate.stats["dropped_backpressure"] += 1
+            frame_queue.put_nowait(frame)
+
+        async def _close_session():
+            nonlocal session_cm, active_session, receive_task, frame_task
+            for task in (receive_task, frame_task):
+                if task:
+                    task.cancel()
+                    with suppress(asyncio.CancelledError):
+                        await task
+            receive_task = frame_task = None
+            while not frame_queue.empty():
+                frame_queue.get_nowait()
+            if session_cm:
+                with suppress(Exception):
+                    await session_cm.__aexit__(None, None, None)
+                session_cm = None
+                active_session = None
+
         async def _client_to_gemini():
-            nonlocal active_session, receive_task
-            async for req in request_iterator:
-                # Initialize or reinitialize session
-                if req.HasField("initial_config"):
-                    # Tear down old session if any
-                    if active_session:
-                        await active_session.__aexit__(None, None, None)
-                        receive_task.cancel()
-                    cfg = {
-                        **CONFIG_DEFAULT,
-                        **{ "response_modalities": list(req.initial_config.modalities) }
-                    }
-                    active_session = (
-                        gemini_global_client.aio.live
-                            .connect(model=req.initial_config.model_name or MODEL_NAME_DEFAULT,
-                                     config=cfg)
+            nonlocal session_cm, active_session, receive_task, frame_task
+            try:
+                async for req in request_iterator:
+                    # Initialize or reinitialize session
+                    if req.HasField("initial_config"):
+                        # Tear down old session if any
+                        await _close_session()
+                        cfg = {
+                            **CONFIG_DEFAULT,
+                            **({"response_modalities": list(req.initial_config.response_modalities)}
+                               if req.initial_config.response_modalities else {})
+                        }
+                        session_cm = gemini_global_client.aio.live.connect(
+                            model=req.initial_config.model_name or MODEL_NAME_DEFAULT,
+                            config=cfg)
+                        active_session = await session_cm.__aenter__()
+                        receive_task = asyncio.create_task(_handle_gemini_responses(active_session))
+                        frame_task = asyncio.create_task(_frames_to_gemini(active_session))
+
+                    # Send text from client
+                    elif req.HasField("text_part"):
+                        await active_session.send(input=req.text_part.text)
+
+                    # Camera frames go through the change/rate gate
+                    elif req.HasField("image_part"):
+                        if active_session:
+                            await _enqueue_frame(req.image_part)
+
+                    # Send audio bytes from client
+                    elif req.HasField("client_audio_part"):
+                        audio = req.client_audio_part
+                        rate = audio.sample_rate or CLIENT_AUDIO_RATE_DEFAULT
+                        await active_session.send_realtime_input(
+                            media=types.Blob(data=audio.audio_data, mime_type=f"audio/pcm;rate={rate}"))
+
+                    # handle end_of_turn from client
+                    elif req.end_of_turn:
+                        await active_session.send_realtime_input(audio_stream_end=True)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                logging.exception("Error forwarding client requests to Gemini")
+                await client_response_queue.put(
+                    blind_assist_pb2.ServerResponse(
+                        error_part=blind_assist_pb2.ErrorPart(message=str(e))
                     )
-                    await active_session.__aenter__()
-                    receive_task = asyncio.create_task(_handle_gemini_responses(active_session))
-
-                # Send text from client
-                elif req.HasField("text_part"):
-                    await active_session.send(input=req.text_part.text)
-
-                # Send audio bytes from client
-                elif req.HasField("audio_part"):
-                    await active_session.send_audio(content=req.audio_part.data)
-
-                # handle end_of_turn from client
-                elif req.end_of_turn:
-                    await active_session.end_input()
-
-            # client done: clean up the session
-            if active_session:
-                await active_session.__aexit__(None, None, None)
+                )
+            finally:
+                # client done (or gone): clean up the session
+                await _close_session()
+            # Not reached when cancelled: nobody is reading the queue then
+            await client_response_queue.put(_STREAM_END)
 
         # Kick off client→Gemini pump
         client_task = asyncio.create_task(_client_to_gemini())
 
-        # Interleave yields back to gRPC client
-        while True:
-            if client_task.done() and client_response_queue.empty():
-                break
-            try:
-                resp = await asyncio.wait_for(client_response_queue.get(), timeout=0.1)
+        # Every wakeup is a real response or the end sentinel; an idle stream
+        # costs nothing until one of them arrives.
+        try:
+            while True:
+                resp = await client_response_queue.get()
+                if resp is _STREAM_END:
+                    break
                 yield resp
-            except asyncio.TimeoutError:
-                continue
-
-        # Final cleanup
-        if receive_task:
-            receive_task.cancel()
+        finally:
+            # Also runs when the gRPC peer disconnects and this generator is
+            # cancelled: stop reading the client and tear down the Gemini session.
+            if not client_task.done():
+                client_task.cancel()
             with suppress(asyncio.CancelledError):
-                await receive_task
+                await client_task
 
-        logging.info("ChatStream complete, closing.")
+        logging.info(f"ChatStream complete, closing. Frame stats: {frame_gate.stats}")
 
 async def serve():
     server = grpc.aio.server()
@@ -0,0 +1,61 @@
+import io
+import random
+
+from PIL import Image
+
+from frame_filter import FrameGate, difference_hash, hamming
+
+
+def _jpeg(seed, size=(1280, 960), fmt="JPEG"):
+    # Coarse random blocks: a scene with structure dHash can tell apart
+    rng = random.Random(seed)
+    blocks = Image.new("L", (16, 12))
+    blocks.putdata([rng.randrange(256) for _ in range(16 * 12)])
+    out = io.BytesIO()
+    blocks.resize(size, Image.BILINEAR).convert("RGB").save(out, format=fmt, quality=90)
+    return out.getvalue()
+
+
+def _size(data):
+    return Image.open(io.BytesIO(data)).size
+
+
+def test_same_scene_hashes_alike_and_other_scenes_do_not():
+    a = difference_hash(Image.open(io.BytesIO(_jpeg(1))))
+    assert hamming(a, difference_hash(Image.open(io.BytesIO(_jpeg(1, size=(640, 480)))))) <= 4
+    assert hamming(a, difference_hash(Image.open(io.BytesIO(_jpeg(2))))) >= 20
+
+
+def test_duplicates_are_dropped_until_the_keepalive():
+    gate = FrameGate(max_fps=2, keepalive_seconds=5)
+    frame = _jpeg(1)
+    assert gate.process(frame, now=0.0) is not None
+    assert gate.process(frame, now=0.2) is None  # above max fps
+    assert [gate.process(frame, now=t) for t in (1.0, 2.0, 3.0)] == [None] * 3
+    assert gate.process(frame, now=5.0) is not None  # a static scene is still refreshed
+    assert gate.stats["dropped_rate"] == 1 and gate.stats["dropped_duplicate"] == 3 and gate.stats["sent"] == 2
+
+
+def test_scene_change_goes_through_at_max_fps():
+    gate = FrameGate(max_fps=2, min_fps=0.2)
+    assert gate.process(_jpeg(1), now=0.0) is not None
+    for _ in range(5):  # a calm scene stretches the interval towards min fps
+        gate._adapt(0.0)
+    assert gate.interval > 2.0
+    assert gate.process(_jpeg(2), now=0.6) is not None
+
+
+def test_frames_shrink_while_upstream_is_behind():
+    gate = FrameGate(max_edge=768, min_edge=384)
+    assert max(_size(gate.process(_jpeg(1), upstream_depth=0, upstream_capacity=2, now=0.0))) == 768
+    assert max(_size(gate.process(_jpeg(2), upstream_depth=2, upstream_capacity=2, now=1.0))) == 384
+    small = _jpeg(3, size=(320, 240))
+    assert gate.process(small, now=2.0) == small  # already small: forwarded untouched
+    png = gate.process(_jpeg(4, size=(320, 240), fmt="PNG"), now=3.0)
+    assert png[:2] == b"\xff\xd8"  # anything else is re-encoded as JPEG
+
+
+def test_invalid_frames_are_dropped():
+    gate = FrameGate()
+    assert gate.process(b"not an image", now=0.0) is None
+    assert gate.stats["dropped_invalid"] == 1 and gate.last_sent_at is None
@@ -0,0 +1,91 @@
+import asyncio
+from types import SimpleNamespace
+
+import blind_assist_pb2
+import liveapi_server
+
+
+class FakeLiveSession:
+    """Answers every text with one text message and one audio chunk."""
+
+    def __init__(self):
+        self.turns = asyncio.Queue()
+        self.sent = []
+        self.closed = False
+
+    async def send(self, input=None, **kwargs):
+        self.sent.append(input)
+        await self.turns.put([SimpleNamespace(text=f"re: {input}", data=None),
+                              SimpleNamespace(text=None, data=b"\0" * 960)])
+
+    async def send_realtime_input(self, **kwargs):
+        self.sent.append(kwargs)
+
+    async def receive(self):
+        for message in await self.turns.get():
+            yield message
+
+
+class FakeConnect:
+    def __init__(self, session):
+        self.session = session
+
+    async def __aenter__(self):
+        return self.session
+
+    async def __aexit__(self, *exc):
+        self.session.closed = True
+        return False
+
+
+def _fake_client(monkeypatch):
+    sessions = []
+
+    def connect(model, config):
+        sessions.append(FakeLiveSession())
+        return FakeConnect(sessions[-1])
+    monkeypatch.setattr(liveapi_server, "gemini_global_client",
+                        SimpleNamespace(aio=SimpleNamespace(live=SimpleNamespace(connect=connect))))
+    return sessions
+
+
+def test_responses_are_forwarded_in_order_and_the_stream_ends_with_the_client(monkeypatch):
+    sessions = _fake_client(monkeypatch)
+
+    async def main():
+        answered = asyncio.Event()
+
+        async def requests():
+            yield blind_assist_pb2.ClientRequest(initial_config=blind_assist_pb2.InitialConfigRequest())
+            yield blind_assist_pb2.ClientRequest(text_part=blind_assist_pb2.TextPart(text="hello"))
+            await answered.wait()
+
+        responses = []
+        async for response in liveapi_server.GeminiLiveServicer().ChatStream(requests(), None):
+            responses.append(response)
+            if response.turn_complete:
+                answered.set()
+        return responses
+
+    responses = asyncio.run(main())
+    assert [r.WhichOneof("response_data") for r in responses] == ["text_part", "gemini_audio_part", "turn_complete"]
+    assert responses[0].text_part.text == "re: hello"
+    assert sessions[0].sent == ["hello"] and sessions[0].closed
+
+
+def test_client_going_away_tears_down_the_session(monkeypatch):
+    sessions = _fake_client(monkeypatch)
+
+    async def main():
+        async def requests():
+            yield blind_assist_pb2.ClientRequest(initial_config=blind_assist_pb2.InitialConfigRequest())
+            yield blind_assist_pb2.ClientRequest(text_part=blind_assist_pb2.TextPart(text="hello"))
+            await asyncio.Event().wait()  # the client never finishes on its own
+
+        stream = liveapi_server.GeminiLiveServicer().ChatStream(requests(), None)
+        first = await stream.__anext__()
+        await stream.aclose()  # what grpc does when the peer disconnects
+        return first
+
+    assert asyncio.run(main()).text_part.text == "re: hello"
+    assert sessions[0].closed
@@ -0,0 +1,189 @@
+import os
+import math
+import time
+import asyncio
+from typing import TYPE_CHECKING, Callable, Dict, Optional
+
+import deviation
+
+if TYPE_CHECKING:  # navigator imports this module
+    from navigator import SessionState
+
+# Ingestion stage for the client's GPS fixes, one filter per session.
+#
+#   * Smoothing: an alpha-beta filter on position (in a local metric frame) and
+#     a circular one on the compass heading, so the tracker and the off-route
+#     check see a steady walker instead of raw jitter.
+#   * Jump rejection: a fix farther from the prediction than LOCATION_MAX_SPEED_MPS
+#     allows in the elapsed time (plus LOCATION_JUMP_SLACK_METERS of GPS error)
+#     is dropped. After LOCATION_MAX_REJECTS rejections in a row the filter
+#     trusts the GPS again and restarts from the latest fix.
+#   * Coalescing: every fix updates current_loc, but step tracking and push
+#     guidance run at most once per LOCATION_MIN_INTERVAL seconds, on the
+#     latest estimate; bursts in between are absorbed. A coalesced fix is
+#     tracked by a deferred pass once the interval is over, unless a newer fix
+#     got there first, so the last fix before the client goes quiet still counts.
+#     Intervals are measured on the fixes' own timestamps when the caller has
+#     them (a burst of delayed fixes is then not one burst), else on arrival.
+#
+# The heading stays numeric (degrees) in current_loc; the compass word is kept
+# next to it for the model.
+
+LOCATION_ALPHA = float(os.getenv("LOCATION_ALPHA", "0.5"))
+LOCATION_BETA = float(os.getenv("LOCATION_BETA", "0.1"))
+LOCATION_HEADING_ALPHA = float(os.getenv("LOCATION_HEADING_ALPHA", "0.5"))
+LOCATION_MAX_SPEED_MPS = float(os.getenv("LOCATION_MAX_SPEED_MPS", "3.0"))
+LOCATION_JUMP_SLACK_METERS = float(os.getenv("LOCATION_JUMP_SLACK_METERS", "25"))
+LOCATION_MAX_REJECTS = int(os.getenv("LOCATION_MAX_REJECTS", "3"))
+LOCATION_MIN_INTERVAL = float(os.getenv("LOCATION_MIN_INTERVAL", "0.5"))
+# Re-anchor the local frame when the walker gets this far from its origin
+REANCHOR_METERS = 5000.0
+# Below this the fixes are a burst; velocity isn't updated from them
+MIN_VELOCITY_DT = 0.2
+
+_DIRECTIONS = ["north", "northeast", "east", "southeast", "south", "southwest", "west", "northwest"]
+
+_stats = {"fixes": 0, "rejected_jumps": 0, "resets": 0, "coalesced": 0, "processed": 0, "deferred": 0}
+
+
+def compass_direction(heading: float) -> str:
+    return _DIRECTIONS[int(((heading % 360) + 22.5) // 45) % 8]
+
+
+def heading_description(loc: Dict) -> str:
+    """Heading as shown to the model, e.g. 'east angle: 90.0°'."""
+    heading = loc.get("heading", 0)
+    if isinstance(heading, str):  # sessions stored before headings were numeric
+        return heading
+    return f"{loc.get('direction') or compass_direction(heading)} angle: {heading:.1f}°"
+
+
+def _angle_diff(a: float, b: float) -> float:
+    return (a - b + 180.0) % 360.0 - 180.0
+
+
+class LocationFilter:
+    def __init__(self, alpha: float = LOCATION_ALPHA, beta: float = LOCATION_BETA,
+                 heading_alpha: float = LOCATION_HEADING_ALPHA, max_speed: float = LOCATION_MAX_SPEED_MPS,
+                 jump_slack: float = LOCATION_JUMP_SLACK_METERS, max_rejects: int = LOCATION_MAX_REJECTS):
+        self.alpha = alpha
+        self.beta = beta
+        self.heading_alpha = heading_alpha
+        self.max_speed = max_speed
+        self.jump_slack = jump_slack
+        self.max_rejects = max_rejects
+        self.frame: Optional[deviation.LocalFrame] = None
+        self.x = self.y = self.vx = self.vy = 0.0
+        self.heading: Optional[float] = None
+        self.last_time = 0.0
+        self.rejects = 0
+        self.last_processed = float("-inf")
+        self.pending: Optional[Dict] = None  # latest coalesced estimate, not tracked yet
+        self._deferred: Optional[asyncio.TimerHandle] = None
+
+    def _reset(self, lat: float, lng: float, heading: float, now: float) -> None:
+        self.frame = deviation.LocalFrame(lat, lng)
+        self.x = self.y = self.vx = self.vy = 0.0
+        self.heading = heading
+        self.last_time = now
+        self.rejects = 0
+
+    def update(self, lat: float, lng: float, heading: float, now: float) -> Optional[Dict]:
+        """Folds in one raw fix; returns the new estimate, or None if the fix was rejected as a jump."""
+        if self.frame is None:
+            self._reset(lat, lng, heading, now)
+        else:
+            dt = max(0.0, now - self.last_time)
+            zx, zy = (float(v) for v in self.frame.to_xy(lat, lng))
+            px, py = self.x + self.vx * dt, self.y + self.vy * dt
+            rx, ry = zx - px, zy - py
+            if math.hypot(rx, ry) > self.max_speed * dt + self.jump_slack:
+                self.rejects += 1
+                if self.rejects < self.max_rejects:
+                    _stats["rejected_jumps"] += 1
+                    return None
+                _stats["resets"] += 1  # the GPS keeps insisting: believe it
+                self._reset(lat, lng, heading, now)
+            else:
+                self.rejects = 0
+                self.x, self.y = px + self.alpha * rx, py + self.alpha * ry
+                if dt >= MIN_VELOCITY_DT:
+                    self.vx += self.beta * rx / dt
+                    self.vy += self.beta * ry / dt
+                    speed = math.hypot(self.vx, self.vy)
+                    if speed > self.max_speed:
+                        self.vx, self.vy = self.vx * self.max_speed / speed, self.vy * self.max_speed / speed
+                self.heading = (self.heading + self.heading_alpha * _angle_diff(heading, self.heading)) % 360.0
+                self.last_time = now
+                if math.hypot(self.x, self.y) > REANCHOR_METERS:
+                    est_lat, est_lng = self.frame.to_latlon(self.x, self.y)
+                    self.frame = deviation.LocalFrame(float(est_lat), float(est_lng))
+                    self.x = self.y = 0.0
+
+        est_lat, est_lng = self.frame.to_latlon(self.x, self.y)
+        return {"lat": round(float(est_lat), 7), "lng": round(float(est_lng), 7),
+                "heading": round(self.heading, 1), "direction": compass_direction(self.heading)}
+
+    def due(self, now: float) -> bool:
+        """True at most once per LOCATION_MIN_INTERVAL: time to run tracking on the latest estimate."""
+        if now - self.last_processed < LOCATION_MIN_INTERVAL:
+            return False
+        self.last_processed = now
+        return True
+
+    def defer(self, estimate: Dict, delay: float, run: Callable[[Dict], None]) -> None:
+        """Tracks `estimate` with run() after `delay` seconds, unless a due fix comes first."""
+        self.pending = estimate
+        if self._deferred is None:
+            self._deferred = asyncio.get_running_loop().call_later(max(0.0, delay), self._run_pending, run)
+
+    def _run_pending(self, run: Callable[[Dict], None]) -> None:
+        self._deferred = None
+        estimate, self.pending = self.pending, None
+        if estimate is not None:
+            self.last_processed = self.last_time
+            _stats["deferred"] += 1
+            run(estimate)
+
+    def cancel(self) -> None:
+        """Drops the deferred pass, if any (a due fix supersedes it; the session is going away)."""
+        if self._deferred is not None:
+            self._deferred.cancel()
+        self._deferred, self.pending = None, None
+
+
+def ingest(session_state: "SessionState", lat: float, lng: float, heading: float,
+           now: Optional[float] = None, fix_time: Optional[float] = None,
+           track: Optional[Callable[["SessionState", Dict], None]] = None) -> Optional[Dict]:
+    """
+    Filters one raw fix into the session. Returns the estimate when tracking
+    and push guidance should run on it (navigator.set_current_location),
+    None when the fix was rejected or coalesced into current_loc. `fix_time`
+    is the fix's own timestamp in seconds, if the client sent one; with
+    `track`, a coalesced fix is handed to track(session_state, estimate) once
+    the interval is over (needs a running event loop).
+    """
+    now = time.monotonic() if now is None else now
+    if fix_time is not None:
+        now = fix_time
+    _stats["fixes"] += 1
+    if session_state.location_filter is None:
+        session_state.location_filter = LocationFilter()
+    location_filter = session_state.location_filter
+    estimate = location_filter.update(lat, lng, heading, now)
+    if estimate is None:
+        return None
+    if not location_filter.due(now):
+        _stats["coalesced"] += 1
+        session_state.current_loc = estimate  # fresh for a turn, tracked on the next due fix or deferred pass
+        if track is not None:
+            location_filter.defer(estimate, location_filter.last_processed + LOCATION_MIN_INTERVAL - now,
+                                  lambda pending: track(session_state, pending))
+        return None
+    location_filter.cancel()
+    _stats["processed"] += 1
+    return estimate
+
+
+def stats() -> Dict[str, int]:
+    return dict(_stats)
@@ -0,0 +1,126 @@
+import os
+import logging
+import functools
+from typing import Any, Dict, Optional
+from urllib.parse import urlsplit
+
+import httpx
+
+import tracing
+
+# Process-wide HTTP layer for every Google Maps Platform call made by navigator.
+# One pooled AsyncClient per host keeps TCP+TLS (and HTTP/2) connections alive
+# between tool calls, and gives each host its own connection limit.
+
+MAPS_HTTP2 = os.getenv("MAPS_HTTP2", "1") != "0"
+MAPS_MAX_CONNECTIONS_PER_HOST = int(os.getenv("MAPS_MAX_CONNECTIONS_PER_HOST", "20"))
+MAPS_MAX_KEEPALIVE_PER_HOST = int(os.getenv("MAPS_MAX_KEEPALIVE_PER_HOST", "10"))
+MAPS_KEEPALIVE_EXPIRY = float(os.getenv("MAPS_KEEPALIVE_EXPIRY", "60"))
+MAPS_CONNECT_TIMEOUT = float(os.getenv("MAPS_CONNECT_TIMEOUT", "5"))
+MAPS_READ_TIMEOUT = float(os.getenv("MAPS_READ_TIMEOUT", "10"))
+
+_clients: Dict[str, httpx.AsyncClient] = {}
+_stats = {"requests": 0, "new_connections": 0, "tls_handshakes": 0}
+
+
+@functools.lru_cache(maxsize=None)
+def _http2_available() -> bool:
+    if not MAPS_HTTP2:
+        return False
+    try:
+        import h2  # noqa: F401  (httpx needs it for http2=True)
+        return True
+    except ImportError:
+        logging.warning("maps_client: 'h2' not installed, falling back to HTTP/1.1 keep-alive")
+        return False
+
+
+def _timeout(read: Optional[float] = None) -> httpx.Timeout:
+    read = read if read is not None else MAPS_READ_TIMEOUT
+    return httpx.Timeout(read, connect=MAPS_CONNECT_TIMEOUT)
+
+
+def _new_client() -> httpx.AsyncClient:
+    return httpx.AsyncClient(
+        http2=_http2_available(),
+        timeout=_timeout(),
+        limits=httpx.Limits(
+            max_connections=MAPS_MAX_CONNECTIONS_PER_HOST,
+            max_keepalive_connections=MAPS_MAX_KEEPALIVE_PER_HOST,
+            keepalive_expiry=MAPS_KEEPALIVE_EXPIRY,
+        ),
+    )
+
+
+def _client_for(url: str) -> httpx.AsyncClient:
+    host = urlsplit(url).netloc
+    client = _clients.get(host)
+    if client is None or client.is_closed:
+        client = _new_client()
+        _clients[host] = client
+    return client
+
+
+async def _trace(event_name: str, info: Dict) -> None:
+    # httpcore reports connection setup through the "trace" extension; anything
+    # that sends a request without these events went over a pooled connection.
+    if event_name == "connection.connect_tcp.complete":
+        _stats["new_connections"] += 1
+    elif event_name == "connection.start_tls.complete":
+        _stats["tls_handshakes"] += 1
+
+
+@functools.lru_cache(maxsize=256)
+def _api_name(url: str) -> str:
+    # Span name: ".../maps/api/place/textsearch/json" -> "place.textsearch", ".../v2:computeRoutes" -> "computeRoutes"
+    path = urlsplit(url).path
+    if ":" in path:
+        return path.rsplit(":", 1)[1]
+    return path.removeprefix("/maps/api/").removesuffix("/json").strip("/").replace("/", ".") or "root"
+
+
+async def request(method: str, url: str, *, timeout: Optional[float] = None, **kwargs: Any) -> httpx.Response:
+    _stats["requests"] += 1
+    client = _client_for(url)
+    if not tracing.ENABLED:
+        return await client.request(method, url, timeout=_timeout(timeout), extensions={"trace": _trace}, **kwargs)
+    with tracing.span(f"maps.{_api_name(url)}", method=method) as span:
+        response = await client.request(method, url, timeout=_timeout(timeout), extensions={"trace": _trace}, **kwargs)
+        span.set("status", response.status_code)
+        span.set("bytes_in", len(response.request.content))
+        span.set("bytes_out", len(response.content))
+    return response
+
+
+async def get(url: str, *, timeout: Optional[float] = None, **kwargs: Any) -> httpx.Response:
+    return await request("GET", url, timeout=timeout, **kwargs)
+
+
+async def post(url: str, *, timeout: Optional[float] = None, **kwargs: Any) -> httpx.Response:
+    return await request("POST", url, timeout=timeout, **kwargs)
+
+
+def stats() -> Dict[str, int]:
+    requests = _stats["requests"]
+    return {
+        **_stats,
+        "reused_connections": max(0, requests - _stats["new_connections"]),
+        "open_hosts": sum(1 for c in _clients.values() if not c.is_closed),
+    }
+
+
+async def startup(hosts=("maps.googleapis.com", "routes.googleapis.com")) -> None:
+    """Creates the pooled clients up front; called from server.serve()."""
+    for host in hosts:
+        _client_for(f"https://{host}/")
+    logging.info(f"Maps HTTP client ready (http2={_http2_available()}, "
+                 f"max {MAPS_MAX_CONNECTIONS_PER_HOST} connections/host)")
+
+
+async def shutdown() -> None:
+    """Closes every pooled connection; called from server.serve() on exit."""
+    clients = list(_clients.values())
+    _clients.clear()
+    for client in clients:
+        await client.aclose()
+    logging.info(f"Maps HTTP client closed. Stats: {stats()}")
@@ -1,19 +1,30 @@
 import os
 import json
 import asyncio
-import httpx
 import dotenv
 import math
 import traceback
 from dataclasses import dataclass, field
-from typing import Optional, List, Any, Dict
+from typing import Optional, List, Any, Dict, Tuple
 
 from google.genai import chats,types as genai_types # Renamed to avoid conflict
+from google.genai import errors as genai_errors
 from google import genai
 # Ensure your tool_schemas are correctly imported
 from tool_schemas import *
 # Make sure deviation module is available
 import deviation
+import genai_clients
+import maps_client
+import geo_cache
+import guidance
+import location_filter
+from location_filter import LocationFilter
+import static_maps
+import tracing
+from route_cache import route_cache
+from prompt_cache import PromptCache
+from streaming import TurnStream
 from pydantic import BaseModel
 
 
@@ -21,9 +32,7 @@ dotenv.load_dotenv()
 MAP_KEY = os.getenv("GOOGLE_MAPS_KEY")
 GEMINI_API_KEY = os.getenv("GEMINI_API_KEY") # Used in ChatManager
 
-# Ensure client is initialized for use by ChatManager.
-# This might be a global client if the library handles concurrency,
-# or you might pass it around. For simplicity, assuming genai.GenerativeModel handles its own client needs.
+# Gemini clients are pooled per API key in genai_clients; ChatManager picks the session's one.
 MODEL_NAME = "gemini-2.0-flash" # Or your preferred model from the 'gemini-2.0-flash' family if that was intended
 # Define prompts (ensure these are accessible)
 idle_instruction = """
@@ -53,14 +62,21 @@ During interactions (both idle and navigation), you will receive a sequence of i
 
 """
 
-def get_navigation_instruction(route_info: Optional[Dict]): # Added type hint
-    # Basic instruction if route_info is None or empty, adapt as needed.
-    if not route_info:
-        return "You are in navigation mode. Please provide your current route details if available."
-
-    return f"""
+def _route_overview(route_info: Dict, limit: int = 200) -> str:
+    # Same text as json.dumps(route_info, indent=2)[:limit], without encoding the whole route
+    out, size = [], 0
+    for chunk in json.JSONEncoder(indent=2).iterencode(route_info):
+        out.append(chunk)
+        size += len(chunk)
+        if size >= limit:
+            break
+    return "".join(out)[:limit]
+
+# The route overview goes into the chat history (see route_preamble) rather than
+# this instruction, so the instruction is the same for every session and can be cached.
+navigation_instruction = """
 You are now in **active navigation mode**, guiding a visually impaired user. Focus on providing clear, actionable, and timely instructions.
-Current route overview: {json.dumps(route_info, indent=2)[:200]}... (truncated for brevity)
+The overview of the current route is given at the start of the conversation.
 
 **Core Principle: Tool Call Management during Navigation**
 * **Handling Dependencies**: If one function's output is required as input for another (e.g., `geocode_place` for a new destination before calling `restart_navigation`), you must ensure the first function has completed and its results are available before you proceed to use or call the dependent function. This often means the dependent function will be part of a subsequent step or turn.
@@ -122,38 +138,91 @@ class NavResponse(BaseModel):
     response_text: str
     alerts: List[str]
     
-client = genai.Client(api_key=os.getenv("GEMINI_API_KEY")) 
+# Built once and shared by every chat: the tool declarations and the idle config never change
+IDLE_TOOLS = [genai_types.Tool(function_declarations=idle_routes_tool_declarations)]
+NAVIGATION_TOOLS = [genai_types.Tool(function_declarations=navigating_routes_tool_declarations)]
+IDLE_CHAT_CONFIG = genai_types.GenerateContentConfig(
+    tools=IDLE_TOOLS, system_instruction=idle_instruction, temperature=0)
+NAVIGATION_CHAT_CONFIG = genai_types.GenerateContentConfig(
+    tools=NAVIGATION_TOOLS, system_instruction=navigation_instruction, temperature=0)
+
+# Instructions and tools of both modes are cached server-side, see prompt_cache.py
+prompt_cache = PromptCache(MODEL_NAME)
+
+ROUTE_PREAMBLE_HEADER = "[Route overview]"
+
+
+def route_preamble(route_info: Optional[Dict]) -> List[genai_types.Content]:
+    """The exchange a navigation chat starts with, carrying the session's route."""
+    if route_info:
+        overview = f"{_route_overview(route_info)}... (truncated for brevity)"
+    else:
+        overview = "No route details available. Ask the user for their destination."
+    return [genai_types.Content(role="user", parts=[genai_types.Part(text=f"{ROUTE_PREAMBLE_HEADER}\n{overview}")]),
+            genai_types.Content(role="model", parts=[genai_types.Part(text="Understood.")])]
+
+
+def is_route_preamble(content: genai_types.Content) -> bool:
+    parts = content.parts or []
+    return content.role == "user" and bool(parts and parts[0].text and parts[0].text.startswith(ROUTE_PREAMBLE_HEADER))
+
+
+# Client for the server's own key; sessions with their own key get theirs from the registry
+client = genai_clients.get_client(GEMINI_API_KEY)
 class ChatManager:
     def __init__(self, api_key: str):
         self.api_key = api_key
-        # Consider initializing the base model once if configuration is static
-        # and starting chats from it, or ensure API key is used by GenerativeModel
-        # self.base_model = GenerativeModel(MODEL_NAME, api_key=self.api_key) # if api_key is needed here
-
-    def create_idle_chat_for_session(self) -> chats.Chat:
-        # Using genai_types for Tool and FunctionDeclaration
-        config = {
-            "tools": [genai_types.Tool(function_declarations=idle_routes_tool_declarations)],
-            "system_instruction": idle_instruction,
-            "temperature": 0
-        }
-        chat = client.chats.create(
+        self.client = genai_clients.get_client(api_key)
+        self.mode = "idle"
+        # Full config of the current mode, and the config of the chat created last
+        # (the session's current one, possibly the cached variant) for rebuilding it
+        self.inline_config: genai_types.GenerateContentConfig = IDLE_CHAT_CONFIG
+        self.config: Optional[genai_types.GenerateContentConfig] = None
+        self.route_preamble: List[genai_types.Content] = []
+
+    def _create_chat(self, config: genai_types.GenerateContentConfig,
+                     history: Optional[List[genai_types.Content]] = None) -> chats.AsyncChat:
+        self.config = config
+        # Async chats keep the grpc.aio event loop free while Gemini is thinking
+        return self.client.aio.chats.create(
             model=MODEL_NAME,
             config=config,
+            history=history,
         )
-        return chat
-
-    def create_navigation_chat_for_session(self, route_info: Optional[Dict]) -> chats.Chat:
-        config = {
-            "tools": [genai_types.Tool(function_declarations=navigating_routes_tool_declarations)],
-            "system_instruction": get_navigation_instruction(route_info),
-            "temperature": 0
-        }
-        chat = client.chats.create(
-            model=MODEL_NAME,
-            config=config,
-        )
-        return chat
+
+    def create_idle_chat_for_session(self) -> chats.AsyncChat:
+        self.mode, self.inline_config, self.route_preamble = "idle", IDLE_CHAT_CONFIG, []
+        return self._create_chat(IDLE_CHAT_CONFIG)
+
+    def create_navigation_chat_for_session(self, route_info: Optional[Dict]) -> chats.AsyncChat:
+        self.mode, self.inline_config = "navigation", NAVIGATION_CHAT_CONFIG
+        self.route_preamble = route_preamble(route_info)
+        return self._create_chat(NAVIGATION_CHAT_CONFIG, list(self.route_preamble))
+
+    def restore_chat(self, mode: str, route_info: Optional[Dict],
+                     history: List[genai_types.Content]) -> chats.AsyncChat:
+        """A chat in `mode` ("idle" or "navigation") continuing `history`, for a session loaded from a store."""
+        if mode == "navigation":
+            self.mode, self.inline_config = "navigation", NAVIGATION_CHAT_CONFIG
+            self.route_preamble = route_preamble(route_info)
+        else:
+            self.mode, self.inline_config, self.route_preamble = "idle", IDLE_CHAT_CONFIG, []
+        return self.recreate_chat(history, self.inline_config)
+
+    def recreate_chat(self, history: List[genai_types.Content],
+                      config: Optional[genai_types.GenerateContentConfig] = None) -> chats.AsyncChat:
+        """Same mode and instructions as the current chat, starting from `history`."""
+        if history and is_route_preamble(history[0]):
+            history = history[2:]
+        # The route preamble always leads, whatever compaction or trimming cut away
+        return self._create_chat(config or self.config, self.route_preamble + list(history))
+
+    async def with_cached_prompt(self, chat: chats.AsyncChat) -> chats.AsyncChat:
+        """`chat`, or a copy of it switched to (or off) the mode's cached prompt."""
+        config = await prompt_cache.config_for(self.client, self.api_key, self.mode, self.inline_config)
+        if config is self.config:
+            return chat
+        return self._create_chat(config, chat.get_history())
 
 
 @dataclass
@@ -162,14 +231,31 @@ class SessionState:
     status: str = "Idle"
     current_route: Optional[Dict] = None
     current_step: Optional[Dict] = None
-    chat: Optional[chats.Chat] = None
+    compiled_route: Optional[deviation.CompiledRoute] = None # Decoded geometry of current_route
+    progress_tracker: Optional[deviation.RouteProgressTracker] = None # Step/progress matching on compiled_route
+    dump_map_image: bool = static_maps.STATIC_MAP_DEBUG_DUMP # Debug: write this session's map overviews to disk
+    map_prefetch_task: Optional[asyncio.Task] = field(default=None, repr=False)
+    chat: Optional[chats.AsyncChat] = None
     current_loc: Optional[Dict] = None
     new_destination: Optional[str] = None
+    route_destination: Optional[str] = None # "lat,lng" and travel mode current_route was computed for
+    route_mode: str = "WALK"
+    rerouted: bool = False # Route replaced automatically since the last turn
     mode_switched: bool = False
     chat_manager: Optional[ChatManager] = None
     history: List[Any] = field(default_factory=list)
+    sent_frames: List[Tuple[bytes, int]] = field(default_factory=list, repr=False) # (jpeg, dHash) of the last camera frames sent
+    prompt_tokens: int = 0 # Prompt size of the last model call, from usage_metadata
+    prefers_zh: bool = True # Language of the user's last request; routes come in zh-TW
+    push_state: Optional[Any] = field(default=None, repr=False) # push_guidance.PushState of the current route
+    held_push: Optional[str] = None # Pushed guidance of a deferred tracking pass, sent with the next response
+    reroute_state: Optional[Any] = field(default=None, repr=False) # reroute.RerouteState, off-route detection and task
+    location_filter: Optional[LocationFilter] = field(default=None, repr=False) # GPS smoothing state
     gemini_api_key: Optional[str] = None
     maps_api_key: Optional[str] = None
+    # Only one turn per session may talk to the chat at a time; other sessions are unaffected
+    turn_lock: asyncio.Lock = field(default_factory=asyncio.Lock, repr=False)
+    requests_in_flight: int = 0 # ChatRequests being answered, see SessionManager.in_use
 
     def __post_init__(self):
         # Use provided API key or fallback to environment variable
@@ -181,15 +267,119 @@ class SessionState:
             print(f"Warning: Session {self.session_id} - No Gemini API key available")
 
 
+def is_turn_start(content: genai_types.Content) -> bool:
+    # A user message, not the function responses that answer a model's calls
+    return content.role == "user" and not any(p.function_response for p in content.parts or [])
+
+
+def trim_chat_history(session_state: SessionState, max_contents: int) -> int:
+    """
+    Drops the oldest turns of the session's chat so at most `max_contents`
+    contents remain, cutting only at the start of a user turn. Returns the
+    number of contents dropped. Call with the session's turn_lock held.
+    """
+    chat = session_state.chat
+    if not chat or not session_state.chat_manager or not session_state.chat_manager.config:
+        return 0
+    history = chat.get_history()
+    if len(history) <= max_contents:
+        return 0
+    start = next((i for i in range(len(history) - max_contents, len(history)) if is_turn_start(history[i])), None)
+    if start is None:
+        return 0
+    session_state.chat = session_state.chat_manager.recreate_chat(history[start:])
+    return start
+
+
+def clear_route_guidance(session_state: SessionState) -> None:
+    """Cancels the background work of the current route and forgets its reroute and push guidance state."""
+    if session_state.map_prefetch_task and not session_state.map_prefetch_task.done():
+        session_state.map_prefetch_task.cancel()
+    session_state.map_prefetch_task = None
+    if session_state.reroute_state:
+        session_state.reroute_state.cancel()
+    session_state.reroute_state = None
+    session_state.push_state = None
+    session_state.held_push = None
+
+
+def release_session(session_state: SessionState) -> None:
+    """Cancels background work and drops everything the session holds on to."""
+    clear_route_guidance(session_state)
+    session_state.status = "Idle"
+    session_state.current_route = None
+    session_state.compiled_route = None
+    session_state.progress_tracker = None
+    session_state.current_step = None
+    session_state.new_destination = None
+    session_state.chat = None
+    session_state.chat_manager = None
+    session_state.history = []
+    session_state.sent_frames = []
+    if session_state.location_filter:
+        session_state.location_filter.cancel()
+    session_state.location_filter = None
+
+
+def frame_hashes_in_context(session_state: SessionState) -> List[int]:
+    """dHashes of the last camera frames sent that are still in the chat (history strips old blobs)."""
+    chat = session_state.chat
+    if not session_state.sent_frames or not chat:
+        return []
+    in_context = {part.inline_data.data for content in chat.get_history() for part in content.parts or []
+                  if part.inline_data and part.inline_data.data}
+    return [image_hash for data, image_hash in session_state.sent_frames if data in in_context]
+
+
+def _content_bytes(content: genai_types.Content) -> int:
+    size = 0
+    for part in content.parts or []:
+        if part.text:
+            size += len(part.text)
+        if part.inline_data and part.inline_data.data:
+            size += len(part.inline_data.data)
+        if part.function_call:
+            size += len(json.dumps(part.function_call.args or {}, default=str))
+        if part.function_response:
+            size += len(json.dumps(part.function_response.response or {}, default=str))
+    return size
+
+
+def session_bytes(session_state: SessionState) -> int:
+    """Rough size of what the session keeps alive: chat history, route and its compiled geometry."""
+    size = 0
+    if session_state.chat:
+        size += sum(_content_bytes(c) for c in session_state.chat.get_history())
+    if session_state.current_route:
+        size += len(json.dumps(session_state.current_route))
+    compiled = session_state.compiled_route
+    if compiled:
+        for holder in (compiled, compiled.segments):
+            size += sum(v.nbytes for v in vars(holder).values() if hasattr(v, "nbytes"))
+    return size
+
+
 def set_current_location(session_state: SessionState, loc: Dict) -> None:
     session_state.current_loc = loc
     print(f"Session {session_state.session_id}: Current location set to: {session_state.current_loc}")
+    update_route_progress(session_state)
+
+
+def update_route_progress(session_state: SessionState) -> Optional[Dict]:
+    # Advance the session's step tracker with the latest fix while navigating
+    tracker = session_state.progress_tracker
+    loc = session_state.current_loc
+    if session_state.status != "Navigating" or not tracker or not loc:
+        return session_state.current_step
+    session_state.current_step = tracker.update(float(loc["lat"]), float(loc["lng"]))
+    return session_state.current_step
 
 
 async def get_current_location(session_state: SessionState) -> List[float]:
     print(f"Session {session_state.session_id}: Getting current location: {session_state.current_loc}")
     if session_state.current_loc and "lat" in session_state.current_loc and "lng" in session_state.current_loc:
-        return [float(session_state.current_loc["lat"]), float(session_state.current_loc["lng"]), session_state.current_loc.get("heading", 0)]
+        return [float(session_state.current_loc["lat"]), float(session_state.current_loc["lng"]),
+                location_filter.heading_description(session_state.current_loc)]
     # This should ideally not be reached if client always sends location.
     # If it can be reached, implement a fallback or raise a more specific error.
     print(f"Warning: Session {session_state.session_id}: Current location not available in session. Returning default or raising error.")
@@ -199,37 +389,43 @@ async def get_current_location(session_state: SessionState) -> List[float]:
 
 
 async def geocode_place(session_state: SessionState, query: str) -> Dict:
-    async with httpx.AsyncClient(timeout=10) as c:
+    async def fetch() -> Dict:
         print(f"Session {session_state.session_id}: Geocoding '{query}'")
-        r = await c.get(
+        r = await maps_client.get(
             "https://maps.googleapis.com/maps/api/geocode/json",
             params={"address": query, "key": MAP_KEY, "language": "zh-TW"},
         )
-    r.raise_for_status()
-    results = r.json().get("results")
-    if not results:
-        raise RuntimeError(f"No location found for query: {query}")
-    loc = results[0]["geometry"]["location"]
-    print(f"Session {session_state.session_id}: Geocoded location for '{query}': {loc}")
-    return {"lat": loc["lat"], "lng": loc["lng"]}
+        r.raise_for_status()
+        results = r.json().get("results")
+        if not results:
+            raise RuntimeError(f"No location found for query: {query}")
+        loc = results[0]["geometry"]["location"]
+        print(f"Session {session_state.session_id}: Geocoded location for '{query}': {loc}")
+        return {"lat": loc["lat"], "lng": loc["lng"]}
+
+    return await geo_cache.geocode_cache.get_or_fetch(geo_cache.normalize_query(query), fetch)
 
 
 async def reverse_geocode(session_state: SessionState, lat: float, lng: float) -> Dict:
-    async with httpx.AsyncClient(timeout=10) as c:
+    async def fetch() -> Dict:
         print(f"Session {session_state.session_id}: Reverse geocoding {lat},{lng}")
-        r = await c.get(
+        r = await maps_client.get(
             "https://maps.googleapis.com/maps/api/geocode/json",
             params={"latlng": f"{lat},{lng}", "key": MAP_KEY, "language": "zh-TW"},
         )
-    r.raise_for_status()
-    result = r.json()
-    if not result.get("results"):
-        raise RuntimeError("No address found for these coordinates")
-    # Simplified response, expand as needed
-    return {"formatted_address": result["results"][0].get("formatted_address", "Unknown address")}
+        r.raise_for_status()
+        result = r.json()
+        if not result.get("results"):
+            raise RuntimeError("No address found for these coordinates")
+        # Simplified response, expand as needed
+        return {"formatted_address": result["results"][0].get("formatted_address", "Unknown address")}
 
+    cell = geo_cache.grid_cell(float(lat), float(lng), geo_cache.REVERSE_GEOCODE_CELL_METERS)
+    return await geo_cache.reverse_geocode_cache.get_or_fetch(cell, fetch)
 
-async def compute_route(session_state: SessionState, origin: str, destination: str, mode: str = "WALK") -> Dict:
+
+async def fetch_route(session_state: SessionState, origin: str, destination: str, mode: str = "WALK") -> Dict:
+    """Routes API call (through route_cache) without touching the session's route."""
     # Use session-specific Maps API key if available
     maps_key = session_state.maps_api_key or MAP_KEY
     if not maps_key:
@@ -249,17 +445,34 @@ async def compute_route(session_state: SessionState, origin: str, destination: s
         "languageCode": "zh-TW"
     }
     url = f"https://routes.googleapis.com/directions/v2:computeRoutes?key={maps_key}"
-    async with httpx.AsyncClient(timeout=20) as c:
-        r = await c.post(url, headers=hdr, json=body)
-    r.raise_for_status()
-    data = r.json()
 
-    if not data.get("routes"):
-        raise RuntimeError("No route found by Google Maps API.")
-    
-    route_data = data["routes"][0]
-    session_state.current_route = route_data # Store the computed route in session
-    
+    async def fetch() -> Dict:
+        r = await maps_client.post(url, headers=hdr, json=body, timeout=20)
+        r.raise_for_status()
+        data = r.json()
+
+        if not data.get("routes"):
+            raise RuntimeError("No route found by Google Maps API.")
+        return data["routes"][0]
+
+    # Served from cache when the same trip, or a trip starting on a cached route
+    # to this destination, was computed recently.
+    return await route_cache.get_or_compute((lat1, lng1), (lat2, lng2), mode, fetch)
+
+
+def install_route(session_state: SessionState, route_data: Dict) -> None:
+    """Makes route_data the session's route. Geometry and tracker are built first and swapped in together."""
+    compiled = deviation.CompiledRoute(route_data) # Decode polylines once per route
+    tracker = deviation.RouteProgressTracker(compiled)
+    session_state.current_route, session_state.compiled_route, session_state.progress_tracker = \
+        route_data, compiled, tracker
+
+
+async def compute_route(session_state: SessionState, origin: str, destination: str, mode: str = "WALK") -> Dict:
+    route_data = await fetch_route(session_state, origin, destination, mode)
+    install_route(session_state, route_data) # Store the computed route in session
+    session_state.route_destination, session_state.route_mode = destination, mode # For automatic reroutes
+
     dist_km = route_data.get("distanceMeters", 0) / 1000
     duration_str = route_data.get("duration", "0s")
     duration_sec = int(duration_str[:-1]) # Remove 's' and convert to int
@@ -279,11 +492,17 @@ async def search_places(session_state: SessionState, query: str, location: Optio
         if radius:
             params["radius"] = min(radius, 50000)
 
-    async with httpx.AsyncClient(timeout=10) as c:
+    async def fetch() -> Dict:
         print(f"Session {session_state.session_id}: Searching places for '{query}' near {location} within {radius}m")
-        r = await c.get("https://maps.googleapis.com/maps/api/place/textsearch/json", params=params)
-    r.raise_for_status()
-    return {"places":r.json().get("results", [])}
+        r = await maps_client.get("https://maps.googleapis.com/maps/api/place/textsearch/json", params=params)
+        r.raise_for_status()
+        return {"places":r.json().get("results", [])}
+
+    cache_key = geo_cache.normalize_query(query)
+    if "location" in params:
+        cell = geo_cache.grid_cell(float(location["lat"]), float(location["lng"]), geo_cache.SEARCH_PLACES_CELL_METERS)
+        cache_key = f"{cache_key}|{cell}|{params.get('radius', '')}"
+    return await geo_cache.search_places_cache.get_or_fetch(cache_key, fetch)
 
 
 async def place_details(session_state: SessionState, place_id: str) -> Dict:
@@ -292,14 +511,16 @@ async def place_details(session_state: SessionState, place_id: str) -> Dict:
         raise ValueError(f"Session {session_state.session_id}: No Maps API key available")
         
     fields = ["name", "formatted_address", "formatted_phone_number", "opening_hours", "rating", "website"]
-    async with httpx.AsyncClient(timeout=10) as c:
+    async def fetch() -> Dict:
         print(f"Session {session_state.session_id}: Getting details for place_id '{place_id}'")
-        r = await c.get(
+        r = await maps_client.get(
             "https://maps.googleapis.com/maps/api/place/details/json",
             params={"place_id": place_id, "key": maps_key, "language": "zh-TW", "fields": ",".join(fields)},
         )
-    r.raise_for_status()
-    return r.json().get("result", {})
+        r.raise_for_status()
+        return r.json().get("result", {})
+
+    return await geo_cache.place_details_cache.get_or_fetch(f"{place_id}|{','.join(fields)}", fetch)
 
 
 async def get_current_step_from_session(session_state: SessionState) -> Optional[Dict]: # Renamed to avoid clash with schema name
@@ -332,8 +553,11 @@ async def end_navigation(session_state: SessionState) -> None:
     if not session_state.chat_manager:
         raise ValueError(f"Session {session_state.session_id}: ChatManager not initialized.")
 
+    clear_route_guidance(session_state)
     session_state.status = "Idle"
     session_state.current_route = None
+    session_state.compiled_route = None
+    session_state.progress_tracker = None
     session_state.current_step = None
     session_state.chat = session_state.chat_manager.create_idle_chat_for_session()
     session_state.mode_switched = True
@@ -359,7 +583,226 @@ async def get_full_route_from_session(session_state: SessionState) -> Optional[D
     return session_state.current_route
 
 
-async def ask_llm(session_state: SessionState, message_content: Any, images: Optional[List[bytes]] = None) -> tuple[Optional[List[Dict]], str]:
+# Upper bound on model round-trips spent on tool calls within one user turn
+MAX_TOOL_HOPS = int(os.getenv("MAX_TOOL_HOPS", "6"))
+
+# Tools that change session state; they run one at a time, in the order the model asked
+SESSION_MUTATING_TOOLS = {"compute_route", "start_navigation", "end_navigation", "restart_navigation"}
+
+llm_stats = {"turns": 0, "model_calls": 0, "tool_calls": 0, "parallel_tool_batches": 0, "hop_limit_hits": 0,
+             "prompt_tokens": 0, "cached_tokens": 0, "output_tokens": 0}
+
+
+def _merge_text_parts(parts: List[genai_types.Part]) -> List[genai_types.Part]:
+    # A streamed response arrives a few words per part; adjacent text parts become one
+    merged: List[genai_types.Part] = []
+    for part in parts:
+        previous = merged[-1] if merged else None
+        if part.text is not None and not part.thought and previous is not None \
+                and previous.text is not None and not previous.thought:
+            merged[-1] = previous.model_copy(update={"text": previous.text + part.text})
+        else:
+            merged.append(part)
+    return merged
+
+
+async def _stream_message(session_state: SessionState, chat: chats.AsyncChat, llm_parts: List[genai_types.Part],
+                          stream: TurnStream) -> genai_types.GenerateContentResponse:
+    """
+    Like chat.send_message, but passes the text to `stream` as it arrives. The
+    response is recorded in the chat as one content rather than one per chunk.
+    """
+    manager = session_state.chat_manager
+    user_content = genai_types.Content(role="user", parts=llm_parts)
+    stream.start_response()
+    parts, usage, finished = [], None, False
+    async for chunk in await manager.client.aio.models.generate_content_stream(
+            model=MODEL_NAME, contents=chat.get_history(curated=True) + [user_content], config=manager.config):
+        if chunk.usage_metadata:
+            usage = chunk.usage_metadata
+        candidate = chunk.candidates[0] if chunk.candidates else None
+        if candidate and candidate.finish_reason:
+            finished = True
+        for part in (candidate.content.parts if candidate and candidate.content else None) or []:
+            if part.text and not part.thought:
+                stream.feed(part.text)
+            parts.append(part)
+    content = genai_types.Content(role="model", parts=_merge_text_parts(parts))
+    chat.record_history(user_input=user_content, model_output=[content] if parts else [],
+                        is_valid=bool(parts) and finished)
+    return genai_types.GenerateContentResponse(
+        candidates=[genai_types.Candidate(content=content)] if parts else [], usage_metadata=usage)
+
+
+def _cache_rejected(e: genai_errors.APIError) -> bool:
+    # Only errors about the cached content itself (expired, deleted, not found);
+    # a bad image or an invalid history is a 400 too and must not drop the shared handle
+    if e.code not in (400, 403, 404):
+        return False
+    text = f"{e.message or ''} {e.details or ''}".lower().replace("_", "").replace(" ", "")
+    return "cachedcontent" in text
+
+
+async def _send_message(session_state: SessionState, llm_parts: List[genai_types.Part],
+                        stream: Optional[TurnStream] = None) -> genai_types.GenerateContentResponse:
+    chat = session_state.chat
+    try:
+        if stream:
+            return await _stream_message(session_state, chat, llm_parts, stream)
+        return await chat.send_message(llm_parts)
+    except genai_errors.APIError as e:
+        manager = session_state.chat_manager
+        if not _cache_rejected(e) or not manager or not prompt_cache.is_cached(manager.config):
+            raise
+        # The cached prompt expired or was deleted under us: retry once with the inline prompt
+        # (the request is rejected before any text streams, so nothing is said twice)
+        print(f"Session {session_state.session_id}: Cached prompt rejected ({e.code}), retrying inline.")
+        prompt_cache.invalidate(manager.api_key, manager.mode)
+        session_state.chat = manager.recreate_chat(chat.get_history(), manager.inline_config)
+        if stream:
+            return await _stream_message(session_state, session_state.chat, llm_parts, stream)
+        return await session_state.chat.send_message(llm_parts)
+
+
+async def execute_tool(session_state: SessionState, fn_name: str, fn_args: Dict, hop: int = 0) -> Dict:
+    with tracing.span(f"tool.{fn_name}", tool=fn_name, hop=hop) as span:
+        fn_response_content = await _execute_tool(session_state, fn_name, fn_args, span)
+        if tracing.ENABLED:
+            span.set("bytes_out", len(json.dumps(fn_response_content, default=str)))
+    return fn_response_content
+
+
+async def _execute_tool(session_state: SessionState, fn_name: str, fn_args: Dict, span) -> Dict:
+    print(f"Session {session_state.session_id}: LLM requested function call: {fn_name} with args {fn_args}")
+    try:
+        if fn_name == "geocode_place":
+            fn_response_content = await geocode_place(session_state, **fn_args)
+        elif fn_name == "reverse_geocode":
+            fn_response_content = await reverse_geocode(session_state, **fn_args)
+        elif fn_name == "compute_route":
+            # compute_route stores result in session_state.current_route
+            route_details = await compute_route(session_state, **fn_args)
+            # We need to return something simple for the FunctionResponse,
+            # the main data (current_route) is now in session_state.
+            fn_response_content = {"status": "success", "distanceMeters": route_details.get("distanceMeters"), "duration": route_details.get("duration")}
+        elif fn_name == "search_places":
+            fn_response_content = await search_places(session_state, **fn_args)
+        elif fn_name == "place_details":
+            fn_response_content = await place_details(session_state, **fn_args)
+        elif fn_name == "start_navigation":
+            await start_navigation(session_state) # Modifies session_state
+            fn_response_content = {"status": "navigation_started"}
+        elif fn_name == "end_navigation":
+            await end_navigation(session_state) # Modifies session_state
+            fn_response_content = {"status": "navigation_ended"}
+        elif fn_name == "get_current_step": # Corresponds to get_current_step_decl
+            fn_response_content = await get_current_step_from_session(session_state)
+        elif fn_name == "get_current_location": # Corresponds to get_current_location_decl
+            loc = await get_current_location(session_state)
+            fn_response_content = {"lat": loc[0], "lng": loc[1],"heading": loc[2]}
+        elif fn_name == "restart_navigation":
+            await restart_navigation(session_state, **fn_args) # Modifies session_state
+            fn_response_content = {"status": "navigation_restart_initiated"}
+        elif fn_name == "get_full_route": # Corresponds to get_full_route_decl
+            fn_response_content = await get_full_route_from_session(session_state)
+        else:
+            print(f"Session {session_state.session_id}: Unknown function call {fn_name}")
+            fn_response_content = {"error": f"Unknown function: {fn_name}"}
+    except Exception as e:
+        print(f"Session {session_state.session_id}: Error executing function {fn_name}: {e}")
+        traceback.print_exc()
+        span.set("error", str(e))
+        fn_response_content = {"error": str(e)} # Inform LLM about the error
+
+    # FunctionResponse.response must be an object
+    if not isinstance(fn_response_content, dict):
+        fn_response_content = {"result": fn_response_content}
+    return fn_response_content
+
+
+async def execute_tool_calls(session_state: SessionState, calls: List[genai_types.FunctionCall],
+                             hop: int = 0) -> List[genai_types.Part]:
+    """
+    Runs every function call of one model response and returns their
+    FunctionResponse parts in call order. Independent read-only tools run
+    concurrently; session-mutating tools are barriers executed one by one.
+    """
+    results: List[Optional[Dict]] = [None] * len(calls)
+    batch: List[int] = []
+
+    async def flush():
+        if len(batch) > 1:
+            llm_stats["parallel_tool_batches"] += 1
+        outputs = await asyncio.gather(*(
+            execute_tool(session_state, calls[i].name, dict(calls[i].args) if calls[i].args else {}, hop)
+            for i in batch))
+        for i, output in zip(batch, outputs):
+            results[i] = output
+        batch.clear()
+
+    for i, call in enumerate(calls):
+        if call.name in SESSION_MUTATING_TOOLS:
+            await flush()
+            results[i] = await execute_tool(session_state, call.name, dict(call.args) if call.args else {}, hop)
+        else:
+            batch.append(i)
+    await flush()
+
+    llm_stats["tool_calls"] += len(calls)
+    return [genai_types.Part(function_response=genai_types.FunctionResponse(name=call.name, response=result))
+            for call, result in zip(calls, results)]
+
+
+def _append_to_history(session_state: SessionState, contents: List[genai_types.Content]) -> None:
+    """Adds an exchange that didn't go through the model to the session's chat history."""
+    manager, chat = session_state.chat_manager, session_state.chat
+    if manager and chat:
+        session_state.chat = manager.recreate_chat(chat.get_history() + contents)
+
+
+def _close_unanswered_calls(session_state: SessionState, calls: List[genai_types.FunctionCall], reply: str) -> None:
+    """
+    Ends a turn whose last model response still has function calls without
+    another model call: the calls get error responses and `reply` is recorded
+    as the model's answer, so the next turn doesn't start from an unpaired call.
+    """
+    error = {"error": "Not executed: the tool call limit for this request was reached."}
+    _append_to_history(session_state, [
+        genai_types.Content(role="user", parts=[
+            genai_types.Part(function_response=genai_types.FunctionResponse(name=call.name, response=error))
+            for call in calls]),
+        genai_types.Content(role="model", parts=[genai_types.Part(text=reply)]),
+    ])
+
+
+def _parts_bytes(parts: List[genai_types.Part]) -> int:
+    # Text and inline media sent in one model call (function responses count as their JSON)
+    size = 0
+    for part in parts:
+        if part.text:
+            size += len(part.text.encode())
+        elif part.inline_data and part.inline_data.data:
+            size += len(part.inline_data.data)
+        elif part.function_response:
+            size += len(json.dumps(part.function_response.response, default=str))
+    return size
+
+
+def _trace_response(span, response: genai_types.GenerateContentResponse) -> None:
+    content = response.candidates[0].content if response.candidates else None
+    parts = (content.parts or []) if content else []
+    span.set("bytes_out", _parts_bytes(parts))
+    span.set("tool_calls", sum(1 for p in parts if p.function_call))
+    usage = response.usage_metadata
+    if usage:
+        span.set("prompt_tokens", usage.prompt_token_count or 0)
+        span.set("cached_tokens", usage.cached_content_token_count or 0)
+        span.set("output_tokens", usage.candidates_token_count or 0)
+
+
+async def ask_llm(session_state: SessionState, message_content: Any, images: Optional[List[bytes]] = None,
+                  stream: Optional[TurnStream] = None) -> tuple[Optional[List[Dict]], str]:
+    # With a `stream`, the answer is streamed and its sentences go out as they arrive (see streaming.py)
     if session_state.mode_switched:
         session_state.mode_switched = False
         return None, "" # Indicates mode was just switched, no actual LLM call needed for this turn
@@ -372,6 +815,8 @@ async def ask_llm(session_state: SessionState, message_content: Any, images: Opt
         print(f"Warning: Session {session_state.session_id}: Chat not found, reinitializing to idle chat.")
         active_chat = session_state.chat_manager.create_idle_chat_for_session()
         session_state.chat = active_chat
+    if session_state.chat_manager:
+        session_state.chat = await session_state.chat_manager.with_cached_prompt(active_chat)
     
     print(f"Session {session_state.session_id}: Sending to LLM. Message type: {type(message_content)}")
 
@@ -397,74 +842,62 @@ async def ask_llm(session_state: SessionState, message_content: Any, images: Opt
             print(f"Warning: Session {session_state.session_id}: No content to send to LLM.")
             return None, "NO_UPDATE" # Or handle as appropriate, e.g., "What can I help you with?"
 
-        # print(f"Session {session_state.session_id}: Sending parts to LLM: {llm_parts}")
-        response = active_chat.send_message(llm_parts)
-        
-        # Process response, including function calls
-        if not response.candidates:
-            print(f"Session {session_state.session_id}: No candidates in LLM response.")
-            return None, "I'm sorry, I couldn't process that."
-
-        candidate_part = response.candidates[0].content.parts[0]
-
-        if candidate_part.function_call and candidate_part.function_call.name:
-            fn_call = candidate_part.function_call
-            fn_name = fn_call.name
-            fn_args = dict(fn_call.args) if fn_call.args else {}
-            print(f"Session {session_state.session_id}: LLM requested function call: {fn_name} with args {fn_args}")
-
-            fn_response_content = None
-            try:
-                if fn_name == "geocode_place":
-                    fn_response_content = await geocode_place(session_state, **fn_args)
-                elif fn_name == "reverse_geocode":
-                    fn_response_content = await reverse_geocode(session_state, **fn_args)
-                elif fn_name == "compute_route":
-                    # compute_route stores result in session_state.current_route
-                    route_details = await compute_route(session_state, **fn_args)
-                    # We need to return something simple for the FunctionResponse,
-                    # the main data (current_route) is now in session_state.
-                    fn_response_content = {"status": "success", "distanceMeters": route_details.get("distanceMeters"), "duration": route_details.get("duration")}
-                elif fn_name == "search_places":
-                    fn_response_content = await search_places(session_state, **fn_args)
-                elif fn_name == "place_details":
-                    fn_response_content = await place_details(session_state, **fn_args)
-                elif fn_name == "start_navigation":
-                    await start_navigation(session_state) # Modifies session_state
-                    fn_response_content = {"status": "navigation_started"}
-                elif fn_name == "end_navigation":
-                    await end_navigation(session_state) # Modifies session_state
-                    fn_response_content = {"status": "navigation_ended"}
-                elif fn_name == "get_current_step": # Corresponds to get_current_step_decl
-                    fn_response_content = await get_current_step_from_session(session_state)
-                elif fn_name == "get_current_location": # Corresponds to get_current_location_decl
-                    loc = await get_current_location(session_state)
-                    fn_response_content = {"lat": loc[0], "lng": loc[1],"heading": loc[2]}
-                elif fn_name == "restart_navigation":
-                    await restart_navigation(session_state, **fn_args) # Modifies session_state
-                    fn_response_content = {"status": "navigation_restart_initiated"}
-                elif fn_name == "get_full_route": # Corresponds to get_full_route_decl
-                    fn_response_content = await get_full_route_from_session(session_state)
-                else:
-                    print(f"Session {session_state.session_id}: Unknown function call {fn_name}")
-                    fn_response_content = {"error": f"Unknown function: {fn_name}"}
-                
-                function_response_part = genai_types.FunctionResponse(name=fn_name, response=fn_response_content)
-                return await ask_llm(session_state, function_response_part) # Recursive call
-
-            except Exception as e:
-                print(f"Session {session_state.session_id}: Error executing function {fn_name}: {e}")
-                traceback.print_exc()
-                error_response_part = genai_types.FunctionResponse(name=fn_name, response={"error": str(e)})
-                return await ask_llm(session_state, error_response_part) # Inform LLM about the error
-
-        elif candidate_part.text:
-            print(f"Session {session_state.session_id}: LLM response text: {candidate_part.text}")
-            return None, candidate_part.text
-        
-        # Fallback if no function call and no text
-        print(f"Session {session_state.session_id}: LLM response had no actionable content (no function call, no text).")
-        return None, "I'm not sure how to respond to that."
+        llm_stats["turns"] += 1
+        hops = 0
+        # Each iteration is one model round-trip; all function calls of a response
+        # are answered together in the next one.
+        while True:
+            # print(f"Session {session_state.session_id}: Sending parts to LLM: {llm_parts}")
+            llm_stats["model_calls"] += 1
+            with tracing.span("llm", hop=hops, streamed=stream is not None) as span:
+                if tracing.ENABLED:
+                    span.set("bytes_in", _parts_bytes(llm_parts))
+                response = await _send_message(session_state, llm_parts, stream)
+                if tracing.ENABLED:
+                    _trace_response(span, response)
+            usage = response.usage_metadata
+            if usage:
+                session_state.prompt_tokens = usage.prompt_token_count or 0
+                llm_stats["prompt_tokens"] += session_state.prompt_tokens
+                llm_stats["cached_tokens"] += usage.cached_content_token_count or 0
+                llm_stats["output_tokens"] += usage.candidates_token_count or 0
+                print(f"Session {session_state.session_id}: Tokens: prompt {session_state.prompt_tokens} "
+                      f"({usage.cached_content_token_count or 0} cached), output {usage.candidates_token_count or 0}")
+
+            # Process response, including function calls
+            if not response.candidates or not response.candidates[0].content:
+                print(f"Session {session_state.session_id}: No candidates in LLM response.")
+                return None, "I'm sorry, I couldn't process that."
+
+            candidate_parts = response.candidates[0].content.parts or []
+            fn_calls = [p.function_call for p in candidate_parts if p.function_call and p.function_call.name]
+
+            if not fn_calls:
+                text = "".join(p.text for p in candidate_parts if p.text)
+                if text:
+                    print(f"Session {session_state.session_id}: LLM response text: {text}")
+                    return None, text
+                # Fallback if no function call and no text
+                print(f"Session {session_state.session_id}: LLM response had no actionable content (no function call, no text).")
+                return None, "I'm not sure how to respond to that."
+
+            if hops >= MAX_TOOL_HOPS:
+                llm_stats["hop_limit_hits"] += 1
+                print(f"Session {session_state.session_id}: Tool hop budget ({MAX_TOOL_HOPS}) exhausted.")
+                text = "I'm sorry, that took too many steps. Please try again."
+                _close_unanswered_calls(session_state, fn_calls, text)
+                return None, text
+            hops += 1
+
+            if stream:
+                stream.tool_calls_started()
+            llm_parts = await execute_tool_calls(session_state, fn_calls, hops)
+
+            if session_state.mode_switched:
+                # start/end/restart_navigation replaced the chat; the old chat's
+                # function calls have nothing left to answer them.
+                session_state.mode_switched = False
+                return None, ""
 
     except Exception as e:
         print(f"Session {session_state.session_id}: General error in ask_llm: {e}")
@@ -472,59 +905,142 @@ async def ask_llm(session_state: SessionState, message_content: Any, images: Opt
         return None, f"An error occurred: {str(e)}"
 
 
+async def _fetch_static_map(session_state: SessionState, center_lat: float, center_lng: float,
+                            encoded_polyline: Optional[str], maps_key: str) -> bytes:
+    map_url_params = {
+        "center": f"{center_lat},{center_lng}",
+        "zoom": str(static_maps.STATIC_MAP_ZOOM),
+        "size": static_maps.STATIC_MAP_SIZE,
+        "maptype": "roadmap",
+        "key": maps_key
+    }
+    if encoded_polyline:
+        map_url_params["path"] = f"weight:3|color:blue|enc:{encoded_polyline}"
+
+    map_url = "https://maps.googleapis.com/maps/api/staticmap"
+    r = await maps_client.get(map_url, params=map_url_params)
+    r.raise_for_status()
+    print(f"Session {session_state.session_id}: Static map image fetched for {center_lat},{center_lng}.")
+    return r.content
+
+
+async def _cached_static_map(session_state: SessionState, lat: float, lng: float,
+                             encoded_polyline: Optional[str], maps_key: str) -> Tuple[bytes, float, float]:
+    """The unmarked tile around (lat, lng) and its snapped center."""
+    center_lat, center_lng, cell = static_maps.snap_center(lat, lng)
+    tile = await static_maps.tile_cache.get_or_fetch(
+        static_maps.tile_key(cell, encoded_polyline),
+        lambda: _fetch_static_map(session_state, center_lat, center_lng, encoded_polyline, maps_key),
+    )
+    return tile, center_lat, center_lng
+
+
+async def _prefetch_static_maps(session_state: SessionState, encoded_polyline: Optional[str], maps_key: str) -> None:
+    # Warm the tiles the user is about to walk into
+    tracker, compiled = session_state.progress_tracker, session_state.compiled_route
+    if not tracker or not compiled:
+        return
+    along = tracker.distance_along_route
+    for i in range(1, static_maps.STATIC_MAP_PREFETCH_TILES + 1):
+        point = compiled.segments.point_at_distance(along + i * static_maps.STATIC_MAP_PREFETCH_SPACING_METERS)
+        if point is None:
+            return
+        try:
+            await _cached_static_map(session_state, point[0], point[1], encoded_polyline, maps_key)
+        except Exception as e:
+            print(f"Session {session_state.session_id}: Static map prefetch failed: {e}")
+            return
+
+
 async def get_static_map_image(session_state: SessionState, location_coords: List[float]) -> Optional[bytes]:
     maps_key = session_state.maps_api_key or MAP_KEY
     if not maps_key:
         raise ValueError(f"Session {session_state.session_id}: No Maps API key available")
         
     try:
-        async with httpx.AsyncClient(timeout=10) as c:
-            map_url_params = {
-                "center": f"{location_coords[0]},{location_coords[1]}",
-                "zoom": "17",
-                "size": "600x600",
-                "markers": f"color:red|{location_coords[0]},{location_coords[1]}",
-                "maptype": "roadmap",
-                "key": maps_key
-            }
-            if session_state.status == "Navigating" and session_state.current_route:
-                polyline = session_state.current_route.get("polyline", {}).get("encodedPolyline")
-                if polyline:
-                    map_url_params["path"] = f"weight:3|color:blue|enc:{polyline}"
-            
-            map_url = "https://maps.googleapis.com/maps/api/staticmap"
-            r = await c.get(map_url, params=map_url_params)
-            r.raise_for_status()
-            print(f"Session {session_state.session_id}: Static map image fetched successfully.")
-            return r.content
+        encoded_polyline = None
+        if session_state.status == "Navigating" and session_state.current_route:
+            encoded_polyline = session_state.current_route.get("polyline", {}).get("encodedPolyline")
+
+        with tracing.span("static_map", with_route=encoded_polyline is not None) as span:
+            lat, lng = location_coords[0], location_coords[1]
+            tile, center_lat, center_lng = await _cached_static_map(session_state, lat, lng, encoded_polyline, maps_key)
+            image = await asyncio.to_thread(static_maps.draw_user_marker, tile, lat, lng, center_lat, center_lng)
+            span.set("bytes_out", len(image))
+
+        if encoded_polyline and static_maps.STATIC_MAP_PREFETCH_TILES > 0:
+            previous = session_state.map_prefetch_task
+            if previous is None or previous.done():
+                session_state.map_prefetch_task = asyncio.create_task(
+                    _prefetch_static_maps(session_state, encoded_polyline, maps_key))
+        return image
     except Exception as e:
         print(f"Session {session_state.session_id}: Error getting static map: {e}")
         return None
 
 
-async def chatbot_conversation(session_state: SessionState, user_input: str, images: Optional[List[bytes]] = None) -> NavResponse:
+def _write_debug_map_image(path: str, data: bytes) -> None:
+    with open(path, "wb") as f:
+        f.write(data)
+
+
+async def chatbot_conversation(session_state: SessionState, user_input: str, images: Optional[List[bytes]] = None,
+                               audio: Optional[bytes] = None, stream: Optional[TurnStream] = None) -> NavResponse:
+    # Turns of the same session are serialized so the chat history never interleaves,
+    # while turns of different sessions overlap their model latency.
+    # `audio` is a WAV utterance sent to the model as-is instead of a transcript.
+    # `stream` receives the answer sentence by sentence while the model writes it.
+    async with session_state.turn_lock:
+        return await _chatbot_turn(session_state, user_input, images, audio, stream)
+
+
+async def _chatbot_turn(session_state: SessionState, user_input: str, images: Optional[List[bytes]] = None,
+                        audio: Optional[bytes] = None, stream: Optional[TurnStream] = None) -> NavResponse:
     try:
         current_session_loc_list = await get_current_location(session_state)
     except ValueError as e: # Handle case where location is not set
         print(f"Session {session_state.session_id}: Cannot proceed with chatbot_conversation, {e}")
         return f"Error: Could not determine your current location for session {session_state.session_id}."
 
+    if user_input:
+        session_state.prefers_zh = guidance.is_zh(user_input)
+
+    # Progress / next-maneuver questions during navigation are answered from the
+    # tracked step directly: no static map, no model round-trip. Not with camera
+    # frames, which the model has to look at. The exchange still goes into the
+    # chat history so follow-up questions to the model make sense.
+    if session_state.status == "Navigating" and session_state.progress_tracker and not session_state.new_destination \
+            and not audio and not images:
+        progress = update_route_progress(session_state)
+        fast_text = guidance.fast_path_response(user_input, progress, session_state.progress_tracker.step_of_route())
+        if fast_text:
+            print(f"Session {session_state.session_id}: Answered on the navigation fast path: {fast_text}")
+            _append_to_history(session_state, [
+                genai_types.Content(role="user", parts=[genai_types.Part(text=user_input)]),
+                genai_types.Content(role="model", parts=[genai_types.Part(text=fast_text)]),
+            ])
+            return NavResponse(response_text=fast_text, alerts=[])
+
     map_image_bytes = await get_static_map_image(session_state, current_session_loc_list)
 
     combined_images_list = []
     if map_image_bytes:
         combined_images_list.append(map_image_bytes)
-        # For debugging:
-        with open(f"map_image.jpg", "wb") as f:
-            f.write(map_image_bytes)
-        print(f"Session {session_state.session_id}: Map image saved.")
+        if session_state.dump_map_image: # For debugging, off unless the session opts in
+            path = f"map_image_{session_state.session_id}.jpg"
+            await asyncio.to_thread(_write_debug_map_image, path, map_image_bytes)
+            print(f"Session {session_state.session_id}: Map image saved to {path}.")
     if images:
         combined_images_list.extend(images)
 
     if session_state.status == "Navigating" and session_state.current_route:
-        if deviation: # Check if deviation module is imported
+        if session_state.progress_tracker:
+            current_step_info = update_route_progress(session_state)
+            print(f"Session {session_state.session_id}: Updated current step: {current_step_info}")
+        elif deviation: # Check if deviation module is imported
             current_step_info = deviation.get_current_step(
-                current_session_loc_list[0], current_session_loc_list[1], session_state.current_route, 100 # 20m tolerance
+                current_session_loc_list[0], current_session_loc_list[1],
+                session_state.compiled_route or session_state.current_route, 100 # 20m tolerance
             )
             session_state.current_step = current_step_info
             print(f"Session {session_state.session_id}: Updated current step: {current_step_info}")
@@ -533,13 +1049,23 @@ async def chatbot_conversation(session_state: SessionState, user_input: str, ima
 
 
     effective_input = user_input
+    rerouted, session_state.rerouted = session_state.rerouted, False
     if session_state.new_destination:
         # Prepend instruction to navigate to new destination
         effective_input = f"My new destination is {session_state.new_destination}. Please guide me there. Original request was: {user_input}"
         print(f"Session {session_state.session_id}: New destination detected: {session_state.new_destination}. Updating input.")
         session_state.new_destination = None # Consumed
+    elif rerouted:
+        effective_input = (f"(I left the route and it was recalculated from my current position to the same "
+                           f"destination; guide me on the new route.) {user_input}")
+
+    if audio:
+        effective_input = [
+            genai_types.Part(text=effective_input or "The user's request is in the attached audio. Reply to what they said."),
+            genai_types.Part(inline_data=genai_types.Blob(mime_type="audio/wav", data=audio)),
+        ]
 
-    _, text_response = await ask_llm(session_state, effective_input, images=combined_images_list)
+    _, text_response = await ask_llm(session_state, effective_input, images=combined_images_list, stream=stream)
     
     mode_display = "Navigation" if session_state.status == "Navigating" else "Idle"
     print(f"[Session {session_state.session_id} Mode: {mode_display}] LLM Replied.")
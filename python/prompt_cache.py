@@ -0,0 +1,134 @@
+import os
+import time
+import hashlib
+import logging
+from typing import Dict, Optional, Tuple
+
+from google import genai
+from google.genai import types as genai_types
+
+from geo_cache import SingleFlight
+
+# Gemini context caching for the static part of every chat: the system
+# instruction and tool declarations of a mode (idle / navigation). One cached
+# content per (API key, mode) is shared by all sessions using that key; chats
+# then send only `cached_content` instead of the full prompt, which is billed
+# at the cached rate and doesn't have to be re-read before the first token.
+#
+# Handles are refreshed PROMPT_CACHE_REFRESH_MARGIN seconds before they expire.
+# When creating one fails (prompt below the model's minimum cacheable size,
+# model without caching, quota) the inline config is used and creation is not
+# retried for PROMPT_CACHE_RETRY_AFTER seconds. The inline prompt is identical
+# across sessions, so Gemini's implicit prefix caching still applies to it.
+
+PROMPT_CACHE = os.getenv("PROMPT_CACHE", "on") != "off"
+PROMPT_CACHE_TTL = int(os.getenv("PROMPT_CACHE_TTL", "3600"))
+PROMPT_CACHE_REFRESH_MARGIN = int(os.getenv("PROMPT_CACHE_REFRESH_MARGIN", "300"))
+PROMPT_CACHE_RETRY_AFTER = int(os.getenv("PROMPT_CACHE_RETRY_AFTER", "900"))
+
+CacheKey = Tuple[str, str]  # (api key fingerprint, mode)
+
+
+class _Handle:
+    def __init__(self, name: str, expires_at: float, config: genai_types.GenerateContentConfig):
+        self.name = name
+        self.expires_at = expires_at
+        self.config = config
+
+
+class PromptCache:
+    def __init__(self, model: str, ttl_seconds: int = PROMPT_CACHE_TTL,
+                 refresh_margin: int = PROMPT_CACHE_REFRESH_MARGIN, retry_after: int = PROMPT_CACHE_RETRY_AFTER,
+                 enabled: bool = PROMPT_CACHE):
+        self.model = model
+        self.ttl_seconds = ttl_seconds
+        self.refresh_margin = refresh_margin
+        self.retry_after = retry_after
+        self.enabled = enabled
+        self._handles: Dict[CacheKey, _Handle] = {}
+        self._clients: Dict[CacheKey, genai.Client] = {}  # to delete the caches on shutdown
+        self._pending = SingleFlight()  # concurrent sessions wait for the same creation
+        self._disabled_until: Dict[CacheKey, float] = {}
+        self.stats = {"lookups": 0, "hits": 0, "creates": 0, "refreshes": 0, "failures": 0,
+                      "fallbacks": 0, "invalidations": 0}
+
+    @staticmethod
+    def _key(api_key: Optional[str], mode: str) -> CacheKey:
+        return hashlib.sha256((api_key or "").encode()).hexdigest()[:16], mode
+
+    def is_cached(self, config: Optional[genai_types.GenerateContentConfig]) -> bool:
+        return bool(config and config.cached_content)
+
+    async def _create(self, client: genai.Client, key: CacheKey,
+                      inline: genai_types.GenerateContentConfig) -> Optional[_Handle]:
+        try:
+            cached = await client.aio.caches.create(
+                model=self.model,
+                config=genai_types.CreateCachedContentConfig(
+                    display_name=f"nav-{key[1]}-{key[0][:8]}",
+                    system_instruction=inline.system_instruction,
+                    tools=inline.tools,
+                    ttl=f"{self.ttl_seconds}s",
+                ),
+            )
+        except Exception as e:
+            self.stats["failures"] += 1
+            self._disabled_until[key] = time.monotonic() + self.retry_after
+            logging.warning(f"Prompt cache for mode {key[1]} unavailable, using the inline prompt: {e}")
+            return None
+        # Only settings that may accompany cached_content; instruction and tools live in the cache
+        config = genai_types.GenerateContentConfig(cached_content=cached.name, temperature=inline.temperature)
+        self._clients[key] = client
+        return _Handle(cached.name, time.monotonic() + self.ttl_seconds, config)
+
+    async def _refresh(self, client: genai.Client, key: CacheKey,
+                       inline: genai_types.GenerateContentConfig) -> Optional[_Handle]:
+        new_handle = await self._create(client, key, inline)
+        if new_handle:
+            self.stats["refreshes" if key in self._handles else "creates"] += 1
+            self._handles[key] = new_handle
+        else:
+            self._handles.pop(key, None)
+        return new_handle
+
+    async def config_for(self, client: genai.Client, api_key: Optional[str], mode: str,
+                         inline: genai_types.GenerateContentConfig) -> genai_types.GenerateContentConfig:
+        """The cached-content config for `mode`, or `inline` when no cache is available."""
+        self.stats["lookups"] += 1
+        if not self.enabled:
+            self.stats["fallbacks"] += 1
+            return inline
+        key = self._key(api_key, mode)
+        now = time.monotonic()
+        handle = self._handles.get(key)
+        if handle and handle.expires_at - self.refresh_margin > now:
+            self.stats["hits"] += 1
+            return handle.config
+        if self._disabled_until.get(key, 0) > now:
+            self.stats["fallbacks"] += 1
+            return inline
+
+        new_handle = await self._pending.do(key, lambda: self._refresh(client, key, inline))
+        if new_handle is None:
+            self.stats["fallbacks"] += 1
+            return inline
+        return new_handle.config
+
+    def invalidate(self, api_key: Optional[str], mode: str) -> None:
+        """Forget a handle the API no longer accepts (deleted or expired early)."""
+        if self._handles.pop(self._key(api_key, mode), None):
+            self.stats["invalidations"] += 1
+
+    async def close(self) -> None:
+        """Deletes the caches this process created instead of leaving them to their TTL."""
+        handles, self._handles = self._handles, {}
+        for key, handle in handles.items():
+            try:
+                await self._clients[key].aio.caches.delete(name=handle.name)
+            except Exception as e:
+                logging.warning(f"Could not delete prompt cache {handle.name}: {e}")
+
+    def snapshot(self) -> Dict[str, float]:
+        lookups = self.stats["lookups"]
+        return {**self.stats, "live_handles": len(self._handles),
+                "hit_rate": round(self.stats["hits"] / lookups, 3) if lookups else 0.0}
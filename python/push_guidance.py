@@ -0,0 +1,152 @@
+import os
+import time
+from typing import Dict, Optional, Set, Tuple
+
+import deviation
+import guidance
+import reroute
+from navigator import SessionState
+
+# Guidance the server speaks on its own while navigating, driven only by GPS
+# fixes: "in 20 meters, turn left" as the user passes distance thresholds before
+# each maneuver, arrival, and off-route warnings. Everything is computed from
+# the session's progress tracker and compiled route (no model, no network), so
+# a prompt goes out on the fix that triggers it.
+#
+# Arrival needs both the last step tracked to within PUSH_ARRIVAL_METERS of its
+# end and the fix itself that close to the route's end point.
+#
+# Off-route uses hysteresis: the user is considered off the route after
+# PUSH_OFF_ROUTE_FIXES consecutive fixes farther than PUSH_OFF_ROUTE_METERS, and
+# back on it once a fix is within PUSH_BACK_ON_ROUTE_METERS. While off the route
+# the warning is repeated every PUSH_OFF_ROUTE_REPEAT_SECONDS and maneuver
+# prompts are held back. When the route is replaced mid-navigation (see
+# reroute.py) the next maneuver on the new one is announced right away.
+
+PUSH_GUIDANCE = os.getenv("PUSH_GUIDANCE", "on") != "off"
+# Announce the next maneuver when it gets this close, largest first
+PUSH_THRESHOLDS_METERS = sorted((float(m) for m in os.getenv("PUSH_THRESHOLDS_METERS", "50,20").split(",")),
+                                reverse=True)
+PUSH_ARRIVAL_METERS = float(os.getenv("PUSH_ARRIVAL_METERS", "10"))
+PUSH_OFF_ROUTE_METERS = float(os.getenv("PUSH_OFF_ROUTE_METERS", "30"))
+PUSH_BACK_ON_ROUTE_METERS = float(os.getenv("PUSH_BACK_ON_ROUTE_METERS", "15"))
+PUSH_OFF_ROUTE_FIXES = int(os.getenv("PUSH_OFF_ROUTE_FIXES", "2"))
+PUSH_OFF_ROUTE_REPEAT_SECONDS = float(os.getenv("PUSH_OFF_ROUTE_REPEAT_SECONDS", "30"))
+
+_TEXTS = {
+    "arrived": ("You have arrived at your destination.", "您已抵達目的地。"),
+    "off_route": ("You seem to be off the route. Stop and ask me to reroute if you are lost.",
+                  "您似乎偏離了路線。如果迷路了，請停下來並請我重新規劃路線。"),
+    "off_route_auto": ("You seem to be off the route. If you stay off it I will find a new route.",
+                       "您似乎偏離了路線。如果持續偏離，我會為您重新規劃路線。"),
+    "back_on_route": ("You are back on the route.", "您已回到路線上。"),
+}
+
+_stats = {"fixes": 0, "maneuver_prompts": 0, "arrivals": 0, "off_route_warnings": 0, "back_on_route": 0}
+
+
+class PushState:
+    """What has already been said on one route, so nothing is announced twice."""
+
+    def __init__(self, compiled_route: deviation.CompiledRoute, replaced: bool = False):
+        self.compiled_route = compiled_route
+        self.end = tuple(compiled_route.segments.seg_b[-1]) if len(compiled_route.segments) else None
+        self.announce_next = replaced  # route swapped while navigating: say where to go now
+        self.announced: Set[Tuple[int, float]] = set()  # (step position, threshold)
+        self.arrived = False
+        self.off_route = False
+        self.far_fixes = 0
+        self.last_warning = 0.0
+
+
+def _text(key: str, zh: bool) -> str:
+    return _TEXTS[key][1 if zh else 0]
+
+
+def _off_route_text(zh: bool) -> str:
+    return _text("off_route_auto" if reroute.AUTO_REROUTE else "off_route", zh)
+
+
+def _off_route_update(state: PushState, lat: float, lng: float, now: float, zh: bool) -> Tuple[bool, Optional[str]]:
+    """Applies the hysteresis; returns (off route, text to say)."""
+    route = state.compiled_route
+    if not state.off_route:
+        if not deviation.has_user_deviated(lat, lng, route, PUSH_OFF_ROUTE_METERS):
+            state.far_fixes = 0
+            return False, None
+        state.far_fixes += 1
+        if state.far_fixes < PUSH_OFF_ROUTE_FIXES:
+            return False, None
+        state.off_route, state.last_warning = True, now
+        _stats["off_route_warnings"] += 1
+        return True, _off_route_text(zh)
+
+    if not deviation.has_user_deviated(lat, lng, route, PUSH_BACK_ON_ROUTE_METERS):
+        state.off_route, state.far_fixes = False, 0
+        _stats["back_on_route"] += 1
+        return False, _text("back_on_route", zh)
+    if now - state.last_warning >= PUSH_OFF_ROUTE_REPEAT_SECONDS:
+        state.last_warning = now
+        _stats["off_route_warnings"] += 1
+        return True, _off_route_text(zh)
+    return True, None
+
+
+def _at_destination(state: PushState, lat: float, lng: float) -> bool:
+    # Checked against the fix itself, not only the tracked step: a wrong match must never announce arrival
+    return state.end is not None and \
+        deviation.haversine_distance(lat, lng, state.end[0], state.end[1]) <= PUSH_ARRIVAL_METERS
+
+
+def _maneuver_update(state: PushState, progress: Dict, position: int, lat: float, lng: float,
+                     zh: bool) -> Optional[str]:
+    to_maneuver = progress["distance_to_next_maneuver_meters"]
+    if progress.get("is_last_step") and to_maneuver <= PUSH_ARRIVAL_METERS and _at_destination(state, lat, lng):
+        if state.arrived:
+            return None
+        state.arrived = True
+        _stats["arrivals"] += 1
+        return _text("arrived", zh)
+
+    crossed = [t for t in PUSH_THRESHOLDS_METERS if to_maneuver <= t and (position, t) not in state.announced]
+    if state.announce_next:
+        state.announce_next = False
+    elif not crossed:
+        return None
+    # Passing several thresholds between two fixes gives one prompt, not one per threshold
+    state.announced.update((position, t) for t in crossed)
+    _stats["maneuver_prompts"] += 1
+    return guidance.next_maneuver_text(progress, zh)
+
+
+def on_location(session_state: SessionState, now: Optional[float] = None) -> Optional[str]:
+    """
+    Evaluates the session's latest fix (after navigator.set_current_location)
+    and returns what to tell the user unprompted, if anything.
+    """
+    route = session_state.compiled_route
+    loc = session_state.current_loc
+    if not PUSH_GUIDANCE or session_state.status != "Navigating" or route is None or not loc:
+        session_state.push_state = None
+        return None
+    state = session_state.push_state
+    if state is None or state.compiled_route is not route:
+        # New route: start over
+        state = session_state.push_state = PushState(route, replaced=state is not None)
+    _stats["fixes"] += 1
+    now = time.monotonic() if now is None else now
+    zh = session_state.prefers_zh
+
+    lat, lng = float(loc["lat"]), float(loc["lng"])
+    off_route, text = _off_route_update(state, lat, lng, now, zh)
+    if off_route or text:
+        return text
+    progress = session_state.current_step
+    tracker = session_state.progress_tracker
+    if not progress or not tracker or "distance_to_next_maneuver_meters" not in progress:
+        return None
+    return _maneuver_update(state, progress, tracker.last_position, lat, lng, zh)
+
+
+def stats() -> Dict[str, int]:
+    return dict(_stats)
@@ -0,0 +1,155 @@
+import os
+import time
+import asyncio
+import logging
+from typing import Dict, Optional, Tuple
+
+import navigator
+from navigator import SessionState
+from session_manager import session_manager
+
+# Automatic rerouting. When the user stays off the route, a new route from the
+# current fix to the same destination is computed in the background and swapped
+# in as soon as it arrives; the chat is not rebuilt, tracking and push guidance
+# just continue on the new geometry and the model is told on the next turn.
+#
+# Leaving the route takes REROUTE_MIN_FIXES fixes farther than
+# REROUTE_OFF_ROUTE_METERS spanning at least REROUTE_SUSTAIN_SECONDS; a fix
+# within REROUTE_BACK_ON_ROUTE_METERS starts the count over. A session reroutes
+# at most once per REROUTE_MIN_INTERVAL seconds and never has two computations
+# in flight. If the route changed meanwhile (the model computed one, navigation
+# ended), the result is thrown away.
+
+AUTO_REROUTE = os.getenv("AUTO_REROUTE", "on") != "off"
+REROUTE_OFF_ROUTE_METERS = float(os.getenv("REROUTE_OFF_ROUTE_METERS", "40"))
+REROUTE_BACK_ON_ROUTE_METERS = float(os.getenv("REROUTE_BACK_ON_ROUTE_METERS", "20"))
+REROUTE_MIN_FIXES = int(os.getenv("REROUTE_MIN_FIXES", "3"))
+REROUTE_SUSTAIN_SECONDS = float(os.getenv("REROUTE_SUSTAIN_SECONDS", "8"))
+REROUTE_MIN_INTERVAL = float(os.getenv("REROUTE_MIN_INTERVAL", "30"))
+REROUTE_TIMEOUT = float(os.getenv("REROUTE_TIMEOUT", "20"))
+
+_TEXTS = ("Found a new route from here.", "已為您重新規劃路線。")
+
+_stats = {"started": 0, "swapped": 0, "failed": 0, "discarded": 0, "rate_limited": 0}
+_latency_ms_total = 0.0
+
+
+class RerouteState:
+    """Off-route evidence and the reroute in flight, for one session."""
+
+    def __init__(self):
+        self.far_fixes = 0
+        self.far_since: Optional[float] = None
+        self.last_started = float("-inf")
+        self.task: Optional[asyncio.Task] = None
+        self.announcement: Optional[str] = None  # said on the next fix after a swap
+
+    def cancel(self) -> None:
+        if self.task and not self.task.done():
+            self.task.cancel()
+        self.task = None
+
+    def in_flight(self) -> bool:
+        return self.task is not None and not self.task.done()
+
+
+def route_target(session_state: SessionState) -> Tuple[Optional[str], str]:
+    """("lat,lng", mode) of the current route's destination."""
+    if session_state.route_destination:
+        return session_state.route_destination, session_state.route_mode
+    # Sessions stored before the destination was kept: the end of the last step
+    steps = [s for leg in (session_state.current_route or {}).get("legs", []) for s in leg.get("steps", [])]
+    end = (steps[-1].get("endLocation") or {}).get("latLng") if steps else None
+    if not end:
+        return None, session_state.route_mode
+    return f"{end['latitude']},{end['longitude']}", session_state.route_mode
+
+
+async def _reroute(session_state: SessionState, state: RerouteState, old_route: Dict,
+                   origin: str, destination: str, mode: str) -> None:
+    global _latency_ms_total
+    started = time.perf_counter()
+    try:
+        route = await asyncio.wait_for(navigator.fetch_route(session_state, origin, destination, mode),
+                                       REROUTE_TIMEOUT)
+    except asyncio.CancelledError:
+        raise
+    except Exception as e:
+        _stats["failed"] += 1
+        logging.warning(f"Session {session_state.session_id}: Reroute failed: {e}")
+        return
+    if session_state.status != "Navigating" or session_state.current_route is not old_route:
+        _stats["discarded"] += 1
+        logging.info(f"Session {session_state.session_id}: Route changed during reroute, result discarded")
+        return
+
+    # No awaits from here on: nothing sees a half-swapped route
+    navigator.install_route(session_state, route)
+    navigator.update_route_progress(session_state)
+    manager = session_state.chat_manager
+    if manager and manager.mode == "navigation":
+        manager.route_preamble = navigator.route_preamble(route)  # used whenever the chat is next rebuilt
+    session_state.rerouted = True
+    state.announcement = _TEXTS[1 if session_state.prefers_zh else 0]
+    _stats["swapped"] += 1
+    elapsed_ms = (time.perf_counter() - started) * 1000
+    _latency_ms_total += elapsed_ms
+    logging.info(f"Session {session_state.session_id}: Rerouted in {elapsed_ms:.0f} ms, "
+                 f"{route.get('distanceMeters', 0)} m to go")
+    # A replica that picks the session up next continues on the new route
+    await session_manager.persist(session_state)
+
+
+def on_location(session_state: SessionState, now: Optional[float] = None) -> Optional[str]:
+    """
+    Evaluates the session's latest fix (after navigator.set_current_location):
+    may start a background reroute, and returns the announcement of one that
+    has completed since the previous fix.
+    """
+    route = session_state.compiled_route
+    loc = session_state.current_loc
+    if not AUTO_REROUTE or session_state.status != "Navigating" or route is None or not loc:
+        if session_state.reroute_state:
+            session_state.reroute_state.cancel()
+        session_state.reroute_state = None
+        return None
+    state = session_state.reroute_state
+    if state is None:
+        state = session_state.reroute_state = RerouteState()
+    if state.announcement:
+        text, state.announcement = state.announcement, None
+        return text
+    if state.in_flight():
+        return None
+    now = time.monotonic() if now is None else now
+
+    lat, lng = float(loc["lat"]), float(loc["lng"])
+    distance = route.distance_to_route(lat, lng, REROUTE_OFF_ROUTE_METERS)
+    if distance > REROUTE_OFF_ROUTE_METERS:
+        state.far_fixes += 1
+        if state.far_since is None:
+            state.far_since = now
+    elif distance <= REROUTE_BACK_ON_ROUTE_METERS:
+        state.far_fixes, state.far_since = 0, None
+    if state.far_fixes < REROUTE_MIN_FIXES or now - state.far_since < REROUTE_SUSTAIN_SECONDS:
+        return None
+    if now - state.last_started < REROUTE_MIN_INTERVAL:
+        _stats["rate_limited"] += 1
+        return None
+
+    destination, mode = route_target(session_state)
+    if not destination:
+        return None
+    logging.info(f"Session {session_state.session_id}: Off the route for {now - state.far_since:.0f} s, rerouting")
+    state.last_started, state.far_fixes, state.far_since = now, 0, None
+    _stats["started"] += 1
+    state.task = asyncio.create_task(
+        _reroute(session_state, state, session_state.current_route, f"{lat},{lng}", destination, mode))
+    return None
+
+
+def stats() -> Dict[str, float]:
+    result = dict(_stats)
+    if _stats["swapped"]:
+        result["avg_latency_ms"] = round(_latency_ms_total / _stats["swapped"], 1)
+    return result
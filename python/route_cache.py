@@ -0,0 +1,150 @@
+import os
+import copy
+from typing import Awaitable, Callable, Dict, List, Optional, Set, Tuple
+
+import polyline
+
+import deviation
+import geo_cache
+
+# Route cache for navigator.compute_route. Routes are keyed on the grid cells of
+# origin and destination plus the travel mode. On a miss, a cached route to the
+# same destination whose polyline passes near the new origin is reused: the steps
+# already behind the user are dropped and the current step is cut at the user's
+# projection, so re-routes from a few meters away never reach the Routes API.
+# Exact-key hits are trimmed the same way. Every caller gets its own copy.
+
+ROUTE_CACHE_TTL = float(os.getenv("ROUTE_CACHE_TTL", "900"))
+ROUTE_CACHE_MAX_ENTRIES = int(os.getenv("ROUTE_CACHE_MAX_ENTRIES", "1000"))
+ROUTE_CACHE_CELL_METERS = float(os.getenv("ROUTE_CACHE_CELL_METERS", "30"))
+ROUTE_CORRIDOR_TOLERANCE_METERS = float(os.getenv("ROUTE_CORRIDOR_TOLERANCE_METERS", "25"))
+
+LatLng = Tuple[float, float]
+
+
+def _seconds(duration: Optional[str]) -> float:
+    # Routes API durations look like "123s"
+    if not duration:
+        return 0.0
+    return float(duration.rstrip("s") or 0)
+
+
+def _step_coordinates(step: Dict) -> List[LatLng]:
+    encoded = step.get("polyline", {}).get("encodedPolyline")
+    return deviation.decode_google_polyline(encoded) if encoded else []
+
+
+def _latlng(lat: float, lng: float) -> Dict:
+    return {"latLng": {"latitude": lat, "longitude": lng}}
+
+
+def route_suffix(route: Dict, user_lat: float, user_lng: float, tolerance_meters: float) -> Optional[Dict]:
+    """
+    Remaining part of `route` as seen from (user_lat, user_lng), or None if the
+    user is not within `tolerance_meters` of any step.
+    """
+    # Nearest step rather than the first one in tolerance: near a step's end the
+    # previous step is usually within tolerance too.
+    best = None
+    for li, leg in enumerate(route.get("legs", [])):
+        for si, step in enumerate(leg.get("steps", [])):
+            distance = deviation.shortest_distance_to_route(user_lat, user_lng, _step_coordinates(step))
+            if distance <= tolerance_meters and (best is None or distance <= best[0]):
+                best = (distance, li, si)
+    if best is None:
+        return None
+    _, leg_index, step_index = best
+
+    legs = copy.deepcopy(route.get("legs", [])[leg_index:])
+    legs[0]["steps"] = legs[0].get("steps", [])[step_index:]
+
+    first_step = legs[0]["steps"][0]
+    full_path = _step_coordinates(first_step)
+    remaining_path = deviation.trim_route_coordinates(user_lat, user_lng, full_path)
+    if len(remaining_path) >= 2:
+        full_length = deviation.path_length_meters(full_path)
+        remaining_length = deviation.path_length_meters(remaining_path)
+        ratio = remaining_length / full_length if full_length else 1.0
+        first_step["polyline"] = {"encodedPolyline": polyline.encode(remaining_path)}
+        first_step["startLocation"] = _latlng(*remaining_path[0])
+        first_step["distanceMeters"] = int(round(first_step.get("distanceMeters", remaining_length) * ratio))
+        if "staticDuration" in first_step:
+            first_step["staticDuration"] = f"{int(round(_seconds(first_step['staticDuration']) * ratio))}s"
+
+    route_path: List[LatLng] = []
+    distance = 0
+    duration = 0.0
+    for leg in legs:
+        for step in leg.get("steps", []):
+            step_path = _step_coordinates(step)
+            # consecutive steps share their joint vertex
+            route_path.extend(step_path[1:] if route_path and step_path and step_path[0] == route_path[-1] else step_path)
+            distance += step.get("distanceMeters", 0)
+            duration += _seconds(step.get("staticDuration"))
+
+    suffix = copy.deepcopy({key: value for key, value in route.items()
+                            if key not in ("legs", "polyline", "distanceMeters", "duration")})
+    suffix["legs"] = legs
+    suffix["polyline"] = {"encodedPolyline": polyline.encode(route_path)}
+    suffix["distanceMeters"] = distance
+    suffix["duration"] = f"{int(round(duration))}s"
+    return suffix
+
+
+class RouteCache:
+    def __init__(self, ttl_seconds: float = ROUTE_CACHE_TTL, max_entries: int = ROUTE_CACHE_MAX_ENTRIES,
+                 cell_meters: float = ROUTE_CACHE_CELL_METERS,
+                 corridor_tolerance_meters: float = ROUTE_CORRIDOR_TOLERANCE_METERS):
+        self.cell_meters = cell_meters
+        self.corridor_tolerance_meters = corridor_tolerance_meters
+        self.routes = geo_cache.TTLCache("routes", ttl_seconds, max_entries=max_entries, persistent=False)
+        # destination key -> cache keys of routes ending there, for corridor lookups
+        self._by_destination: Dict[str, Set[str]] = {}
+        self.stats = {"corridor_hits": 0, "corridor_misses": 0}
+
+    def _destination_key(self, destination: LatLng, mode: str) -> str:
+        return f"{mode.upper()}|{geo_cache.grid_cell(*destination, self.cell_meters)}"
+
+    def _key(self, origin: LatLng, destination: LatLng, mode: str) -> str:
+        return f"{self._destination_key(destination, mode)}|{geo_cache.grid_cell(*origin, self.cell_meters)}"
+
+    def corridor_lookup(self, origin: LatLng, destination: LatLng, mode: str) -> Optional[Dict]:
+        dest_key = self._destination_key(destination, mode)
+        keys = self._by_destination.get(dest_key, set())
+        for key in list(keys):
+            route = self.routes.peek(key)  # route_suffix copies what it keeps
+            if route is None:  # expired or evicted
+                keys.discard(key)
+                continue
+            suffix = route_suffix(route, origin[0], origin[1], self.corridor_tolerance_meters)
+            if suffix is not None:
+                self.stats["corridor_hits"] += 1
+                return suffix
+        if not keys:
+            self._by_destination.pop(dest_key, None)
+        self.stats["corridor_misses"] += 1
+        return None
+
+    async def get_or_compute(self, origin: LatLng, destination: LatLng, mode: str,
+                             fetch: Callable[[], Awaitable[Dict]]) -> Dict:
+        key = self._key(origin, destination, mode)
+        cached = self.routes.peek(key)
+        if cached is not None:
+            self.routes.stats["hits"] += 1
+            # The cached route may start anywhere in the origin's cell, up to a cell diagonal away
+            suffix = route_suffix(cached, origin[0], origin[1], self.corridor_tolerance_meters)
+            return suffix if suffix is not None else copy.deepcopy(cached)
+
+        suffix = self.corridor_lookup(origin, destination, mode)
+        if suffix is not None:
+            return suffix
+
+        route = await self.routes.get_or_fetch(key, fetch)
+        self._by_destination.setdefault(self._destination_key(destination, mode), set()).add(key)
+        return route
+
+    def snapshot(self) -> Dict:
+        return {**self.routes.snapshot(), **self.stats}
+
+
+route_cache = RouteCache()
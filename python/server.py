@@ -3,101 +3,95 @@ import logging
 import math
 import time
 import os
-from typing import AsyncIterable, Iterable, Dict
-import wave
-import io
+import functools
+from typing import AsyncIterable, AsyncIterator, Awaitable, Callable, Iterable, Dict, Optional
 import uuid
 
 import grpc
 import gemini_chat_pb2
 import gemini_chat_pb2_grpc
 from dotenv import load_dotenv
-import speech_recognition as sr
 import httpx
 from google import genai
 from google.genai import types
 import navigator
+import genai_clients
+import asr
+import image_pipeline
+import history
+import streaming
+import push_guidance
+import reroute
+import location_filter
+import maps_client
+import geo_cache
+import guidance
+import static_maps
+import tracing
+import session_store
+from route_cache import route_cache
+from session_manager import session_manager
 from navigator import SessionState,NavResponse
 
 load_dotenv()
 
-GOOGLE_SPEECH_API_KEY = os.getenv("GOOGLE_SPEECH_API_KEY")
 logging.basicConfig(level=logging.INFO)
 
-# Store active sessions
-active_sessions: Dict[str, SessionState] = {}
+# Replicas sharing a SESSION_STORE on one host each need their own port
+PORT = int(os.getenv("PORT", "50051"))
 
 def get_or_create_session(session_id: str) -> SessionState:
-    if session_id not in active_sessions:
-        active_sessions[session_id] = SessionState(session_id=session_id)
+    if session_id not in session_manager:
         logging.info(f"Created new session: {session_id}")
-    return active_sessions[session_id]
+    return session_manager.get_or_create(session_id)
 
-def transcribe_audio(audio_bytes):
-    recognizer = sr.Recognizer()
+async def converse(session_state: SessionState, user_input: str, images, audio: Optional[bytes] = None,
+                   stream: Optional[streaming.TurnStream] = None) -> NavResponse:
+    llm_resp = await navigator.chatbot_conversation(session_state, user_input, images, audio=audio, stream=stream)
+    await session_manager.after_turn(session_state)
+    return llm_resp
+
+async def transcribe_utterance(session_state: SessionState, pcm: bytes, sample_rate: int,
+                               images, stream: Optional[streaming.TurnStream] = None) -> Optional[NavResponse]:
+    """Runs one spoken turn through the ASR backend (or inline to the model) and the navigator."""
     try:
-        sample_rate = 16000 # default sample rate for Google Speech Recognition
-        # if the audio_bytes is a WAV file, we need to convert it to PCM raw data
-        if audio_bytes.startswith(b'RIFF') and b'WAVE' in audio_bytes[:12]:
-            logging.info("Detected WAV file format")
-            
-            # use io.BytesIO to read the WAV file
-            with io.BytesIO(audio_bytes) as wav_io:
-                with wave.open(wav_io, 'rb') as wav_file:
-                    # get WAV file properties
-                    channels = wav_file.getnchannels()
-                    sample_width = wav_file.getsampwidth()
-                    sample_rate = wav_file.getframerate()
-                    
-                    # read the PCM data
-                    pcm_data = wav_file.readframes(wav_file.getnframes())
-                    
-                    audio_bytes = pcm_data
-                    logging.info(f"Converted WAV to PCM raw data with sample rate {sample_rate}")
-        else:
-            logging.info("Detected raw PCM audio format")
-        audio_data = sr.AudioData(audio_bytes, sample_rate, 2)  # each sample is 2 bytes (16 bits)
-        
-        text = recognizer.recognize_google(audio_data)
-        logging.info(f"Transcribed text: {text}")
-        return text
-    except sr.UnknownValueError:
-        logging.warning("Google Speech Recognition could not understand audio")
-        return "Cannot understand audio"
-    except sr.RequestError as e:
-        logging.error(f"Could not request results from Google Speech Recognition service; {e}")
-        return None
-    except Exception as e:
-        logging.error(f"An error occurred during audio transcription: {e}")
-        return None
+        with tracing.span("asr", bytes_in=len(pcm), sample_rate=sample_rate) as span:
+            audio_text, inline_wav = await asr.recognize(pcm, sample_rate)
+            span.set("inline", inline_wav is not None)
+            span.set("bytes_out", len(audio_text.encode()) if audio_text else 0)
+    except asr.UnintelligibleAudio:
+        logging.warning(f"Session {session_state.session_id}: Cannot understand audio")
+        return NavResponse(response_text="Please repeat your request.", alerts=[])
+    if inline_wav:
+        logging.info(f"Session {session_state.session_id}: Sending {len(pcm)} bytes of speech inline to the model")
+        return await converse(session_state, "", images, audio=inline_wav, stream=stream)
+    if audio_text:
+        logging.info(f"Session {session_state.session_id}: Transcribed audio: {audio_text}")
+        return await converse(session_state, audio_text, images, stream=stream)
+    logging.error(f"Session {session_state.session_id}: Failed to transcribe audio")
+    return None
     
-def process_location_data(location_input):
-    lat = location_input.lat
-    lng = location_input.lng
-    heading = location_input.heading  # Get compass heading
-    
-    logging.info(f"Received location: {lat}, {lng} with heading: {heading}°")
-    
-    # Use heading for directional guidance
-    if heading > 337.5 or heading <= 22.5:
-        direction = "north"
-    elif heading > 22.5 and heading <= 67.5:
-        direction = "northeast"
-    elif heading > 67.5 and heading <= 112.5:
-        direction = "east"
-    elif heading > 112.5 and heading <= 157.5:
-        direction = "southeast"
-    elif heading > 157.5 and heading <= 202.5:
-        direction = "south"
-    elif heading > 202.5 and heading <= 247.5:
-        direction = "southwest"
-    elif heading > 247.5 and heading <= 292.5:
-        direction = "west"
-    else:
-        direction = "northwest"
-    
-    # Now you can use the direction in your navigation instructions
-    return direction
+def track_fix(session_state: SessionState, fix: Dict) -> Optional[str]:
+    """Tracks a filtered fix; returns what to push to the user, if anything."""
+    navigator.set_current_location(session_state, fix)
+    # Maneuver prompts, arrival and off-route warnings, straight from the fix;
+    # a reroute that finished since the last fix is announced first
+    rerouted = reroute.on_location(session_state)
+    push_text = push_guidance.on_location(session_state)
+    return " ".join(t for t in (rerouted, push_text) if t) or None
+
+
+def track_deferred_fix(session_state: SessionState, fix: Dict) -> None:
+    # A coalesced fix tracked after the fact: no request to answer, so its prompt
+    # goes out with the session's next response
+    tracked = session_store.tracking_key(session_state)
+    push_text = track_fix(session_state, fix)
+    if push_text:
+        session_state.held_push = " ".join(t for t in (session_state.held_push, push_text) if t)
+        logging.info(f"Session {session_state.session_id}: Holding pushed guidance: {push_text}")
+    if session_store.tracking_key(session_state) != tracked:
+        session_manager.persist_later(session_state)
+
 
 class GeminiChatServicer(gemini_chat_pb2_grpc.GeminiChatServicer):
 
@@ -116,7 +110,8 @@ class GeminiChatServicer(gemini_chat_pb2_grpc.GeminiChatServicer):
             )
             
             # Store session state
-            active_sessions[session_id] = session_state
+            session_manager.add(session_state)
+            await session_manager.persist(session_state)
             
             logging.info(f"Created new session: {session_id}")
             return gemini_chat_pb2.CreateSessionResponse(
@@ -132,11 +127,160 @@ class GeminiChatServicer(gemini_chat_pb2_grpc.GeminiChatServicer):
                 error_message=str(e)
             )
 
+    @staticmethod
+    def _nav_response(session_id: str, session_state: SessionState, llm_resp,
+                      is_final: bool = True) -> gemini_chat_pb2.ChatResponse:
+        response = gemini_chat_pb2.ChatResponse()
+        response.session_id = session_id
+        
+        response.nav.nav_status = session_state.status == "Navigating"
+        response.nav.is_final = is_final
+        if llm_resp:
+            response.nav.nav_description = llm_resp.response_text
+        else:
+            response.nav.nav_description = ""
+        return response
+
+    async def _turn_responses(self, session_id: str, session_state: SessionState, started: float,
+                              run_turn: Callable[..., Awaitable[Optional[NavResponse]]]
+                              ) -> AsyncIterator[gemini_chat_pb2.ChatResponse]:
+        """Runs one turn, yielding its sentences as partial responses and then the final one."""
+        first_word, partial, bytes_out = None, 0, 0
+        spoken = getattr(run_turn, "func", None) is transcribe_utterance
+        with tracing.turn(session_state.session_id, input="speech" if spoken else "text") as turn_span:
+            if not streaming.STREAM_RESPONSES:
+                llm_resp = await run_turn()
+            else:
+                stream = streaming.TurnStream(started)
+
+                async def turn():
+                    try:
+                        return await run_turn(stream=stream)
+                    finally:
+                        stream.close()
+
+                task = asyncio.create_task(turn())
+                try:
+                    async for chunk in stream.chunks():
+                        if first_word is None:
+                            first_word = time.perf_counter() - started
+                        partial += 1
+                        bytes_out += len(chunk.encode())
+                        yield self._nav_response(session_id, session_state,
+                                                 NavResponse(response_text=chunk, alerts=[]), is_final=False)
+                    llm_resp = await task
+                finally:
+                    if not task.done():
+                        task.cancel()  # the client went away mid-turn
+                if llm_resp:
+                    # only what the partial responses haven't said yet
+                    llm_resp = NavResponse(response_text=stream.unsent(llm_resp.response_text), alerts=llm_resp.alerts)
+            if first_word is None and llm_resp and llm_resp.response_text:
+                first_word = time.perf_counter() - started
+            if llm_resp and llm_resp.response_text:
+                bytes_out += len(llm_resp.response_text.encode())
+            turn_span.set("first_word_ms", round(first_word * 1000, 1) if first_word is not None else None)
+            turn_span.set("partial_responses", partial)
+            turn_span.set("bytes_out", bytes_out)
+        streaming.record_turn(first_word, partial)
+        if first_word is not None:
+            logging.info(f"Session {session_state.session_id}: First word after {first_word * 1000:.0f} ms "
+                         f"({partial} partial responses)")
+        yield self._nav_response(session_id, session_state, llm_resp)
+
+    async def _request_responses(self, request: gemini_chat_pb2.ChatRequest, session_state: SessionState,
+                                 endpointers: Dict[str, asr.Endpointer]
+                                 ) -> AsyncIterator[gemini_chat_pb2.ChatResponse]:
+        """Everything one ChatRequest is answered with: a pushed prompt and the responses of its turns."""
+        logging.info(f"Processing request for session {request.session_id}")
+        started = time.perf_counter()
+        
+        push_text = None
+        if (request.HasField("location") and request.location.lat and request.location.lng):
+            with tracing.span("location", session_id=session_state.session_id) as span:
+                # Smoothed, jump-free, and only every LOCATION_MIN_INTERVAL for tracking.
+                # LocationInput has no timestamp, so intervals are measured on arrival.
+                tracked = session_store.tracking_key(session_state)
+                fix = location_filter.ingest(session_state, request.location.lat, request.location.lng,
+                                             request.location.heading, track=track_deferred_fix)
+                if fix is not None:
+                    push_text = track_fix(session_state, fix)
+                if session_store.tracking_key(session_state) != tracked:
+                    # Moved along the route: the replica serving the next request resumes from here
+                    await session_manager.persist(session_state)
+                span.set("tracked", fix is not None)
+                span.set("pushed", push_text is not None)
+        held, session_state.held_push = session_state.held_push, None
+        push_text = " ".join(t for t in (held, push_text) if t) or None
+
+        # The turns this request asks for, known before the push goes out: only
+        # the last response of the exchange may be final
+        turns = []
+        reply = None  # answered without a turn
+        if request.HasField("text"):
+            text_prompt = request.text
+            logging.info(f"Session {session_state.session_id}: Received text: {text_prompt}")
+            turns.append(functools.partial(converse, session_state, text_prompt))
+        elif request.HasField("audio") and request.audio.format == asr.STREAM_FORMAT:
+            # Chunked PCM: answer each utterance as soon as the speaker pauses.
+            # An empty chunk means the client stopped recording.
+            endpointer = endpointers.get(session_state.session_id)
+            if endpointer is None:
+                endpointer = asr.Endpointer(request.audio.sample_rate_hz or asr.ASR_DEFAULT_SAMPLE_RATE)
+                endpointers[session_state.session_id] = endpointer
+            if request.audio.data:
+                utterances = endpointer.feed(request.audio.data)
+            else:
+                utterances = [u for u in [endpointer.flush()] if u]
+            if not utterances and not push_text:
+                return  # still listening
+            turns = [functools.partial(transcribe_utterance, session_state, utterance, endpointer.sample_rate)
+                     for utterance in utterances]
+        elif request.HasField("audio") and request.audio.data:
+            try:
+                pcm, sample_rate = asr.to_pcm(request.audio.data, request.audio.sample_rate_hz)
+                turns.append(functools.partial(transcribe_utterance, session_state, pcm, sample_rate))
+            except asr.UnintelligibleAudio:
+                logging.warning(f"Session {session_state.session_id}: Malformed audio")
+                reply = NavResponse(response_text="Please repeat your request.", alerts=[])
+
+        if push_text:
+            logging.info(f"Session {session_state.session_id}: Pushed guidance: {push_text}")
+            yield self._nav_response(request.session_id, session_state,
+                                     NavResponse(response_text=push_text, alerts=[]),
+                                     is_final=not turns and reply is None)
+        if reply is not None:
+            yield self._nav_response(request.session_id, session_state, reply)
+            return
+        if not turns:
+            if not push_text:
+                yield self._nav_response(request.session_id, session_state, None)
+            return
+
+        multi_images = []
+        if request.HasField("multi_images") and len(request.multi_images.images) > 0:
+            raw_images = [(img.data, img.width, img.height) for img in request.multi_images.images if img.data]
+            with tracing.span("images", session_id=session_state.session_id, count=len(raw_images),
+                              bytes_in=sum(len(img[0]) for img in raw_images)) as span:
+                # Downscaled, EXIF-free, and without older frames the model already has in context
+                multi_images, session_state.sent_frames = await image_pipeline.prepare_images(
+                    raw_images, navigator.frame_hashes_in_context(session_state))
+                span.set("kept", len(multi_images))
+                span.set("bytes_out", sum(len(img) for img in multi_images))
+        logging.info(f"Session {session_state.session_id}: Processing {len(multi_images)} images")
+
+        for run_turn in turns:
+            async for response in self._turn_responses(request.session_id, session_state, started,
+                                                        functools.partial(run_turn, images=multi_images)):
+                yield response
+
     async def ChatStream(
             self, request_iterator: AsyncIterable[gemini_chat_pb2.ChatRequest],
             context) -> AsyncIterable[gemini_chat_pb2.ChatResponse]:
         
         session_state = None
+        # session_id -> endpointer for clients streaming PCM chunks on this stream
+        endpointers: Dict[str, asr.Endpointer] = {}
         try:
             async for request in request_iterator:
                 if not request.session_id:
@@ -144,7 +288,7 @@ class GeminiChatServicer(gemini_chat_pb2_grpc.GeminiChatServicer):
                     continue
                 
                 # Get existing session or return error
-                session_state = active_sessions.get(request.session_id)
+                session_state = await session_manager.fetch(request.session_id)
                 if not session_state:
                     logging.error(f"Invalid session ID: {request.session_id}")
                     response = gemini_chat_pb2.ChatResponse()
@@ -153,57 +297,10 @@ class GeminiChatServicer(gemini_chat_pb2_grpc.GeminiChatServicer):
                     yield response
                     continue
                 
-                logging.info(f"Processing request for session {request.session_id}")
-                
-                if (request.HasField("location") and request.location.lat and request.location.lng):
-                    lat = request.location.lat
-                    lng = request.location.lng
-                    heading_info = process_location_data(request.location) + " angle: " + str(request.location.heading) + "°"
-                    logging.info(f"Session {session_state.session_id}: Received location: {lat}, {lng}")
-                    navigator.set_current_location(session_state, {"lat": lat, "lng": lng, 'heading': heading_info })
-            
-                text_prompt = ""
-                audio_text = ""
-                llm_resp = None
-                
-                multi_images = []
-                if request.HasField("multi_images") and len(request.multi_images.images) > 0:
-                    for img in request.multi_images.images:
-                        if img.data:
-                            multi_images.append(img.data)
-                            
-                logging.info(f"Session {session_state.session_id}: Processing {len(multi_images)} images")
-                if request.HasField("text"):
-                    text_prompt = request.text
-                    logging.info(f"Session {session_state.session_id}: Received text: {text_prompt}")
-                    llm_resp = await navigator.chatbot_conversation(session_state, text_prompt,multi_images)
-                elif request.HasField("audio") and request.audio.data:
-                    audio_text = await asyncio.to_thread(
-                        transcribe_audio, request.audio.data)
-                    
-                    if audio_text == "Cannot understand audio":
-                        llm_resp = NavResponse(response_text="Please repeat your request.",alerts=[])
-                        logging.warning(f"Session {session_state.session_id}: Cannot understand audio")
-                    elif audio_text:
-                        llm_resp = await navigator.chatbot_conversation(session_state, audio_text,multi_images)
-                        logging.info(f"Session {session_state.session_id}: Transcribed audio: {audio_text}")
-                    else:
-                        logging.error(f"Session {session_state.session_id}: Failed to transcribe audio")
-                
-                    # logging.info(f"Session {session_state.session_id}: Processing {len(multi_images)} images")
-                    # alert_resp = await navigator.chatbot_conversation(session_state, 
-                    #     navigator.images_alert_prompt, multi_images)
-
-                response = gemini_chat_pb2.ChatResponse()
-                response.session_id = request.session_id
-                
-                response.nav.nav_status = session_state.status == "Navigating"
-                if llm_resp:
-                    response.nav.nav_description = llm_resp.response_text
-                else:
-                    response.nav.nav_description = ""
-                
-                yield response
+                # Busy for the whole request, not just the turn: never evicted halfway
+                with session_manager.in_use(session_state):
+                    async for response in self._request_responses(request, session_state, endpointers):
+                        yield response
 
         except Exception as e:
             logging.error(f"Error in ChatStream: {e}")
@@ -212,12 +309,17 @@ class GeminiChatServicer(gemini_chat_pb2_grpc.GeminiChatServicer):
             raise
 
 async def serve() -> None:
+    metrics_server = None
     try:
         server = grpc.aio.server()
         gemini_chat_pb2_grpc.add_GeminiChatServicer_to_server(
             GeminiChatServicer(), server)
-        server.add_insecure_port('[::]:50051')
-        logging.info("Starting server on port 50051...")
+        server.add_insecure_port(f'[::]:{PORT}')
+        await maps_client.startup()
+        await image_pipeline.startup()
+        session_manager.start()
+        metrics_server = await tracing.start_metrics_server()
+        logging.info(f"Starting server on port {PORT}...")
         await server.start()
         logging.info("Server started.")
         await server.wait_for_termination()
@@ -227,6 +329,31 @@ async def serve() -> None:
     except Exception as e:
         logging.error(f"An error occurred: {e}")
         await server.stop(0)
+    finally:
+        await session_manager.stop()
+        if metrics_server:
+            metrics_server.close()
+        logging.info(f"Session metrics: {session_manager.metrics()}")
+        logging.info(f"History compaction stats: {history.stats}")
+        await maps_client.shutdown()
+        image_pipeline.shutdown()
+        logging.info(f"Geo cache stats: {geo_cache.stats()}")
+        logging.info(f"Route cache stats: {route_cache.snapshot()}")
+        logging.info(f"Navigation fast path stats: {guidance.stats()}")
+        logging.info(f"Push guidance stats: {push_guidance.stats()}")
+        logging.info(f"Reroute stats: {reroute.stats()}")
+        logging.info(f"Location filter stats: {location_filter.stats()}")
+        logging.info(f"ASR stats: {asr.stats()}")
+        logging.info(f"Image pipeline stats: {image_pipeline.stats()}")
+        logging.info(f"LLM stats: {navigator.llm_stats}")
+        logging.info(f"Response streaming stats: {streaming.stats()}")
+        logging.info(f"Gemini client pool: {genai_clients.registry.snapshot()}")
+        logging.info(f"Prompt cache: {navigator.prompt_cache.snapshot()}")
+        await navigator.prompt_cache.close()
+        logging.info(f"Static map cache stats: {static_maps.stats()}")
+        if tracing.ENABLED:
+            logging.info(f"Span latency: {tracing.snapshot()}")
+        geo_cache.close()
 
 
 if __name__ == "__main__":
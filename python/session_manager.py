@@ -0,0 +1,257 @@
+import os
+import time
+import asyncio
+import logging
+import contextlib
+from collections import OrderedDict
+from typing import Dict, Iterator, Optional, Set
+
+import history
+import navigator
+import session_store
+from navigator import SessionState
+from session_store import SessionStore
+
+# Owner of all live SessionStates. Sessions expire after SESSION_IDLE_TTL seconds
+# without a request; above SESSION_MAX_SESSIONS the least recently used idle
+# session is evicted. Sessions in the middle of a request are never evicted,
+# they are picked up by a later sweep instead. After every turn the chat history is
+# compacted (see history.py) and, as a hard limit, cut back to
+# SESSION_MAX_HISTORY_CONTENTS so a long conversation can't grow without bound.
+#
+# With an external store (see session_store.py) a lookup checks the stored
+# version, reloading sessions another replica has moved on, unless the store
+# reported every save since this replica's copy was written; every finished
+# turn is written back, as is every fix or reroute that moves a session along
+# its route. Local eviction only drops this replica's copy.
+
+SESSION_IDLE_TTL = float(os.getenv("SESSION_IDLE_TTL", "1800"))
+SESSION_MAX_SESSIONS = int(os.getenv("SESSION_MAX_SESSIONS", "1000"))
+SESSION_MAX_HISTORY_CONTENTS = int(os.getenv("SESSION_MAX_HISTORY_CONTENTS", "60"))
+SESSION_SWEEP_INTERVAL = float(os.getenv("SESSION_SWEEP_INTERVAL", "60"))
+
+
+class SessionManager:
+    def __init__(self, idle_ttl: float = SESSION_IDLE_TTL, max_sessions: int = SESSION_MAX_SESSIONS,
+                 max_history_contents: int = SESSION_MAX_HISTORY_CONTENTS,
+                 sweep_interval: float = SESSION_SWEEP_INTERVAL, store: Optional[SessionStore] = None):
+        self.store = store
+        self.idle_ttl = idle_ttl
+        self.max_sessions = max_sessions
+        self.max_history_contents = max_history_contents
+        self.sweep_interval = sweep_interval
+        # session_id -> (state, last used), least recently used first
+        self._sessions: "OrderedDict[str, SessionState]" = OrderedDict()
+        self._last_used: Dict[str, float] = {}
+        self._versions: Dict[str, int] = {}  # store version each local copy corresponds to
+        self._reported: Dict[str, int] = {}  # latest version the store reported saving, for local sessions
+        self._gaps = 0  # times the store's save reports were interrupted
+        self._sweeper: Optional[asyncio.Task] = None
+        self._saves: Set[asyncio.Task] = set()  # from persist_later
+        self.stats = {"created": 0, "evicted_idle": 0, "evicted_lru": 0, "closed": 0,
+                      "history_compactions": 0, "history_trims": 0, "history_contents_dropped": 0,
+                      "store_loads": 0, "store_saves": 0, "store_errors": 0, "store_checks_skipped": 0}
+        if store is not None:
+            store.watch(self._on_store_save, self._on_store_gap)
+
+    def __len__(self) -> int:
+        return len(self._sessions)
+
+    def __contains__(self, session_id: str) -> bool:
+        return session_id in self._sessions
+
+    @staticmethod
+    def _busy(session_state: SessionState) -> bool:
+        return session_state.requests_in_flight > 0 or session_state.turn_lock.locked()
+
+    @staticmethod
+    @contextlib.contextmanager
+    def in_use(session_state: SessionState) -> Iterator[SessionState]:
+        """Keeps the session busy (not evictable, not reloaded) while a request is answered."""
+        session_state.requests_in_flight += 1
+        try:
+            yield session_state
+        finally:
+            session_state.requests_in_flight -= 1
+
+    def _touch(self, session_id: str) -> None:
+        self._sessions.move_to_end(session_id)
+        self._last_used[session_id] = time.monotonic()
+
+    def create(self, session_id: str, **kwargs) -> SessionState:
+        session_state = SessionState(session_id=session_id, **kwargs)
+        self.add(session_state)
+        return session_state
+
+    def add(self, session_state: SessionState) -> None:
+        self._install(session_state)
+        self.stats["created"] += 1
+
+    def _install(self, session_state: SessionState) -> None:
+        previous = self._sessions.pop(session_state.session_id, None)
+        if previous is not None and previous is not session_state:
+            navigator.release_session(previous)
+        self._sessions[session_state.session_id] = session_state
+        self._touch(session_state.session_id)
+        self._enforce_capacity()
+
+    def get(self, session_id: str) -> Optional[SessionState]:
+        """The live session, or None if it never existed or has expired."""
+        session_state = self._sessions.get(session_id)
+        if session_state is None:
+            return None
+        if time.monotonic() - self._last_used[session_id] > self.idle_ttl and not self._busy(session_state):
+            self._evict(session_id, "evicted_idle")
+            return None
+        self._touch(session_id)
+        return session_state
+
+    def _on_store_save(self, session_id: str, version: int) -> None:
+        if session_id in self._sessions:
+            # Reports from several replicas may arrive out of order
+            self._reported[session_id] = max(version, self._reported.get(session_id, 0))
+
+    def _on_store_gap(self) -> None:
+        self._reported.clear()
+        self._gaps += 1
+
+    async def fetch(self, session_id: str) -> Optional[SessionState]:
+        """Like get(), but brings the session in from the store when this replica's copy is missing or stale."""
+        local = self.get(session_id)
+        if self.store is None:
+            return local
+        if local is not None and self.store.watching and session_id in self._reported \
+                and self._reported[session_id] == self._versions.get(session_id):
+            self.stats["store_checks_skipped"] += 1
+            return local  # the last save of the session was this copy
+        try:
+            gaps = self._gaps
+            version = await self.store.version(session_id)
+            if local is not None and version is not None and self.store.watching and self._gaps == gaps:
+                self._on_store_save(session_id, version)  # any later save gets reported
+            if version is None or (local is not None and self._versions.get(session_id) == version):
+                return local
+            if local is not None and self._busy(local):
+                return local  # don't swap the state out from under a running turn
+            loaded = await self.store.load(session_id)
+        except Exception as e:
+            self.stats["store_errors"] += 1
+            logging.error(f"Session store lookup for {session_id} failed: {e}")
+            return local
+        if loaded is None:
+            return local
+        version, data = loaded
+        session_state = session_store.deserialize_session(data)
+        self._install(session_state)
+        self._versions[session_id] = version
+        self.stats["store_loads"] += 1
+        return session_state
+
+    async def persist(self, session_state: SessionState) -> None:
+        """Writes the session to the store, if there is one."""
+        if self.store is None or session_state.session_id not in self._sessions:
+            return
+        try:
+            version = await self.store.save(session_state.session_id, session_store.serialize_session(session_state))
+        except Exception as e:
+            self.stats["store_errors"] += 1
+            logging.error(f"Saving session {session_state.session_id} failed: {e}")
+            return
+        self._versions[session_state.session_id] = version
+        self.stats["store_saves"] += 1
+
+    def persist_later(self, session_state: SessionState) -> None:
+        """persist() from a callback on the event loop: the save runs as a task of its own."""
+        if self.store is None:
+            return
+        task = asyncio.get_running_loop().create_task(self.persist(session_state))
+        self._saves.add(task)
+        task.add_done_callback(self._saves.discard)
+
+    def get_or_create(self, session_id: str) -> SessionState:
+        return self.get(session_id) or self.create(session_id)
+
+    def close(self, session_id: str) -> bool:
+        if session_id not in self._sessions:
+            return False
+        self._evict(session_id, "closed")
+        return True
+
+    def _evict(self, session_id: str, reason: str) -> None:
+        session_state = self._sessions.pop(session_id)
+        self._last_used.pop(session_id, None)
+        self._versions.pop(session_id, None)
+        self._reported.pop(session_id, None)
+        navigator.release_session(session_state)
+        self.stats[reason] += 1
+        logging.info(f"Session {session_id} removed ({reason})")
+
+    def _enforce_capacity(self) -> None:
+        if len(self._sessions) <= self.max_sessions:
+            return
+        for session_id in list(self._sessions):  # oldest first
+            if len(self._sessions) <= self.max_sessions:
+                break
+            if not self._busy(self._sessions[session_id]):
+                self._evict(session_id, "evicted_lru")
+        if len(self._sessions) > self.max_sessions:
+            logging.warning(f"{len(self._sessions)} sessions live, above the cap of {self.max_sessions}: all busy")
+
+    def sweep(self) -> int:
+        """Evicts every idle-expired session; returns how many were removed."""
+        cutoff = time.monotonic() - self.idle_ttl
+        expired = [sid for sid, used in self._last_used.items()
+                   if used < cutoff and not self._busy(self._sessions[sid])]
+        for session_id in expired:
+            self._evict(session_id, "evicted_idle")
+        self._enforce_capacity()
+        return len(expired)
+
+    async def after_turn(self, session_state: SessionState) -> None:
+        """Compacts and caps the chat history once a turn has finished, then saves the session."""
+        async with session_state.turn_lock:
+            if history.compact_history(session_state):
+                self.stats["history_compactions"] += 1
+            dropped = navigator.trim_chat_history(session_state, self.max_history_contents)
+            await self.persist(session_state)
+        if dropped:
+            self.stats["history_trims"] += 1
+            self.stats["history_contents_dropped"] += dropped
+
+    async def _sweep_forever(self) -> None:
+        while True:
+            await asyncio.sleep(self.sweep_interval)
+            try:
+                if self.sweep():
+                    logging.info(f"Session metrics: {self.metrics()}")
+            except Exception as e:
+                logging.error(f"Session sweep failed: {e}")
+
+    def start(self) -> None:
+        if self._sweeper is None:
+            self._sweeper = asyncio.create_task(self._sweep_forever())
+
+    async def stop(self) -> None:
+        if self._sweeper is not None:
+            self._sweeper.cancel()
+            try:
+                await self._sweeper
+            except asyncio.CancelledError:
+                pass
+            self._sweeper = None
+        if self._saves:
+            await asyncio.gather(*self._saves, return_exceptions=True)
+        if self.store is not None:
+            await self.store.close()
+
+    def metrics(self) -> Dict[str, int]:
+        states = list(self._sessions.values())
+        return {
+            "live_sessions": len(states),
+            "navigating": sum(1 for s in states if s.status == "Navigating"),
+            "bytes_held": sum(navigator.session_bytes(s) for s in states),
+            **self.stats,
+        }
+
+
+session_manager = SessionManager(store=session_store.open_store())
@@ -0,0 +1,354 @@
+import os
+import abc
+import json
+import time
+import asyncio
+import logging
+import sqlite3
+import threading
+from typing import Callable, Dict, List, Optional, Tuple
+
+from google.genai import types as genai_types
+
+import deviation
+import history
+from navigator import SessionState
+
+# External home for sessions so several server.py replicas can serve the same
+# session: whichever replica handles a request loads the session if it doesn't
+# hold the latest version, and writes it back after each turn and whenever a
+# fix or a reroute moves it along the route (see tracking_key).
+#
+# Only the portable parts are stored: status, route, step, location, the
+# progress tracker's position and the (compacted, blob-free) chat history.
+# Compiled geometry and the chat object are rebuilt on load. Each save bumps a
+# version number, so a replica can check with one small read whether its
+# in-memory copy is stale. Backends that report saves (memory, redis via
+# pub/sub) spare that read: a replica whose copy is the last version it was
+# told about serves it as is. Concurrent turns of one session on two replicas
+# are last-writer-wins.
+#
+# SESSION_STORE selects the backend:
+#   (unset)             sessions stay in process, single replica only
+#   memory://           in-process store; the local fake for tests
+#   sqlite:///path.db   replicas on one host
+#   redis://host:6379/0 replicas across hosts (needs the redis package)
+#
+# Client-provided API keys are part of the stored session, so the store must be
+# as private as the server's own environment.
+
+SESSION_STORE = os.getenv("SESSION_STORE", "")
+SESSION_STORE_TTL = float(os.getenv("SESSION_STORE_TTL", os.getenv("SESSION_IDLE_TTL", "1800")))
+# Between turns a navigating session is saved at least every this many meters walked
+SESSION_STORE_SAVE_METERS = float(os.getenv("SESSION_STORE_SAVE_METERS", "25"))
+
+
+def serialize_session(session_state: SessionState) -> Dict:
+    contents = session_state.chat.get_history() if session_state.chat else []
+    # Camera and map blobs would dominate the record and are stale on another replica anyway
+    contents = [history.strip_blobs(c) or c for c in contents]
+    tracker = session_state.progress_tracker
+    return {
+        "session_id": session_state.session_id,
+        "status": session_state.status,
+        "current_route": session_state.current_route,
+        "current_step": session_state.current_step,
+        "current_loc": session_state.current_loc,
+        "new_destination": session_state.new_destination,
+        "route_destination": session_state.route_destination,
+        "route_mode": session_state.route_mode,
+        "prefers_zh": session_state.prefers_zh,
+        "dump_map_image": session_state.dump_map_image,
+        "gemini_api_key": session_state.gemini_api_key,
+        "maps_api_key": session_state.maps_api_key,
+        "tracker": {
+            "last_segment": tracker.last_segment,
+            "last_position": tracker.last_position,
+            "distance_along_route": tracker.distance_along_route,
+        } if tracker else None,
+        "chat_mode": session_state.chat_manager.mode if session_state.chat_manager else None,
+        "history": [c.model_dump(mode="json", exclude_none=True) for c in contents],
+    }
+
+
+def tracking_key(session_state: SessionState) -> Tuple:
+    """Changes when a fix or a reroute moves what a stored copy needs to resume tracking."""
+    tracker = session_state.progress_tracker
+    if tracker is None:
+        return session_state.status, id(session_state.current_route)
+    return (session_state.status, id(session_state.current_route), tracker.last_position, tracker.last_segment,
+            int(tracker.distance_along_route // SESSION_STORE_SAVE_METERS))
+
+
+def deserialize_session(data: Dict) -> SessionState:
+    session_state = SessionState(
+        session_id=data["session_id"],
+        gemini_api_key=data.get("gemini_api_key"),
+        maps_api_key=data.get("maps_api_key"),
+    )
+    session_state.status = data.get("status", "Idle")
+    session_state.current_route = data.get("current_route")
+    session_state.current_step = data.get("current_step")
+    session_state.current_loc = data.get("current_loc")
+    session_state.new_destination = data.get("new_destination")
+    session_state.route_destination = data.get("route_destination")
+    session_state.route_mode = data.get("route_mode", "WALK")
+    session_state.prefers_zh = data.get("prefers_zh", True)
+    session_state.dump_map_image = data.get("dump_map_image", session_state.dump_map_image)
+    if session_state.current_route:
+        session_state.compiled_route = deviation.CompiledRoute(session_state.current_route)
+        tracker = deviation.RouteProgressTracker(session_state.compiled_route)
+        saved = data.get("tracker")
+        if saved:
+            tracker.last_segment = saved["last_segment"]
+            tracker.last_position = saved["last_position"]
+            tracker.distance_along_route = saved["distance_along_route"]
+        session_state.progress_tracker = tracker
+
+    manager = session_state.chat_manager
+    if manager:
+        # Records written before the mode was stored: navigating sessions have the navigation chat
+        mode = data.get("chat_mode") or ("navigation" if session_state.status == "Navigating" else "idle")
+        contents = [genai_types.Content.model_validate(c) for c in data.get("history", [])]
+        session_state.chat = manager.restore_chat(mode, session_state.current_route, contents)
+    return session_state
+
+
+class SessionStore(abc.ABC):
+    """Stores sessions as JSON records with a version number."""
+
+    # True while the watch() callbacks hear of every save, by any replica
+    watching = False
+
+    def watch(self, on_save: Callable[[str, int], None], on_gap: Callable[[], None]) -> None:
+        """
+        Has on_save(session_id, version) called for every save, where the backend
+        can report them. on_gap() is called when saves may have gone unreported.
+        """
+
+    @abc.abstractmethod
+    async def load(self, session_id: str) -> Optional[Tuple[int, Dict]]:
+        ...
+
+    @abc.abstractmethod
+    async def version(self, session_id: str) -> Optional[int]:
+        ...
+
+    @abc.abstractmethod
+    async def save(self, session_id: str, data: Dict) -> int:
+        """Writes the record and returns its new version."""
+
+    @abc.abstractmethod
+    async def delete(self, session_id: str) -> None:
+        ...
+
+    async def close(self) -> None:
+        pass
+
+
+class MemoryStore(SessionStore):
+    """In-process store. Records still go through JSON so tests exercise the real round-trip."""
+
+    watching = True
+
+    def __init__(self, ttl_seconds: float = SESSION_STORE_TTL):
+        self.ttl_seconds = ttl_seconds
+        self._records: Dict[str, Tuple[int, str, float]] = {}
+        self._watchers: List[Callable[[str, int], None]] = []
+
+    def watch(self, on_save, on_gap):
+        self._watchers.append(on_save)
+
+    def _live(self, session_id: str) -> Optional[Tuple[int, str, float]]:
+        record = self._records.get(session_id)
+        if record and record[2] < time.time():
+            del self._records[session_id]
+            return None
+        return record
+
+    async def load(self, session_id):
+        record = self._live(session_id)
+        return (record[0], json.loads(record[1])) if record else None
+
+    async def version(self, session_id):
+        record = self._live(session_id)
+        return record[0] if record else None
+
+    async def save(self, session_id, data):
+        record = self._live(session_id)
+        version = (record[0] if record else 0) + 1
+        self._records[session_id] = (version, json.dumps(data), time.time() + self.ttl_seconds)
+        for on_save in self._watchers:
+            on_save(session_id, version)
+        return version
+
+    async def delete(self, session_id):
+        self._records.pop(session_id, None)
+
+
+class SqliteStore(SessionStore):
+    """
+    One sqlite file shared by the replicas on a host (WAL mode, one connection
+    per thread). Saves are not reported, every lookup reads the version.
+    """
+
+    def __init__(self, path: str, ttl_seconds: float = SESSION_STORE_TTL):
+        self.path = path
+        self.ttl_seconds = ttl_seconds
+        self._local = threading.local()
+        self._conn().execute(
+            "CREATE TABLE IF NOT EXISTS sessions (id TEXT PRIMARY KEY, version INTEGER NOT NULL, "
+            "data TEXT NOT NULL, expires REAL NOT NULL)")
+
+    def _conn(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            self._local.conn = conn
+        return conn
+
+    def _load(self, session_id):
+        row = self._conn().execute("SELECT version, data FROM sessions WHERE id = ? AND expires > ?",
+                                   (session_id, time.time())).fetchone()
+        return (row[0], json.loads(row[1])) if row else None
+
+    def _version(self, session_id):
+        row = self._conn().execute("SELECT version FROM sessions WHERE id = ? AND expires > ?",
+                                   (session_id, time.time())).fetchone()
+        return row[0] if row else None
+
+    def _save(self, session_id, data):
+        conn = self._conn()
+        payload, expires = json.dumps(data), time.time() + self.ttl_seconds
+        conn.execute("BEGIN IMMEDIATE")  # take the write lock before reading the version
+        try:
+            row = conn.execute("SELECT version FROM sessions WHERE id = ? AND expires > ?",
+                               (session_id, time.time())).fetchone()
+            version = (row[0] if row else 0) + 1
+            conn.execute("INSERT OR REPLACE INTO sessions (id, version, data, expires) VALUES (?, ?, ?, ?)",
+                         (session_id, version, payload, expires))
+            conn.execute("COMMIT")
+        except BaseException:
+            conn.execute("ROLLBACK")
+            raise
+        return version
+
+    def _delete(self, session_id):
+        self._conn().execute("DELETE FROM sessions WHERE id = ?", (session_id,))
+
+    async def load(self, session_id):
+        return await asyncio.to_thread(self._load, session_id)
+
+    async def version(self, session_id):
+        return await asyncio.to_thread(self._version, session_id)
+
+    async def save(self, session_id, data):
+        return await asyncio.to_thread(self._save, session_id, data)
+
+    async def delete(self, session_id):
+        await asyncio.to_thread(self._delete, session_id)
+
+
+class RedisStore(SessionStore):
+    """
+    Works with any Redis-protocol server (Redis, Valkey, KeyDB, ...). Saves are
+    announced on the <prefix>saved pub/sub channel once a replica watches.
+    """
+
+    def __init__(self, url: str, ttl_seconds: float = SESSION_STORE_TTL, prefix: str = "session:"):
+        try:
+            import redis.asyncio as redis_asyncio
+        except ImportError as e:
+            raise RuntimeError("SESSION_STORE=redis://... needs the 'redis' package") from e
+        self.redis = redis_asyncio.from_url(url)
+        self.ttl = int(ttl_seconds)
+        self.prefix = prefix
+        self.channel = prefix + "saved"
+        self.watching = False
+        self._watchers: List[Tuple[Callable[[str, int], None], Callable[[], None]]] = []
+        self._listener: Optional[asyncio.Task] = None
+
+    def watch(self, on_save, on_gap):
+        self._watchers.append((on_save, on_gap))
+
+    def _listen_soon(self) -> None:
+        # Started from the first call on the event loop; the store is created at import
+        if self._watchers and self._listener is None:
+            self._listener = asyncio.get_running_loop().create_task(self._listen())
+
+    async def _listen(self) -> None:
+        pubsub = self.redis.pubsub()
+        try:
+            await pubsub.subscribe(self.channel)
+            async for message in pubsub.listen():
+                if message["type"] == "subscribe":
+                    # (Re)subscribed: whatever was published while not listening is lost
+                    for _, on_gap in self._watchers:
+                        on_gap()
+                    self.watching = True
+                elif message["type"] == "message":
+                    data = message["data"]
+                    version, session_id = (data.decode() if isinstance(data, bytes) else data).split(" ", 1)
+                    for on_save, _ in self._watchers:
+                        on_save(session_id, int(version))
+        except asyncio.CancelledError:
+            raise
+        except Exception as e:
+            logging.error(f"Session save notifications stopped: {e}")
+        finally:
+            self.watching = False
+            for _, on_gap in self._watchers:
+                on_gap()
+            await pubsub.aclose()
+
+    def _keys(self, session_id: str) -> Tuple[str, str]:
+        key = self.prefix + session_id
+        return key + ":data", key + ":version"
+
+    async def load(self, session_id):
+        self._listen_soon()
+        data_key, version_key = self._keys(session_id)
+        data, version = await self.redis.mget(data_key, version_key)
+        return (int(version), json.loads(data)) if data and version else None
+
+    async def version(self, session_id):
+        self._listen_soon()
+        version = await self.redis.get(self._keys(session_id)[1])
+        return int(version) if version else None
+
+    async def save(self, session_id, data):
+        self._listen_soon()
+        data_key, version_key = self._keys(session_id)
+        async with self.redis.pipeline(transaction=True) as pipe:
+            pipe.set(data_key, json.dumps(data), ex=self.ttl)
+            pipe.incr(version_key)
+            pipe.expire(version_key, self.ttl)
+            _, version, _ = await pipe.execute()
+        await self.redis.publish(self.channel, f"{version} {session_id}")
+        return int(version)
+
+    async def delete(self, session_id):
+        await self.redis.delete(*self._keys(session_id))
+
+    async def close(self):
+        if self._listener is not None:
+            self._listener.cancel()
+            try:
+                await self._listener
+            except asyncio.CancelledError:
+                pass
+        await self.redis.aclose()
+
+
+def open_store(spec: str = SESSION_STORE) -> Optional[SessionStore]:
+    if not spec:
+        return None
+    if spec.startswith("memory://"):
+        return MemoryStore()
+    if spec.startswith("sqlite:///"):
+        return SqliteStore(spec[len("sqlite:///"):])
+    if spec.startswith(("redis://", "rediss://", "unix://")):
+        return RedisStore(spec)
+    raise ValueError(f"Unsupported SESSION_STORE {spec!r}")
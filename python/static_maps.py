@@ -0,0 +1,85 @@
+import io
+import os
+import math
+import hashlib
+from typing import Optional, Tuple
+
+from PIL import Image, ImageDraw
+
+import geo_cache
+
+# Static Maps tiles for the per-turn map overview. Map centers are snapped to a
+# coarse grid of zoom-17 pixels so a user standing still (or GPS jitter) keeps
+# hitting the same cached image. Tiles are fetched and cached without a marker;
+# the user marker is drawn onto each copy at the user's real position.
+
+STATIC_MAP_ZOOM = 17
+STATIC_MAP_SIZE = os.getenv("STATIC_MAP_SIZE", "600x600")
+# 16 px at zoom 17 is ~17 m at the equator and less further north
+STATIC_MAP_SNAP_PIXELS = int(os.getenv("STATIC_MAP_SNAP_PIXELS", "16"))
+STATIC_MAP_PREFETCH_TILES = int(os.getenv("STATIC_MAP_PREFETCH_TILES", "3"))
+STATIC_MAP_PREFETCH_SPACING_METERS = float(os.getenv("STATIC_MAP_PREFETCH_SPACING_METERS", "40"))
+STATIC_MAP_MARKER_RADIUS = int(os.getenv("STATIC_MAP_MARKER_RADIUS", "7"))
+STATIC_MAP_JPEG_QUALITY = int(os.getenv("STATIC_MAP_JPEG_QUALITY", "85"))
+# Default of SessionState.dump_map_image (write map_image_<session>.jpg), for debugging only
+STATIC_MAP_DEBUG_DUMP = os.getenv("STATIC_MAP_DEBUG_DUMP", "0") == "1"
+
+tile_cache = geo_cache.TTLCache(
+    "static_map",
+    ttl_seconds=float(os.getenv("STATIC_MAP_CACHE_TTL", "3600")),
+    max_entries=int(os.getenv("STATIC_MAP_CACHE_MAX_ENTRIES", "512")),
+    max_bytes=int(os.getenv("STATIC_MAP_CACHE_MAX_BYTES", str(64 * 1024 * 1024))),
+    persistent=False,
+    sizeof=len,
+)
+
+
+def _world_size(zoom: int) -> float:
+    return 256.0 * (2 ** zoom)
+
+
+def _world_pixel(lat: float, lng: float, zoom: int) -> Tuple[float, float]:
+    world = _world_size(zoom)
+    siny = min(max(math.sin(math.radians(lat)), -0.9999), 0.9999)
+    x = (lng + 180.0) / 360.0 * world
+    y = (0.5 - math.log((1 + siny) / (1 - siny)) / (4 * math.pi)) * world
+    return x, y
+
+
+def snap_center(lat: float, lng: float, zoom: int = STATIC_MAP_ZOOM,
+                snap_pixels: int = STATIC_MAP_SNAP_PIXELS) -> Tuple[float, float, Tuple[int, int]]:
+    """
+    Snaps a coordinate to the Web Mercator pixel grid of `zoom`, in cells of
+    `snap_pixels`. Returns the snapped (lat, lng) and its integer grid cell.
+    """
+    world = _world_size(zoom)
+    x, y = _world_pixel(lat, lng, zoom)
+    cell = (int(round(x / snap_pixels)), int(round(y / snap_pixels)))
+    sx, sy = cell[0] * snap_pixels, cell[1] * snap_pixels
+    snapped_lng = sx / world * 360.0 - 180.0
+    snapped_lat = math.degrees(math.atan(math.sinh(math.pi * (1 - 2 * sy / world))))
+    return round(snapped_lat, 6), round(snapped_lng, 6), cell
+
+
+def tile_key(cell: Tuple[int, int], encoded_polyline: Optional[str], size: str = STATIC_MAP_SIZE,
+             zoom: int = STATIC_MAP_ZOOM) -> str:
+    path_hash = hashlib.sha1(encoded_polyline.encode()).hexdigest()[:16] if encoded_polyline else "-"
+    return f"z{zoom}|{cell[0]}:{cell[1]}|{path_hash}|{size}"
+
+
+def draw_user_marker(tile: bytes, lat: float, lng: float, center_lat: float, center_lng: float,
+                     zoom: int = STATIC_MAP_ZOOM) -> bytes:
+    """`tile` (centered on center_lat, center_lng) with a red dot at (lat, lng)."""
+    image = Image.open(io.BytesIO(tile)).convert("RGB")
+    x, y = _world_pixel(lat, lng, zoom)
+    cx, cy = _world_pixel(center_lat, center_lng, zoom)
+    px, py = image.width / 2 + x - cx, image.height / 2 + y - cy
+    r = STATIC_MAP_MARKER_RADIUS
+    ImageDraw.Draw(image).ellipse((px - r, py - r, px + r, py + r), fill=(220, 0, 0), outline=(255, 255, 255), width=2)
+    out = io.BytesIO()
+    image.save(out, format="JPEG", quality=STATIC_MAP_JPEG_QUALITY)
+    return out.getvalue()
+
+
+def stats():
+    return tile_cache.snapshot()
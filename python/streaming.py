@@ -0,0 +1,124 @@
+import os
+import re
+import time
+import asyncio
+from collections import deque
+from typing import AsyncIterator, Dict, List, Optional
+
+# Incremental answers for ChatStream. While a turn runs, the model's text is cut
+# into sentence-sized chunks that are sent to the client as soon as each one is
+# complete, so text-to-speech can start on the first sentence instead of the
+# whole answer. When the model calls tools and hasn't said anything yet, a
+# short acknowledgement goes out so the user isn't left in silence during the
+# next round-trip. The last message of a turn has is_final set.
+#
+# Off by default: app builds that predate is_final speak every response they
+# get, partial ones included. Enable it once the deployed client handles is_final.
+#
+# Time to first spoken word (request received -> first non-empty text sent) is
+# recorded per turn; stats() reports its percentiles.
+
+STREAM_RESPONSES = os.getenv("STREAM_RESPONSES", "off") == "on"
+STREAM_MIN_CHUNK_CHARS = int(os.getenv("STREAM_MIN_CHUNK_CHARS", "24"))
+STREAM_ACK_TEXT = os.getenv("STREAM_ACK_TEXT", "One moment, please.")
+FIRST_WORD_SAMPLES = 1000
+
+# End of a sentence: latin punctuation followed by whitespace, or CJK punctuation
+_SENTENCE_END = re.compile(r"[.!?;:](?=\s)|[。！？；]|\n")
+
+_stats = {"turns": 0, "streamed_turns": 0, "partial_chunks": 0, "acks": 0}
+_first_word_ms: deque = deque(maxlen=FIRST_WORD_SAMPLES)
+
+
+class SentenceChunker:
+    """Buffers streamed text and hands out complete sentences of at least min_chars."""
+
+    def __init__(self, min_chars: int = STREAM_MIN_CHUNK_CHARS):
+        self.min_chars = min_chars
+        self.text = ""  # everything fed so far
+        self.consumed = 0  # how much of it has been handed out
+
+    def feed(self, text: str) -> List[str]:
+        self.text += text
+        chunks = []
+        for match in _SENTENCE_END.finditer(self.text, self.consumed):
+            end = match.end()
+            if len(self.text[self.consumed:end].strip()) >= self.min_chars:
+                chunks.append(self.text[self.consumed:end].strip())
+                self.consumed = end
+        return chunks
+
+    def flush(self) -> str:
+        rest, self.consumed = self.text[self.consumed:].strip(), len(self.text)
+        return rest
+
+
+class TurnStream:
+    """Carries one turn's partial answers from the navigator to the gRPC handler."""
+
+    def __init__(self, started: Optional[float] = None):
+        self.started = started if started is not None else time.perf_counter()
+        self._queue: "asyncio.Queue[Optional[str]]" = asyncio.Queue()
+        self._chunker = SentenceChunker()
+        self.spoken = False  # anything (answer or acknowledgement) sent this turn
+
+    def start_response(self) -> None:
+        """A new model response begins; sentences are cut from its text only."""
+        self._chunker = SentenceChunker()
+
+    def _emit(self, text: str) -> None:
+        self.spoken = True
+        self._queue.put_nowait(text)
+
+    def feed(self, text: str) -> None:
+        for chunk in self._chunker.feed(text):
+            self._emit(chunk)
+
+    def tool_calls_started(self) -> None:
+        """The current response ended in tool calls: say what's buffered, or acknowledge."""
+        rest = self._chunker.flush()
+        if rest:
+            self._emit(rest)
+        elif not self.spoken:
+            _stats["acks"] += 1
+            self._emit(STREAM_ACK_TEXT)
+        self.start_response()
+
+    def unsent(self, final_text: str) -> str:
+        """The part of the turn's answer the client hasn't received yet."""
+        sent = self._chunker.text[:self._chunker.consumed]
+        if final_text.startswith(sent):
+            return final_text[len(sent):].strip()
+        return final_text  # replaced after streaming (an error message, say)
+
+    def close(self) -> None:
+        self._queue.put_nowait(None)
+
+    async def chunks(self) -> AsyncIterator[str]:
+        while True:
+            chunk = await self._queue.get()
+            if chunk is None:
+                return
+            yield chunk
+
+
+def record_turn(first_word_seconds: Optional[float], partial_chunks: int) -> None:
+    _stats["turns"] += 1
+    _stats["partial_chunks"] += partial_chunks
+    if partial_chunks:
+        _stats["streamed_turns"] += 1
+    if first_word_seconds is not None:
+        _first_word_ms.append(first_word_seconds * 1000)
+
+
+def _percentile(samples: List[float], q: float) -> float:
+    return round(samples[min(len(samples) - 1, int(q * len(samples)))], 1)
+
+
+def stats() -> Dict[str, float]:
+    samples = sorted(_first_word_ms)
+    result = dict(_stats)
+    if samples:
+        result.update(first_word_ms_p50=_percentile(samples, 0.5), first_word_ms_p95=_percentile(samples, 0.95),
+                      first_word_ms_max=round(samples[-1], 1))
+    return result
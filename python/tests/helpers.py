@@ -0,0 +1,43 @@
+"""Synthetic routes and walks shared by the tests, laid out in meters around START."""
+import math
+
+import polyline
+
+METERS_PER_DEGREE = 111320.0
+START = (24.9924, 121.4990)
+
+
+def point(north, east):
+    return (START[0] + north / METERS_PER_DEGREE,
+            START[1] + east / (METERS_PER_DEGREE * math.cos(math.radians(START[0]))))
+
+
+def step(path, instruction):
+    return {"polyline": {"encodedPolyline": polyline.encode(path)}, "staticDuration": "150s",
+            "navigationInstruction": {"maneuver": "TURN_LEFT", "instructions": instruction}}
+
+
+def out_and_back_route(leg_meters=200, gap_meters=8):
+    """leg_meters east, then back west along the other sidewalk gap_meters to the north."""
+    out = [point(0, 0), point(0, leg_meters)]
+    back = [point(0, leg_meters), point(gap_meters, leg_meters), point(gap_meters, 0)]
+    return {"distanceMeters": 2 * leg_meters + gap_meters,
+            "legs": [{"steps": [step(out, "Walk east"), step(back, "Walk back west")]}]}
+
+
+def walk(compiled, rng, noise=4.0, speed=1.3):
+    """(true distance along the route, noisy fix) once per second."""
+    along = 0.0
+    while along <= compiled.total_length:
+        lat, lng = compiled.segments.point_at_distance(along)
+        yield along, (lat + rng.gauss(0, noise) / METERS_PER_DEGREE,
+                      lng + rng.gauss(0, noise) / (METERS_PER_DEGREE * math.cos(math.radians(lat))))
+        along += speed
+
+
+def two_leg_route(leg_meters=100):
+    """leg_meters east to a waypoint, then leg_meters north; one step per leg."""
+    east = [point(0, 0), point(0, leg_meters)]
+    north = [point(0, leg_meters), point(leg_meters, leg_meters)]
+    return {"distanceMeters": 2 * leg_meters,
+            "legs": [{"steps": [step(east, "Walk east")]}, {"steps": [step(north, "Walk north")]}]}
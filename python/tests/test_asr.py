@@ -0,0 +1,74 @@
+import numpy as np
+import pytest
+
+import asr
+
+RATE = 16000
+FRAME_BYTES = RATE * asr.ASR_FRAME_MS // 1000 * 2
+
+
+def _audio(*parts):
+    """16-bit PCM from (milliseconds, speech?) parts: a loud tone or faint noise."""
+    rng = np.random.default_rng(0)
+    chunks = []
+    for ms, speech in parts:
+        n = RATE * ms // 1000
+        if speech:
+            chunks.append(3000 * np.sin(2 * np.pi * 440 * np.arange(n) / RATE))
+        else:
+            chunks.append(rng.normal(0, 15, n))
+    return np.concatenate(chunks).astype("<i2").tobytes()
+
+
+def _endpointer(**kwargs):
+    settings = dict(sample_rate=RATE, threshold=300, silence_ms=600, min_speech_ms=200,
+                    max_utterance_ms=15000, pre_roll_ms=210)
+    return asr.Endpointer(**{**settings, **kwargs})
+
+
+def test_to_pcm_reads_wav_and_passes_raw_pcm_through():
+    pcm = b"\x00\x01" * 100
+    assert asr.to_pcm(asr.to_wav(pcm, 8000)) == (pcm, 8000)
+    assert asr.to_pcm(pcm, 22050) == (pcm, 22050)
+
+
+@pytest.mark.parametrize("audio", [asr.to_wav(b"\x00\x01" * 100, 16000)[:30],
+                                   b"RIFF\x00\x00\x00\x00WAVEjunk"])
+def test_malformed_wav_is_unintelligible(audio):
+    with pytest.raises(asr.UnintelligibleAudio):
+        asr.to_pcm(audio)
+
+
+def test_utterance_is_cut_after_the_endpoint_silence():
+    endpointer = _endpointer()
+    utterances = endpointer.feed(_audio((600, False), (900, True), (900, False)))
+    # 7 frames of pre-roll, the speech, and 7 frames of the silence that ended it
+    assert [len(u) for u in utterances] == [(7 + 30 + 7) * FRAME_BYTES]
+    assert endpointer.flush() is None
+
+
+def test_cut_points_do_not_depend_on_chunking():
+    audio = _audio((300, False), (600, True), (900, False), (450, True), (900, False))
+    whole = _endpointer().feed(audio)
+    chunked, endpointer = [], _endpointer()
+    for offset in range(0, len(audio), 1234):  # not a multiple of the frame size
+        chunked.extend(endpointer.feed(audio[offset:offset + 1234]))
+    assert len(whole) == 2 and chunked == whole
+
+
+def test_short_bump_is_not_an_utterance():
+    endpointer = _endpointer()
+    assert endpointer.feed(_audio((300, False), (90, True), (900, False))) == []
+
+
+def test_long_speech_is_cut_at_the_maximum_length():
+    endpointer = _endpointer(max_utterance_ms=1500)
+    utterances = endpointer.feed(_audio((300, False), (2400, True)))
+    assert [len(u) for u in utterances] == [50 * FRAME_BYTES]
+
+
+def test_flush_returns_the_speech_still_buffered():
+    endpointer = _endpointer()
+    assert endpointer.feed(_audio((300, False), (600, True), (150, False))) == []
+    assert len(endpointer.flush()) == (7 + 20 + 5) * FRAME_BYTES
+    assert endpointer.flush() is None
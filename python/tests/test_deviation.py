@@ -0,0 +1,103 @@
+import random
+
+import numpy as np
+from shapely.geometry import LineString, Point
+
+import deviation
+from helpers import out_and_back_route, point, walk
+
+
+def test_tracker_stays_on_outbound_leg_of_out_and_back_route():
+    compiled = deviation.CompiledRoute(out_and_back_route())
+    turnaround = float(compiled.step_end_offset[0])
+    for seed in range(200):
+        tracker = deviation.RouteProgressTracker(compiled)
+        for true_along, (lat, lng) in walk(compiled, random.Random(seed)):
+            progress = tracker.update(lat, lng)
+            assert progress is not None
+            if true_along < turnaround - 20:
+                assert progress["step_index"] == 0, (seed, true_along)
+            assert abs(progress["distance_along_route_meters"] - true_along) < 25, (seed, true_along)
+        assert progress["step_index"] == 1
+        assert progress["is_last_step"]
+
+
+def test_tracker_takes_return_leg_once_walked():
+    compiled = deviation.CompiledRoute(out_and_back_route())
+    tracker = deviation.RouteProgressTracker(compiled)
+    for true_along, (lat, lng) in walk(compiled, random.Random(1), noise=0.0):
+        progress = tracker.update(lat, lng)
+        # within tie_meters of the turn either step is a fair answer
+        if abs(true_along - compiled.step_end_offset[0]) > tracker.tie_meters + 1:
+            expected_step = 0 if true_along < compiled.step_end_offset[0] else 1
+            assert progress["step_index"] == expected_step, true_along
+    assert progress["remaining_distance_meters"] < 5
+
+
+def test_tracker_never_moves_backwards():
+    compiled = deviation.CompiledRoute(out_and_back_route())
+    tracker = deviation.RouteProgressTracker(compiled)
+    for _, (_, (lat, lng)) in zip(range(100), walk(compiled, random.Random(2))):
+        tracker.update(lat, lng)
+    along, position = tracker.distance_along_route, tracker.last_position
+    tracker.update(*point(0, 0))  # a fix back at the start
+    assert tracker.distance_along_route >= along
+    assert tracker.last_position >= position
+
+
+def _shapely_distance(user_lat, user_lon, path):
+    # shortest_distance_to_route before the local metric frame: projection in lon/lat degrees
+    line = LineString([(lon, lat) for lat, lon in path])
+    closest = line.interpolate(line.project(Point(user_lon, user_lat)))
+    return deviation.haversine_distance(user_lat, user_lon, closest.y, closest.x)
+
+
+def _sampled_distance(user_lat, user_lon, path, samples=2000):
+    # ground truth: haversine to densely sampled points of every segment
+    a, b = np.array(path[:-1])[:, None, :], np.array(path[1:])[:, None, :]
+    lat, lon = np.radians(a + (b - a) * np.linspace(0.0, 1.0, samples)[:, None]).reshape(-1, 2).T
+    user_lat, user_lon = np.radians(user_lat), np.radians(user_lon)
+    h = np.sin((lat - user_lat) / 2) ** 2 + np.cos(lat) * np.cos(user_lat) * np.sin((lon - user_lon) / 2) ** 2
+    return float(2 * deviation.EARTH_RADIUS_METERS * np.arcsin(np.sqrt(h)).min())
+
+
+def _zigzag(rng, legs=12):
+    north, east, path = 0.0, 0.0, [point(0, 0)]
+    for _ in range(legs):
+        north, east = north + rng.uniform(-80, 80), east + rng.uniform(10, 80)
+        path.append(point(north, east))
+    return path, north, east
+
+
+def test_projection_matches_the_old_results_on_axis_aligned_segments():
+    # there the closest point in degrees is the closest point in meters too
+    rng = random.Random(3)
+    for path in ([point(0, 0), point(0, 300)], [point(0, 0), point(300, 0)]):
+        for _ in range(100):
+            lat, lng = point(rng.uniform(-100, 400), rng.uniform(-100, 400))
+            old = _shapely_distance(lat, lng, path)
+            assert abs(deviation.shortest_distance_to_route(lat, lng, path) - old) <= max(0.05, 0.002 * old)
+
+
+def test_projection_is_exact_where_the_old_results_were_not():
+    rng = random.Random(4)
+    for _ in range(10):
+        path, north, east = _zigzag(rng)
+        for _ in range(10):
+            lat, lng = point(rng.uniform(min(0, north) - 60, max(0, north) + 60), rng.uniform(0, east))
+            new = deviation.shortest_distance_to_route(lat, lng, path)
+            # the old foot point was off the true closest point, never closer than it
+            assert new <= _shapely_distance(lat, lng, path) + 0.05
+            assert abs(new - _sampled_distance(lat, lng, path)) < 0.5
+
+
+def test_project_many_agrees_with_project():
+    rng = random.Random(5)
+    path, north, east = _zigzag(rng, legs=30)
+    segments = deviation.RouteSegments.from_path(path)
+    fixes = [point(rng.uniform(-100, north + 100), rng.uniform(-50, east + 50)) for _ in range(300)]
+    segments.BATCH_CELLS = 7 * len(segments)  # several blocks
+    distances, indices, fractions = segments.project_many(*zip(*fixes))
+    for (lat, lng), d, i, f in zip(fixes, distances, indices, fractions):
+        match = segments.project(lat, lng)
+        assert (match.segment_index, match.distance_meters, match.fraction) == (i, d, f)
@@ -0,0 +1,128 @@
+import asyncio
+
+import pytest
+
+import geo_cache
+
+
+def _cache():
+    return geo_cache.TTLCache("test", ttl_seconds=60, persistent=False)
+
+
+class _Upstream:
+    """A fetch that blocks until released and counts its calls."""
+
+    def __init__(self, value=None, error=None):
+        self.value = value if value is not None else {"results": [{"name": "Banqiao Station"}]}
+        self.error = error
+        self.calls = 0
+        self.cancelled = 0
+        self.release = asyncio.Event()
+
+    async def __call__(self):
+        self.calls += 1
+        try:
+            await self.release.wait()
+        except asyncio.CancelledError:
+            self.cancelled += 1
+            raise
+        if self.error:
+            raise self.error
+        return self.value
+
+
+def test_concurrent_misses_share_one_fetch():
+    async def main():
+        cache, upstream = _cache(), _Upstream()
+        callers = [asyncio.create_task(cache.get_or_fetch("k", upstream)) for _ in range(5)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        results = await asyncio.gather(*callers)
+        assert upstream.calls == 1
+        assert all(r == upstream.value for r in results)
+        assert cache.stats["coalesced"] == 4
+        assert await cache.get_or_fetch("k", upstream) == upstream.value
+        assert upstream.calls == 1
+
+    asyncio.run(main())
+
+
+def test_cancelled_leader_does_not_cancel_waiters():
+    async def main():
+        cache, upstream = _cache(), _Upstream()
+        leader = asyncio.create_task(cache.get_or_fetch("k", upstream))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.get_or_fetch("k", upstream))
+        await asyncio.sleep(0)
+        leader.cancel()
+        await asyncio.sleep(0)
+        upstream.release.set()
+        assert await waiter == upstream.value
+        assert leader.cancelled()
+        assert upstream.calls == 1 and upstream.cancelled == 0
+
+    asyncio.run(main())
+
+
+def test_fetch_cancelled_once_nobody_waits_and_next_call_refetches():
+    async def main():
+        cache, upstream = _cache(), _Upstream()
+        callers = [asyncio.create_task(cache.get_or_fetch("k", upstream)) for _ in range(2)]
+        await asyncio.sleep(0)
+        for caller in callers:
+            caller.cancel()
+        await asyncio.gather(*callers, return_exceptions=True)
+        await asyncio.sleep(0)
+        assert upstream.cancelled == 1
+
+        again = asyncio.create_task(cache.get_or_fetch("k", upstream))
+        await asyncio.sleep(0)
+        upstream.release.set()
+        assert await again == upstream.value
+        assert upstream.calls == 2
+
+    asyncio.run(main())
+
+
+def test_fetch_error_reaches_every_waiter_and_is_not_cached():
+    async def main():
+        cache, upstream = _cache(), _Upstream(error=RuntimeError("quota"))
+        callers = [asyncio.create_task(cache.get_or_fetch("k", upstream)) for _ in range(3)]
+        await asyncio.sleep(0)
+        upstream.release.set()
+        results = await asyncio.gather(*callers, return_exceptions=True)
+        assert all(isinstance(r, RuntimeError) for r in results)
+        assert len(cache) == 0
+
+    asyncio.run(main())
+
+
+def test_callers_get_copies():
+    async def main():
+        cache, upstream = _cache(), _Upstream()
+        upstream.release.set()
+        first = await cache.get_or_fetch("k", upstream)
+        first["results"].append({"name": "mutated"})
+        second = await cache.get_or_fetch("k", upstream)
+        assert second == {"results": [{"name": "Banqiao Station"}]}
+        second["results"].clear()
+        assert cache.get("k")["results"]
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("waiters", [1, 3])
+def test_single_flight_result_shared(waiters):
+    async def main():
+        flights, calls = geo_cache.SingleFlight(), []
+
+        async def run():
+            calls.append(1)
+            await asyncio.sleep(0.01)
+            return len(calls)
+
+        results = await asyncio.gather(*(flights.do("key", run) for _ in range(waiters)))
+        assert results == [1] * waiters
+        assert "key" not in flights
+
+    asyncio.run(main())
@@ -0,0 +1,21 @@
+import random
+
+import deviation
+import guidance
+from helpers import two_leg_route, walk
+
+
+def test_progress_answer_numbers_steps_across_legs():
+    compiled = deviation.CompiledRoute(two_leg_route())
+    tracker = deviation.RouteProgressTracker(compiled)
+    for along, (lat, lng) in walk(compiled, random.Random(0), noise=0.0):
+        progress = tracker.update(lat, lng)
+        if along > 150:
+            break
+    assert (progress["leg_index"], progress["step_index"]) == (1, 0)
+    assert tracker.step_of_route() == (2, 2)
+
+    answer = guidance.fast_path_response("where am I", progress, tracker.step_of_route())
+    assert answer.startswith("You are on step 2 of 2: ")
+    answer = guidance.fast_path_response("我在哪裡", progress, tracker.step_of_route())
+    assert answer.startswith("您在第 2 步，共 2 步")
@@ -0,0 +1,98 @@
+import random
+
+from google.genai import types as genai_types
+
+import history
+import navigator
+from helpers import out_and_back_route, two_leg_route, walk
+
+
+def _session(route):
+    state = navigator.SessionState("walker", maps_api_key="maps-key")
+    state.status = "Navigating"
+    navigator.install_route(state, route)
+    return state
+
+
+def _turn(asked, answered, image=None, call=None):
+    user = [genai_types.Part(text=asked)]
+    if image:
+        user.append(genai_types.Part(inline_data=genai_types.Blob(mime_type="image/jpeg", data=image)))
+    turn = [genai_types.Content(role="user", parts=user)]
+    if call:
+        name, args = call
+        turn += [genai_types.Content(role="model", parts=[genai_types.Part(
+                     function_call=genai_types.FunctionCall(name=name, args=args))]),
+                 genai_types.Content(role="user", parts=[genai_types.Part(
+                     function_response=genai_types.FunctionResponse(name=name, response={"ok": True}))])]
+    return turn + [genai_types.Content(role="model", parts=[genai_types.Part(text=answered)])]
+
+
+def _chat_session(turns):
+    state = _session(out_and_back_route())
+    chat = state.chat_manager.create_navigation_chat_for_session(state.current_route)
+    state.chat = state.chat_manager.recreate_chat(chat.get_history() + [c for t in turns for c in t])
+    return state
+
+
+def _turns(state):
+    return [t for t in history.split_turns(state.chat.get_history()) if not navigator.is_route_preamble(t[0])]
+
+
+def test_digest_numbers_steps_across_legs():
+    state = _session(two_leg_route())
+    for along, (lat, lng) in walk(state.compiled_route, random.Random(0), noise=0.0):
+        navigator.set_current_location(state, {"lat": lat, "lng": lng})
+        navigator.update_route_progress(state)
+        if along > 150:
+            break
+    assert state.progress_tracker.last_progress["step_index"] == 0  # first step of the second leg
+    assert history.build_digest(state, []).splitlines()[1].startswith("Status: navigating; on step 2 of 2, about ")
+
+
+def test_blobs_are_stripped_from_all_but_the_last_turn():
+    state = _chat_session([_turn("What is this?", "A bench.", image=b"\xff\xd8one"),
+                           _turn("And this?", "A tree.", image=b"\xff\xd8two")])
+    assert history.compact_history(state)
+    first, last = _turns(state)
+    assert [p.text for p in first[0].parts] == ["What is this?", "[image omitted]"]
+    assert last[0].parts[1].inline_data.data == b"\xff\xd8two"
+    assert not history.compact_history(state)  # nothing left to strip
+
+
+def test_long_history_is_folded_into_a_digest():
+    kept = history.HISTORY_KEEP_TURNS
+    turns = [_turn("Take me to the station", "Route ready.", call=("compute_route", {"destination": "Main Station"}))]
+    turns += [_turn(f"question {i}", f"answer {i}") for i in range(kept + history.HISTORY_COMPACT_SLACK)]
+    state = _chat_session(turns)
+    before = history.stats["turns_compacted"]
+
+    assert history.compact_history(state)
+    digest, *recent = _turns(state)
+    assert [t[0].parts[0].text for t in recent] == [t[0].parts[0].text for t in turns[-kept:]]
+    assert history.stats["turns_compacted"] - before == len(turns) - kept
+    lines = digest[0].parts[0].text.splitlines()
+    assert lines[0] == history.DIGEST_HEADER
+    assert "Destination: Main Station" in lines
+    assert "Tools used: compute_route" in lines
+    assert lines[-1] == f'- User: "question {len(turns) - kept - 2}" -> Assistant: "answer {len(turns) - kept - 2}"'
+    assert navigator.is_route_preamble(state.chat.get_history()[0])
+
+
+def test_next_digest_carries_the_earlier_one_forward():
+    kept = history.HISTORY_KEEP_TURNS
+    state = _chat_session([_turn("Take me to the station", "Route ready.",
+                                 call=("compute_route", {"destination": "Main Station"}))] +
+                          [_turn(f"question {i}", f"answer {i}") for i in range(kept)])
+    assert history.compact_history(state, force=True)
+    state.chat = state.chat_manager.recreate_chat(
+        state.chat.get_history() + [c for i in range(2) for c in _turn(f"later {i}", "ok")])
+    assert history.compact_history(state, force=True)
+
+    digest, *recent = _turns(state)
+    assert len(recent) == kept
+    text = digest[0].parts[0].text
+    assert text.count(history.DIGEST_HEADER) == 1
+    assert "Destination: Main Station" in text.splitlines()
+    assert '- User: "Take me to the station" -> Assistant: "Route ready."' in text
+    assert '- User: "question 1" -> Assistant: "answer 1"' in text
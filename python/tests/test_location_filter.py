@@ -0,0 +1,90 @@
+import asyncio
+import math
+
+import location_filter
+import navigator
+from helpers import METERS_PER_DEGREE, START, point
+
+
+def _ingest(state, north, east, **kwargs):
+    lat, lng = point(north, east)
+    return location_filter.ingest(state, lat, lng, 90.0, **kwargs)
+
+
+def test_trailing_coalesced_fix_is_tracked_after_the_interval():
+    async def main():
+        state, tracked = navigator.SessionState("test"), []
+        track = lambda session_state, fix: tracked.append(fix)
+        assert _ingest(state, 0, 0, track=track) is not None
+        # the client's last fixes, inside the interval: coalesced
+        assert _ingest(state, 0, 0.4, track=track) is None
+        assert _ingest(state, 0, 0.8, track=track) is None
+        assert tracked == []
+        await asyncio.sleep(location_filter.LOCATION_MIN_INTERVAL + 0.05)
+        assert tracked == [state.current_loc]  # the latest estimate, once
+        await asyncio.sleep(location_filter.LOCATION_MIN_INTERVAL)
+        assert len(tracked) == 1
+
+    asyncio.run(main())
+
+
+def test_due_fix_supersedes_the_deferred_pass():
+    async def main():
+        state, tracked = navigator.SessionState("test"), []
+        track = lambda session_state, fix: tracked.append(fix)
+        _ingest(state, 0, 0, now=0.0, track=track)
+        assert _ingest(state, 0, 0.4, now=0.1, track=track) is None
+        assert _ingest(state, 0, 2.0, now=0.6, track=track) is not None
+        await asyncio.sleep(0.5)
+        assert tracked == []
+
+    asyncio.run(main())
+
+
+def test_delayed_fixes_are_spaced_by_their_own_time():
+    state = navigator.SessionState("test")
+    # Three fixes taken a second apart, arriving together
+    results = [_ingest(state, 0, 1.3 * i, now=100.0, fix_time=float(i)) for i in range(3)]
+    assert all(r is not None for r in results)
+    # Without timestamps the same burst is coalesced
+    state = navigator.SessionState("test")
+    results = [_ingest(state, 0, 1.3 * i, now=100.0) for i in range(3)]
+    assert [r is not None for r in results] == [True, False, False]
+
+
+def test_jump_is_rejected_until_the_gps_insists():
+    state = navigator.SessionState("test")
+    for second in range(5):
+        assert _ingest(state, 0, 1.2 * second, now=float(second)) is not None
+    walked = state.current_loc
+    # a multipath spike 200 m off, then back on track
+    assert _ingest(state, 200, 6.0, now=5.0) is None
+    assert state.current_loc == walked
+    assert _ingest(state, 0, 7.2, now=6.0) is not None
+    # the same far position over and over: believed after LOCATION_MAX_REJECTS fixes
+    far = [_ingest(state, 300, 300, now=7.0 + i) for i in range(location_filter.LOCATION_MAX_REJECTS)]
+    assert far[:-1] == [None] * (location_filter.LOCATION_MAX_REJECTS - 1)
+    assert (far[-1]["lat"], far[-1]["lng"]) == tuple(round(v, 7) for v in point(300, 300))
+
+
+def test_bursts_are_coalesced_but_current_loc_stays_fresh():
+    state = navigator.SessionState("test")
+    interval = location_filter.LOCATION_MIN_INTERVAL
+    tracked = []
+    for i in range(20):
+        now = i * interval / 5
+        fix = _ingest(state, 0, 0.3 * i, now=now)
+        if fix is not None:
+            tracked.append(now)
+        else:  # absorbed, but a turn still sees where the walker is
+            east = (state.current_loc["lng"] - START[1]) * METERS_PER_DEGREE * math.cos(math.radians(START[0]))
+            assert abs(east - 0.3 * i) < 1.0
+    assert len(tracked) == 4 and all(b - a >= interval - 1e-9 for a, b in zip(tracked, tracked[1:]))
+
+
+def test_heading_is_smoothed_across_north():
+    state = navigator.SessionState("test")
+    lat, lng = point(0, 0)
+    location_filter.ingest(state, lat, lng, 350.0, now=0.0)
+    fix = location_filter.ingest(state, lat, lng, 10.0, now=1.0)
+    assert fix["heading"] == 0.0 and fix["direction"] == "north"
@@ -0,0 +1,57 @@
+import asyncio
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+import maps_client
+
+
+class _Handler(BaseHTTPRequestHandler):
+    protocol_version = "HTTP/1.1"  # keep-alive
+
+    def do_GET(self):
+        body = b'{"status": "OK"}'
+        self.send_response(200)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def maps_server(monkeypatch):
+    server = ThreadingHTTPServer(("127.0.0.1", 0), _Handler)
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    monkeypatch.setenv("NO_PROXY", "127.0.0.1,localhost")
+    monkeypatch.setattr(maps_client, "_clients", {})
+    monkeypatch.setattr(maps_client, "_stats", dict.fromkeys(maps_client._stats, 0))
+    yield server.server_address[1]
+    server.shutdown()
+    server.server_close()
+
+
+def test_requests_to_one_host_share_a_connection(maps_server):
+    async def main():
+        url = f"http://127.0.0.1:{maps_server}/maps/api/geocode/json"
+        for _ in range(5):
+            response = await maps_client.get(url, params={"address": "Taipei"})
+            assert response.json() == {"status": "OK"}
+        stats = maps_client.stats()
+        assert (stats["requests"], stats["new_connections"], stats["reused_connections"]) == (5, 1, 4)
+
+        # Another host name gets a pool of its own
+        await maps_client.get(f"http://localhost:{maps_server}/maps/api/geocode/json")
+        assert maps_client.stats()["open_hosts"] == 2 and maps_client.stats()["new_connections"] == 2
+
+        await maps_client.shutdown()
+        assert maps_client.stats()["open_hosts"] == 0
+        await maps_client.get(url)  # a fresh pool after shutdown
+        assert maps_client.stats()["new_connections"] == 3
+        await maps_client.shutdown()
+
+    asyncio.run(main())
@@ -0,0 +1,83 @@
+import asyncio
+
+import pytest
+from google.genai import types as genai_types
+
+import navigator
+from helpers import out_and_back_route, point
+
+
+def _session(monkeypatch, reply, **fields):
+    """A session whose model answers every request with `reply(contents)`."""
+    async def generate_content(*, model, contents, config=None):
+        return genai_types.GenerateContentResponse(candidates=[genai_types.Candidate(
+            content=genai_types.Content(role="model", parts=reply(contents)))])
+
+    monkeypatch.setattr(navigator.prompt_cache, "enabled", False)
+    state = navigator.SessionState("test", **fields)
+    monkeypatch.setattr(state.chat_manager.client.aio.models, "generate_content", generate_content)
+    return state
+
+
+def test_hop_limit_answers_the_pending_function_calls(monkeypatch):
+    def always_call(contents):
+        return [genai_types.Part(function_call=genai_types.FunctionCall(name="get_current_location", args={}))]
+
+    state = _session(monkeypatch, always_call)
+    _, text = asyncio.run(navigator.ask_llm(state, "Where am I?"))
+    assert "too many steps" in text
+
+    history = state.chat.get_history()
+    for call, answer in zip(history, history[1:]):
+        if any(p.function_call for p in call.parts or []):
+            assert answer.role == "user" and all(p.function_response for p in answer.parts)
+    assert history[-1].role == "model" and history[-1].parts[0].text == text
+
+
+def _navigating(monkeypatch, reply):
+    state = _session(monkeypatch, reply)
+    state.status = "Navigating"
+    navigator.install_route(state, out_and_back_route())
+    lat, lng = point(0, 50)
+    navigator.set_current_location(state, {"lat": lat, "lng": lng})
+
+    async def no_map(session_state, location_coords):
+        return None
+    monkeypatch.setattr(navigator, "get_static_map_image", no_map)
+    return state
+
+
+def test_fast_path_answer_is_kept_in_the_chat_history(monkeypatch):
+    state = _navigating(monkeypatch, lambda contents: pytest.fail("the model was asked"))
+    response = asyncio.run(navigator.chatbot_conversation(state, "What's next?"))
+    user, model = state.chat.get_history()[-2:]
+    assert user.parts[0].text == "What's next?"
+    assert model.role == "model" and model.parts[0].text == response.response_text
+
+
+def test_turns_with_camera_frames_go_to_the_model(monkeypatch):
+    seen = []
+
+    def look(contents):
+        seen.append(sum(1 for p in contents[-1].parts if p.inline_data))
+        return [genai_types.Part(text="A bicycle is parked ahead on your left.")]
+
+    state = _navigating(monkeypatch, look)
+    response = asyncio.run(navigator.chatbot_conversation(state, "What's next?", images=[b"frame"]))
+    assert seen == [1]
+    assert response.response_text == "A bicycle is parked ahead on your left."
+
+
+@pytest.mark.parametrize("dump", [False, True])
+def test_map_overview_is_dumped_only_for_sessions_that_opt_in(monkeypatch, dump):
+    state = _session(monkeypatch, lambda contents: [genai_types.Part(text="You are on Main Street.")],
+                     dump_map_image=dump)
+    state.current_loc = {"lat": 25.0, "lng": 121.5}
+    written = []
+
+    async def map_image(session_state, location_coords):
+        return b"map"
+    monkeypatch.setattr(navigator, "get_static_map_image", map_image)
+    monkeypatch.setattr(navigator, "_write_debug_map_image", lambda path, data: written.append(path))
+    asyncio.run(navigator.chatbot_conversation(state, "Where am I?"))
+    assert written == (["map_image_test.jpg"] if dump else [])
@@ -0,0 +1,59 @@
+import asyncio
+from types import SimpleNamespace
+
+import pytest
+from google.genai import errors as genai_errors
+from google.genai import types as genai_types
+
+import navigator
+from prompt_cache import PromptCache
+
+
+class _Caches:
+    def __init__(self):
+        self.release = asyncio.Event()
+        self.created = 0
+
+    async def create(self, model, config):
+        await self.release.wait()
+        self.created += 1
+        return SimpleNamespace(name=f"cachedContents/{self.created}")
+
+
+def _client():
+    return SimpleNamespace(aio=SimpleNamespace(caches=_Caches()))
+
+
+INLINE = genai_types.GenerateContentConfig(system_instruction="You are a guide.", temperature=0.2)
+
+
+def test_cancelled_session_does_not_cancel_other_sessions_waiting_on_creation():
+    async def main():
+        cache, client = PromptCache("model"), _client()
+        leader = asyncio.create_task(cache.config_for(client, "key", "idle", INLINE))
+        await asyncio.sleep(0)
+        waiter = asyncio.create_task(cache.config_for(client, "key", "idle", INLINE))
+        await asyncio.sleep(0)
+        leader.cancel()  # its client disconnected mid-turn
+        await asyncio.sleep(0)
+        client.aio.caches.release.set()
+        config = await waiter
+        assert config.cached_content == "cachedContents/1"
+        assert client.aio.caches.created == 1
+        assert (await cache.config_for(client, "key", "idle", INLINE)).cached_content == "cachedContents/1"
+        assert cache.stats["creates"] == 1 and cache.stats["hits"] == 1
+
+    asyncio.run(main())
+
+
+@pytest.mark.parametrize("code, message, rejected", [
+    (403, "CachedContent not found (or permission denied)", True),
+    (400, "Cached content has expired.", True),
+    (404, "cached_content cachedContents/abc is not found", True),
+    (400, "Unable to process input image. Please retry or report in https://developers.generativeai.google/guide/troubleshooting", False),
+    (400, "Please ensure that function call turn comes immediately after a user turn or after a function response turn.", False),
+    (500, "An internal error has occurred while reading cached content.", False),
+])
+def test_only_errors_about_the_cached_content_drop_the_handle(code, message, rejected):
+    error = genai_errors.APIError(code, {"error": {"code": code, "message": message}})
+    assert navigator._cache_rejected(error) is rejected
@@ -0,0 +1,36 @@
+import random
+
+import navigator
+import push_guidance
+from helpers import out_and_back_route, point, walk
+
+
+def _session(route):
+    state = navigator.SessionState("test")
+    state.status = "Navigating"
+    navigator.install_route(state, route)
+    state.prefers_zh = False
+    return state
+
+
+def test_arrival_only_at_the_end_of_an_out_and_back_route():
+    for seed in range(20):
+        state = _session(out_and_back_route())
+        arrivals = []
+        for t, (true_along, (lat, lng)) in enumerate(walk(state.compiled_route, random.Random(seed))):
+            navigator.set_current_location(state, {"lat": lat, "lng": lng})
+            text = push_guidance.on_location(state, now=float(t))
+            if text and "arrived" in text:
+                arrivals.append(true_along)
+        assert len(arrivals) == 1, seed
+        assert arrivals[0] > state.compiled_route.total_length - 20, seed
+
+
+def test_no_arrival_when_the_fix_is_far_from_the_end():
+    state = _session(out_and_back_route())
+    lat, lng = point(0, 100)  # halfway out, 100 m from the end
+    navigator.set_current_location(state, {"lat": lat, "lng": lng})
+    # A tracker that wrongly believes the walk is over
+    state.current_step = dict(state.current_step, is_last_step=True, distance_to_next_maneuver_meters=3.0)
+    text = push_guidance.on_location(state, now=0.0)
+    assert not (text and "arrived" in text)
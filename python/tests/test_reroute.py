@@ -0,0 +1,49 @@
+import asyncio
+
+import navigator
+import push_guidance
+import reroute
+from helpers import out_and_back_route, point
+
+
+def test_ending_navigation_cancels_a_pending_reroute(monkeypatch):
+    fetches = []
+
+    async def fetch_route(session_state, origin, destination, mode):
+        fetches.append("started")
+        try:
+            await asyncio.Event().wait()
+        except asyncio.CancelledError:
+            fetches.append("cancelled")
+            raise
+    monkeypatch.setattr(navigator, "fetch_route", fetch_route)
+
+    async def main():
+        state = navigator.SessionState("test")
+        state.status, state.route_destination = "Navigating", "24.99,121.5"
+        navigator.install_route(state, out_and_back_route())
+        lat, lng = point(100, 100)  # well off the route
+        navigator.set_current_location(state, {"lat": lat, "lng": lng})
+        push_guidance.on_location(state, now=0.0)
+        for now in (0.0, 5.0, 10.0):
+            reroute.on_location(state, now=now)
+        assert state.reroute_state.in_flight() and state.push_state is not None
+        task = state.reroute_state.task
+        await asyncio.sleep(0)
+
+        await navigator.end_navigation(state)
+        assert state.reroute_state is None and state.push_state is None
+        await asyncio.gather(task, return_exceptions=True)
+        assert task.cancelled()
+        assert fetches == ["started", "cancelled"]
+        assert state.status == "Idle" and state.current_route is None
+
+        # A new navigation starts fresh, not as a replaced route with a maneuver to announce
+        state.status = "Navigating"
+        navigator.install_route(state, out_and_back_route())
+        lat, lng = point(0, 1)
+        navigator.set_current_location(state, {"lat": lat, "lng": lng})
+        navigator.update_route_progress(state)
+        assert push_guidance.on_location(state, now=20.0) is None
+
+    asyncio.run(main())
@@ -0,0 +1,45 @@
+import asyncio
+
+import deviation
+import route_cache
+from helpers import out_and_back_route, point
+
+
+def _cache():
+    # Cells large enough that both origins below share one
+    return route_cache.RouteCache(cell_meters=1000)
+
+
+def test_exact_hit_is_trimmed_to_the_origin():
+    async def main():
+        cache, calls = _cache(), []
+
+        async def fetch():
+            calls.append(1)
+            return out_and_back_route()
+        destination = point(8, 0)
+        await cache.get_or_compute(point(0, 0), destination, "WALK", fetch)
+        route = await cache.get_or_compute(point(0, 40), destination, "WALK", fetch)
+        assert len(calls) == 1 and cache.routes.stats["hits"] == 1
+        path = deviation.decode_google_polyline(route["polyline"]["encodedPolyline"])
+        assert deviation.haversine_distance(*path[0], *point(0, 40)) < 1
+        assert abs(deviation.path_length_meters(path) - (408 - 40)) < 2
+
+    asyncio.run(main())
+
+
+def test_callers_get_their_own_routes():
+    async def main():
+        cache = _cache()
+
+        async def fetch():
+            return out_and_back_route()
+        destination = point(8, 0)
+        first = await cache.get_or_compute(point(0, 0), destination, "WALK", fetch)
+        first["legs"][0]["steps"].clear()
+        for origin in (point(0, 0), point(0, 40)):
+            route = await cache.get_or_compute(origin, destination, "WALK", fetch)
+            assert len(route["legs"][0]["steps"]) == 2
+            route["legs"][0]["steps"].clear()
+
+    asyncio.run(main())
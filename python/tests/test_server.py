@@ -0,0 +1,61 @@
+import asyncio
+
+import pytest
+
+import gemini_chat_pb2
+import server
+from navigator import NavResponse
+
+
+@pytest.fixture
+def servicer(monkeypatch):
+    monkeypatch.setattr(server.location_filter, "ingest",
+                        lambda state, lat, lng, heading, **kwargs: {"lat": lat, "lng": lng})
+    monkeypatch.setattr(server.navigator, "set_current_location", lambda state, fix: None)
+    monkeypatch.setattr(server.reroute, "on_location", lambda state: None)
+    monkeypatch.setattr(server.push_guidance, "on_location", lambda state: "Turn left in 10 meters.")
+
+    async def converse(session_state, user_input, images, audio=None, stream=None):
+        text = f"You said {user_input}, loud and clear. Anything else?"
+        if stream:
+            stream.start_response()
+            stream.feed(text)
+        return NavResponse(response_text=text, alerts=[])
+    monkeypatch.setattr(server, "converse", converse)
+    return server.GeminiChatServicer()
+
+
+def _exchange(servicer, **fields):
+    async def main():
+        created = await servicer.CreateSession(gemini_chat_pb2.CreateSessionRequest(), None)
+        request = gemini_chat_pb2.ChatRequest(session_id=created.session_id, **fields)
+        request.location.lat, request.location.lng = 25.0, 121.5
+
+        async def requests():
+            yield request
+        return [(r.nav.nav_description, r.nav.is_final) async for r in servicer.ChatStream(requests(), None)]
+    return asyncio.run(main())
+
+
+def test_push_is_not_final_when_a_turn_follows(servicer):
+    responses = _exchange(servicer, text="hello")
+    assert responses[0] == ("Turn left in 10 meters.", False)
+    assert responses[-1][1] and [final for _, final in responses].count(True) == 1
+
+
+def test_push_alone_is_final(servicer):
+    assert _exchange(servicer) == [("Turn left in 10 meters.", True)]
+
+
+def test_malformed_audio_gets_a_final_reply_after_the_push(servicer):
+    responses = _exchange(servicer, audio=gemini_chat_pb2.AudioInput(format="wav", data=b"RIFF\x00\x00\x00\x00WAVEjunk"))
+    assert responses == [("Turn left in 10 meters.", False), ("Please repeat your request.", True)]
+
+
+def test_answers_are_streamed_only_when_enabled(servicer, monkeypatch):
+    push = ("Turn left in 10 meters.", False)
+    assert not server.streaming.STREAM_RESPONSES  # clients without is_final support speak every response
+    assert _exchange(servicer, text="hello") == [push, ("You said hello, loud and clear. Anything else?", True)]
+
+    monkeypatch.setattr(server.streaming, "STREAM_RESPONSES", True)
+    assert _exchange(servicer, text="hello") == [push, ("You said hello, loud and clear.", False), ("Anything else?", True)]
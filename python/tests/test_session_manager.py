@@ -0,0 +1,13 @@
+from session_manager import SessionManager
+
+
+def test_session_in_use_is_not_evicted():
+    manager = SessionManager(idle_ttl=0, max_sessions=1)
+    busy = manager.create("busy")
+    with manager.in_use(busy):
+        manager.create("other")  # over the cap: only the idle one may go
+        assert "busy" in manager and "other" not in manager
+        assert manager.sweep() == 0
+        assert manager.get("busy") is busy and busy.chat_manager is not None
+    assert manager.sweep() == 1
+    assert "busy" not in manager and busy.requests_in_flight == 0
@@ -0,0 +1,210 @@
+import asyncio
+import json
+import random
+
+import pytest
+from google.genai import types as genai_types
+
+import gemini_chat_pb2
+import history as history_module
+import navigator
+import reroute
+import server
+import session_store
+from session_manager import SessionManager
+from helpers import out_and_back_route, point, walk
+
+
+def _navigating_session():
+    state = navigator.SessionState("walker", maps_api_key="maps-key", dump_map_image=True)
+    state.status = "Navigating"
+    state.route_destination, state.prefers_zh = "25.0,121.5", False
+    navigator.install_route(state, out_and_back_route())
+    for _, (_, (lat, lng)) in zip(range(60), walk(state.compiled_route, random.Random(0))):
+        navigator.set_current_location(state, {"lat": lat, "lng": lng})
+        navigator.update_route_progress(state)
+    chat = state.chat_manager.create_navigation_chat_for_session(state.current_route)
+    state.chat = state.chat_manager.recreate_chat(chat.get_history() + [
+        genai_types.Content(role="user", parts=[
+            genai_types.Part(text="What is in front of me?"),
+            genai_types.Part(inline_data=genai_types.Blob(mime_type="image/jpeg", data=b"\xff\xd8frame"))]),
+        genai_types.Content(role="model", parts=[genai_types.Part(
+            function_call=genai_types.FunctionCall(name="get_current_step", args={}))]),
+        genai_types.Content(role="user", parts=[genai_types.Part(
+            function_response=genai_types.FunctionResponse(name="get_current_step", response={"step": 1}))]),
+        genai_types.Content(role="model", parts=[genai_types.Part(text="A crosswalk, 10 meters ahead.")]),
+    ])
+    return state
+
+
+def test_round_trip_keeps_route_progress_and_history():
+    state = _navigating_session()
+    data = json.loads(json.dumps(session_store.serialize_session(state)))  # what a store holds
+    loaded = session_store.deserialize_session(data)
+
+    for name in ("session_id", "status", "current_route", "current_step", "current_loc", "route_destination",
+                 "route_mode", "prefers_zh", "maps_api_key", "dump_map_image"):
+        assert getattr(loaded, name) == getattr(state, name), name
+    for name in ("last_segment", "distance_along_route"):
+        assert getattr(loaded.progress_tracker, name) == getattr(state.progress_tracker, name), name
+    assert loaded.progress_tracker.distance_along_route > 0
+    manager = loaded.chat_manager
+    assert manager.mode == "navigation" and manager.config is navigator.NAVIGATION_CHAT_CONFIG
+    assert manager.route_preamble == state.chat_manager.route_preamble
+
+    history = loaded.chat.get_history()
+    assert navigator.is_route_preamble(history[0]) and sum(map(navigator.is_route_preamble, history)) == 1
+    # Camera frames are not stored, the rest of the conversation is
+    expected = [history_module.strip_blobs(c) or c for c in state.chat.get_history()]
+    assert [c.model_dump(exclude_none=True) for c in history] == [c.model_dump(exclude_none=True) for c in expected]
+    assert history[2].parts[1].text == "[image omitted]"
+
+
+def test_idle_session_keeps_the_idle_chat():
+    state = navigator.SessionState("walker")
+    state.chat = state.chat_manager.recreate_chat([
+        genai_types.Content(role="user", parts=[genai_types.Part(text="Hello")]),
+        genai_types.Content(role="model", parts=[genai_types.Part(text="Where would you like to go?")])])
+    loaded = session_store.deserialize_session(json.loads(json.dumps(session_store.serialize_session(state))))
+    manager = loaded.chat_manager
+    assert manager.mode == "idle" and manager.config is navigator.IDLE_CHAT_CONFIG and manager.route_preamble == []
+    assert [c.parts[0].text for c in loaded.chat.get_history()] == ["Hello", "Where would you like to go?"]
+
+
+@pytest.mark.parametrize("backend", ["memory", "sqlite"])
+def test_another_replica_picks_up_the_session(backend, tmp_path):
+    async def main():
+        store = session_store.MemoryStore() if backend == "memory" else \
+            session_store.SqliteStore(str(tmp_path / "sessions.db"))
+        home, other = SessionManager(store=store), SessionManager(store=store)
+        state = _navigating_session()
+        home.add(state)
+        await home.persist(state)
+
+        loaded = await other.fetch("walker")
+        assert loaded is not None and loaded is not state
+        assert loaded.progress_tracker.last_segment == state.progress_tracker.last_segment
+        assert len(loaded.chat.get_history()) == len(state.chat.get_history())
+        assert await other.fetch("walker") is loaded  # same version: the local copy is kept
+        await store.close()
+
+    asyncio.run(main())
+
+
+def test_reported_saves_spare_the_version_check(monkeypatch):
+    async def main():
+        store = session_store.MemoryStore()
+        checks = []
+        version = store.version
+
+        async def counted_version(session_id):
+            checks.append(session_id)
+            return await version(session_id)
+        monkeypatch.setattr(store, "version", counted_version)
+        home, other = SessionManager(store=store), SessionManager(store=store)
+        state = _navigating_session()
+        home.add(state)
+        await home.persist(state)
+
+        assert await home.fetch("walker") is state and checks == []  # this copy is the last save
+        loaded = await other.fetch("walker")
+        assert await other.fetch("walker") is loaded and checks == ["walker", "walker"]
+        assert await other.fetch("walker") is loaded and len(checks) == 2  # confirmed once, then trusted
+
+        await other.persist(loaded)
+        assert await other.fetch("walker") is loaded and len(checks) == 2
+        reloaded = await home.fetch("walker")  # told about the other replica's save
+        assert reloaded is not state and len(checks) == 3
+        assert await home.fetch("walker") is reloaded and len(checks) == 3
+        assert home.stats["store_checks_skipped"] == 2 and other.stats["store_checks_skipped"] == 2
+
+    asyncio.run(main())
+
+
+def test_redis_save_reports_come_from_pubsub():
+    events = []
+
+    class FakePubSub:
+        async def subscribe(self, channel):
+            events.append(("subscribe", channel))
+
+        async def listen(self):
+            yield {"type": "subscribe", "channel": b"session:saved", "data": 1}
+            events.append(("watching", store.watching))
+            yield {"type": "message", "channel": b"session:saved", "data": b"3 walker"}
+            raise ConnectionError("connection lost")
+
+        async def aclose(self):
+            events.append(("closed", store.watching))
+
+    async def main():
+        store.redis.pubsub = FakePubSub
+        store.watch(lambda session_id, version: events.append(("saved", session_id, version)),
+                    lambda: events.append(("gap",)))
+        store._listen_soon()
+        await store._listener
+
+    store = session_store.RedisStore("redis://localhost:1/0")  # never connects
+    asyncio.run(main())
+    assert events == [("subscribe", "session:saved"), ("gap",), ("watching", True), ("saved", "walker", 3),
+                      ("gap",), ("closed", False)]
+
+
+def _shared_store(monkeypatch):
+    store = session_store.MemoryStore()
+    monkeypatch.setattr(server.session_manager, "store", store)
+    return store
+
+
+def test_fixes_that_move_the_tracker_are_saved(monkeypatch):
+    store = _shared_store(monkeypatch)
+    monkeypatch.setattr(server.location_filter, "ingest",
+                        lambda state, lat, lng, heading, **kwargs: {"lat": lat, "lng": lng, "heading": heading})
+
+    async def main():
+        state = _navigating_session()
+        server.session_manager.add(state)
+        await server.session_manager.persist(state)
+        servicer = server.GeminiChatServicer()
+
+        async def send(north, east):
+            request = gemini_chat_pb2.ChatRequest(session_id="walker")
+            request.location.lat, request.location.lng = point(north, east)
+
+            async def requests():
+                yield request
+            return [r async for r in servicer.ChatStream(requests(), None)]
+
+        along = state.progress_tracker.distance_along_route
+        saved = await store.version("walker")
+        await send(0, along)  # where the tracker already is
+        assert await store.version("walker") == saved
+        await send(0, along + 30)
+        assert await store.version("walker") == saved + 1
+        _, data = await store.load("walker")
+        assert data["tracker"]["distance_along_route"] == state.progress_tracker.distance_along_route
+        server.session_manager.close("walker")
+
+    asyncio.run(main())
+
+
+def test_reroute_saves_the_new_route(monkeypatch):
+    store = _shared_store(monkeypatch)
+    new_route = out_and_back_route(leg_meters=150)
+
+    async def fetch_route(session_state, origin, destination, mode):
+        return new_route
+    monkeypatch.setattr(navigator, "fetch_route", fetch_route)
+
+    async def main():
+        state = _navigating_session()
+        server.session_manager.add(state)
+        await server.session_manager.persist(state)
+        saved = await store.version("walker")
+        await reroute._reroute(state, reroute.RerouteState(), state.current_route, "24.99,121.5", "25.0,121.5", "WALK")
+        assert state.current_route is new_route
+        version, data = await store.load("walker")
+        assert version == saved + 1 and data["current_route"] == new_route
+        server.session_manager.close("walker")
+
+    asyncio.run(main())
@@ -0,0 +1,27 @@
+import io
+
+from PIL import Image
+
+import static_maps
+
+
+def _blank_tile(size=600):
+    out = io.BytesIO()
+    Image.new("RGB", (size, size), "white").save(out, format="JPEG")
+    return out.getvalue()
+
+
+def _is_red(pixel):
+    r, g, b = pixel
+    return r > 180 and g < 80 and b < 80
+
+
+def test_marker_is_drawn_at_the_user_not_the_tile_center():
+    lat, lng = 25.03361, 121.56472
+    center_lat, center_lng = lat + 0.0002, lng - 0.0002  # a tile centered ~25 m away
+    image = Image.open(io.BytesIO(static_maps.draw_user_marker(_blank_tile(), lat, lng, center_lat, center_lng)))
+    x, y = static_maps._world_pixel(lat, lng, static_maps.STATIC_MAP_ZOOM)
+    cx, cy = static_maps._world_pixel(center_lat, center_lng, static_maps.STATIC_MAP_ZOOM)
+    assert abs(x - cx) + abs(y - cy) > 3 * static_maps.STATIC_MAP_MARKER_RADIUS  # the fix is well off the center
+    assert _is_red(image.getpixel((round(300 + x - cx), round(300 + y - cy))))
+    assert not _is_red(image.getpixel((300, 300)))
@@ -0,0 +1,56 @@
+import asyncio
+
+import streaming
+
+
+def _feed(chunker, pieces):
+    return [chunk for piece in pieces for chunk in chunker.feed(piece)]
+
+
+def test_sentences_are_cut_at_their_end_only():
+    chunker = streaming.SentenceChunker(min_chars=10)
+    pieces = ["Walk 3.5 km no", "rth on Main St", "reet. Then turn", " left! Done"]
+    assert _feed(chunker, pieces) == ["Walk 3.5 km north on Main Street.", "Then turn left!"]
+    assert chunker.flush() == "Done"
+    assert chunker.flush() == ""
+
+
+def test_short_sentences_are_merged_up_to_min_chars():
+    chunker = streaming.SentenceChunker(min_chars=20)
+    assert chunker.feed("Stop. Wait. The light is red. ") == ["Stop. Wait. The light is red."]
+
+
+def test_cjk_sentences():
+    chunker = streaming.SentenceChunker(min_chars=4)
+    assert chunker.feed("前方路口左轉。接著直走一百公尺") == ["前方路口左轉。"]
+    assert chunker.flush() == "接著直走一百公尺"
+
+
+def _drain(stream):
+    async def collect():
+        stream.close()
+        return [chunk async for chunk in stream.chunks()]
+    return asyncio.run(collect())
+
+
+def test_unsent_is_what_the_partial_responses_did_not_say():
+    stream = streaming.TurnStream()
+    for piece in ["You are near 1 Replay ", "Rd. The sidewalk ", "continues ahead."]:
+        stream.feed(piece)
+    final = "You are near 1 Replay Rd. The sidewalk continues ahead."
+    assert stream.unsent(final) == "The sidewalk continues ahead."
+    assert _drain(stream) == ["You are near 1 Replay Rd."]
+
+
+def test_unsent_after_tool_calls_covers_the_last_response():
+    stream = streaming.TurnStream()
+    stream.tool_calls_started()  # nothing said yet: acknowledged
+    stream.feed("Your route is 400 meters long. Say start ")
+    assert stream.unsent("Your route is 400 meters long. Say start when ready.") == "Say start when ready."
+    assert _drain(stream) == [streaming.STREAM_ACK_TEXT, "Your route is 400 meters long."]
+
+
+def test_unsent_is_the_whole_text_when_it_was_replaced():
+    stream = streaming.TurnStream()
+    stream.feed("The path ahead is clear. ")
+    assert stream.unsent("An error occurred: timeout") == "An error occurred: timeout"
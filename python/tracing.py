@@ -0,0 +1,221 @@
+import os
+import time
+import asyncio
+import bisect
+import logging
+import itertools
+import contextvars
+from typing import Any, Dict, Optional
+
+# Spans around the stages of a turn: ASR, image preparation, static map, each
+# model call, each tool and each Maps request. A span records its duration in
+# an in-process histogram (per span name) and, with TRACING=otel, is also
+# exported as an OpenTelemetry span, nested under the turn it belongs to.
+#
+#   with tracing.span("maps.geocode", bytes_in=0) as span:
+#       ...
+#       span.set("bytes_out", len(body))
+#
+# Spans opened inside tracing.turn(...) carry its session_id and turn_id (and
+# any other attributes given to turn()).
+#
+# TRACING selects the mode:
+#   off    span() returns a shared no-op object; nothing is measured (default)
+#   local  histograms only; snapshot() / prometheus_text() to read them
+#   otel   histograms plus OpenTelemetry spans (needs opentelemetry-api; with
+#          opentelemetry-sdk and the OTLP exporter installed a provider is set
+#          up here, exporting to OTEL_EXPORTER_OTLP_ENDPOINT)
+# TRACING_METRICS_PORT, if set, serves prometheus_text() on GET /metrics.
+
+TRACING = os.getenv("TRACING", "off")
+TRACING_SERVICE_NAME = os.getenv("TRACING_SERVICE_NAME", "gemini-nav-server")
+TRACING_METRICS_PORT = int(os.getenv("TRACING_METRICS_PORT", "0"))
+ENABLED = TRACING != "off"
+# Histogram bucket upper bounds in ms; the last bucket is open-ended
+BUCKETS_MS = (1, 2.5, 5, 10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 30000)
+
+_turn_ids = itertools.count(1)
+_turn: contextvars.ContextVar[Optional["_Turn"]] = contextvars.ContextVar("tracing_turn", default=None)
+_histograms: Dict[str, "Histogram"] = {}
+_tracer = None
+
+
+class Histogram:
+    """Fixed-bucket latency histogram (Prometheus style)."""
+
+    def __init__(self):
+        self.counts = [0] * (len(BUCKETS_MS) + 1)
+        self.count = 0
+        self.sum_ms = 0.0
+        self.max_ms = 0.0
+        self.errors = 0
+
+    def observe(self, ms: float, error: bool = False) -> None:
+        self.counts[bisect.bisect_left(BUCKETS_MS, ms)] += 1
+        self.count += 1
+        self.sum_ms += ms
+        self.max_ms = max(self.max_ms, ms)
+        self.errors += error
+
+    def percentile(self, q: float) -> float:
+        """Estimated from the buckets, interpolating linearly inside the one holding the q-th observation."""
+        rank, seen = q * self.count, 0
+        for i, n in enumerate(self.counts):
+            if n and seen + n >= rank:
+                lower = BUCKETS_MS[i - 1] if i else 0.0
+                upper = min(BUCKETS_MS[i], self.max_ms) if i < len(BUCKETS_MS) else self.max_ms
+                return round(max(0.0, lower + (upper - lower) * (rank - seen) / n), 2)
+            seen += n
+        return 0.0
+
+    def summary(self) -> Dict[str, float]:
+        return {"count": self.count, "errors": self.errors, "avg_ms": round(self.sum_ms / max(1, self.count), 2),
+                "p50_ms": self.percentile(0.5), "p95_ms": self.percentile(0.95), "p99_ms": self.percentile(0.99),
+                "max_ms": round(self.max_ms, 2)}
+
+
+class _Turn:
+    def __init__(self, session_id: str, attributes: Dict[str, Any]):
+        self.attributes = {"session_id": session_id, "turn_id": next(_turn_ids), **attributes}
+
+
+class _NoopSpan:
+    def set(self, key: str, value: Any) -> None:
+        pass
+
+    def __enter__(self) -> "_NoopSpan":
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        return False
+
+
+_NOOP = _NoopSpan()
+
+
+class Span:
+    __slots__ = ("name", "attributes", "start", "_otel", "_otel_cm", "_turn", "_token")
+
+    def __init__(self, name: str, attributes: Dict[str, Any], turn: Optional[_Turn] = None):
+        self.name = name
+        self.attributes = attributes
+        self._turn = turn  # set when this span is the turn itself
+        self._otel = self._otel_cm = self._token = None
+
+    def set(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+        if self._otel is not None and value is not None:
+            self._otel.set_attribute(key, value)
+
+    def __enter__(self) -> "Span":
+        if self._turn is not None:
+            self._token = _turn.set(self._turn)
+        if _tracer is not None:
+            self._otel_cm = _tracer.start_as_current_span(
+                self.name, attributes={k: v for k, v in self.attributes.items() if v is not None})
+            self._otel = self._otel_cm.__enter__()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, tb) -> bool:
+        elapsed_ms = (time.perf_counter() - self.start) * 1000
+        histogram = _histograms.get(self.name)
+        if histogram is None:
+            histogram = _histograms[self.name] = Histogram()
+        histogram.observe(elapsed_ms, exc_type is not None and not issubclass(exc_type, asyncio.CancelledError))
+        if self._otel_cm is not None:
+            self._otel_cm.__exit__(exc_type, exc, tb)
+        if self._token is not None:
+            try:
+                _turn.reset(self._token)
+            except ValueError:
+                _turn.set(None)  # an async generator closed from another context
+        return False
+
+
+def span(name: str, **attributes: Any):
+    """A span for one stage; use as a context manager. No-op unless tracing is on."""
+    if not ENABLED:
+        return _NOOP
+    turn = _turn.get()
+    if turn is not None:
+        attributes = {**turn.attributes, **attributes}
+    return Span(name, attributes)
+
+
+def turn(session_id: str, **attributes: Any):
+    """The span of one turn; spans opened inside it carry its session_id and turn_id."""
+    if not ENABLED:
+        return _NOOP
+    current = _Turn(session_id, attributes)
+    return Span("turn", dict(current.attributes), current)
+
+
+def snapshot() -> Dict[str, Dict[str, float]]:
+    return {name: h.summary() for name, h in sorted(_histograms.items())}
+
+
+def prometheus_text() -> str:
+    histograms = sorted(_histograms.items())
+    lines = ["# TYPE span_duration_ms histogram"]
+    for name, h in histograms:
+        cumulative = 0
+        for bound, n in zip(BUCKETS_MS + (float("inf"),), h.counts):
+            cumulative += n
+            le = "+Inf" if bound == float("inf") else f"{bound:g}"
+            lines.append(f'span_duration_ms_bucket{{span="{name}",le="{le}"}} {cumulative}')
+        lines.append(f'span_duration_ms_sum{{span="{name}"}} {h.sum_ms:.3f}')
+        lines.append(f'span_duration_ms_count{{span="{name}"}} {h.count}')
+    lines.append("# TYPE span_errors_total counter")
+    lines.extend(f'span_errors_total{{span="{name}"}} {h.errors}' for name, h in histograms)
+    return "\n".join(lines) + "\n"
+
+
+def _setup_otel():
+    try:
+        from opentelemetry import trace
+    except ImportError:
+        logging.warning("tracing: 'opentelemetry-api' not installed, keeping spans in-process only")
+        return None
+    try:
+        from opentelemetry.sdk.resources import Resource
+        from opentelemetry.sdk.trace import TracerProvider
+        from opentelemetry.sdk.trace.export import BatchSpanProcessor
+        from opentelemetry.exporter.otlp.proto.grpc.trace_exporter import OTLPSpanExporter
+    except ImportError:
+        # Whatever provider the process was started with (opentelemetry-instrument, say)
+        logging.info("tracing: OpenTelemetry SDK or OTLP exporter missing, using the global tracer provider")
+    else:
+        provider = TracerProvider(resource=Resource.create({"service.name": TRACING_SERVICE_NAME}))
+        provider.add_span_processor(BatchSpanProcessor(OTLPSpanExporter()))
+        trace.set_tracer_provider(provider)
+    return trace.get_tracer(TRACING_SERVICE_NAME)
+
+
+async def _serve_metrics(reader: asyncio.StreamReader, writer: asyncio.StreamWriter) -> None:
+    try:
+        request_line = await reader.readline()
+        while (await reader.readline()).strip():
+            pass  # headers
+        if request_line.split(b" ")[1:2] == [b"/metrics"]:
+            body, status = prometheus_text().encode(), "200 OK"
+        else:
+            body, status = b"not found\n", "404 Not Found"
+        writer.write(f"HTTP/1.1 {status}\r\nContent-Type: text/plain; version=0.0.4\r\n"
+                     f"Content-Length: {len(body)}\r\nConnection: close\r\n\r\n".encode() + body)
+        await writer.drain()
+    finally:
+        writer.close()
+
+
+async def start_metrics_server(port: int = TRACING_METRICS_PORT) -> Optional[asyncio.AbstractServer]:
+    """Serves the histograms on GET /metrics; called from server.serve()."""
+    if not ENABLED or not port:
+        return None
+    metrics_server = await asyncio.start_server(_serve_metrics, port=port)
+    logging.info(f"Span histograms on http://0.0.0.0:{port}/metrics")
+    return metrics_server
+
+
+if TRACING == "otel":
+    _tracer = _setup_otel()